@@ -0,0 +1,142 @@
+"""
+Measure latency of metadata requests (stat) on a NCFS while a large
+DATA_REPR file is being read (cat) in another thread.
+
+NCFS methods are called directly, the same way the FUSE layer calls them
+when mounted with --threads, so no FUSE mount is needed. Latencies are
+reported for metadata served from the snapshot (what NCFS does) and for
+metadata requests which have to wait for the netCDF lock, which is what
+a single-threaded mount amounts to. Latencies of stat of data files
+(whose sizes are computed from the snapshot, if they do not depend on
+the data) are reported separately.
+
+Usage (from the top-level directory):
+
+    python -m benchmarks.concurrent_stat --size 256
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import threading
+import time
+import numpy
+import netCDF4 as ncpy
+from fusenetcdf.fusenetcdf import NCFS
+from fusenetcdf.fusenetcdf import ReprCache
+from fusenetcdf.fusenetcdf import VardataAsBinaryFiles
+from fusenetcdf.fusenetcdf import VardataAsFlatTextFiles
+from fusenetcdf.fusenetcdf import AttributesAsTextFiles
+from fusenetcdf.fusenetcdf import DimNamesAsTextFiles
+
+
+STAT_PATHS = ['/', '/field', '/field/units', '/title', '/field/DIMENSIONS',
+              '/field/DATA_REPR', '/field/DATA.bin']
+DATA_PATHS = ['/field/DATA_REPR', '/field/DATA.bin']
+
+
+def create_dataset(path, size_mb):
+    """ Create NetCDF file with a single float64 variable of given size """
+    nrows = max(1, size_mb * 2**20 // (8 * 1024))
+    ds = ncpy.Dataset(path, 'w', format='NETCDF4')
+    ds.createDimension('row', nrows)
+    ds.createDimension('col', 1024)
+    var = ds.createVariable('field', 'f8', ('row', 'col'))
+    var.units = 'K'
+    ds.title = 'concurrent stat benchmark'
+    step = 256
+    for start in range(0, nrows, step):
+        stop = min(start + step, nrows)
+        var[start:stop] = numpy.random.random((stop - start, 1024))
+    ds.close()
+
+
+def cat(ncfs, path, chunk, done):
+    """ Read the whole file sequentially, like cat(1) does """
+    offset = 0
+    while True:
+        data = ncfs.read(path, chunk, offset)
+        if not data:
+            break
+        offset += len(data)
+    done.append(offset)
+
+
+def stat_latencies(ncfs, reader, locked):
+    """ Stat paths in a loop until reader is finished """
+    latencies = dict((path, []) for path in STAT_PATHS)
+    while reader.is_alive():
+        for path in STAT_PATHS:
+            start = time.time()
+            if locked:
+                with ncfs.lock:
+                    ncfs.getattr(path)
+            else:
+                ncfs.getattr(path)
+            latencies[path].append(time.time() - start)
+        # give the reader a chance to run
+        time.sleep(0.001)
+    return latencies
+
+
+def report(name, latencies):
+    ms = numpy.array(latencies) * 1000
+    print('{:<24} n={:<6d} p50={:8.3f}ms p90={:8.3f}ms '
+          'p99={:8.3f}ms max={:8.3f}ms'.format(
+              name, len(ms), numpy.percentile(ms, 50),
+              numpy.percentile(ms, 90), numpy.percentile(ms, 99), ms.max()))
+
+
+def run(ncpath, repr_name, chunk, locked):
+    ds = ncpy.Dataset(ncpath, 'r+')
+    if repr_name == 'binary':
+        vardata_repr = VardataAsBinaryFiles(cache=ReprCache())
+    else:
+        vardata_repr = VardataAsFlatTextFiles(fmt='%+24.15e')
+    ncfs = NCFS(ds, vardata_repr, AttributesAsTextFiles(),
+                DimNamesAsTextFiles(), data_reprs=[
+                    ('DATA.bin', VardataAsBinaryFiles(cache=ReprCache()))])
+    done = []
+    reader = threading.Thread(
+            target=cat, args=(ncfs, '/field/DATA_REPR', chunk, done))
+    start = time.time()
+    reader.start()
+    latencies = stat_latencies(ncfs, reader, locked)
+    reader.join()
+    elapsed = time.time() - start
+    ds.close()
+    return latencies, done[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=256, metavar='MB',
+                        help='size of the variable (default: %(default)s)')
+    parser.add_argument('--chunk', type=int, default=128 * 1024,
+                        help='read size (default: %(default)s)')
+    parser.add_argument('--repr', choices=['text', 'binary'],
+                        default='text', help='data representation')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ncpath = os.path.join(tmpdir, 'bench.nc')
+        create_dataset(ncpath, args.size)
+        for name, locked in [('snapshot (lock-free)', False),
+                             ('waiting for lock', True)]:
+            latencies, nbytes, elapsed = run(
+                    ncpath, args.repr, args.chunk, locked)
+            report(name, [latency for path in STAT_PATHS
+                          if path not in DATA_PATHS
+                          for latency in latencies[path]])
+            for path in DATA_PATHS:
+                report('  ' + path, latencies[path])
+            print('{:<24} read {:.1f} MB in {:.2f}s'.format(
+                '', nbytes / 2.**20, elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
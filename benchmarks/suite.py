@@ -0,0 +1,310 @@
+"""
+Benchmark the NCFS operations (read, getattr, readdir, write) of every
+data representation plugin on generated NetCDF files.
+
+Files of the given size are created in a temporary directory (NetCDF3
+and/or NetCDF4, the latter optionally chunked and compressed), and NCFS
+methods are called directly, the same way the FUSE layer calls them,
+so no FUSE mount (and no network) is needed. For every file format and
+plugin, throughput and latency percentiles of each operation, and peak
+resident memory, are reported. Each case runs in a fresh process, so
+that peak memory is that of the case, and no case is served from
+caches filled by the previous one.
+
+Operations a plugin does not support (e.g. writes of binary files) are
+reported as such. Results can be saved (--save) and compared with saved
+ones (--compare); the exit status is then 1 if any throughput dropped,
+or any p99 latency grew, by more than the tolerance, or an operation is
+no longer supported. Single measurements (the first getattr) are too
+noisy to be compared, and are only reported.
+
+Usage (from the top-level directory):
+
+    python -m benchmarks.suite --size 64 --formats NETCDF3_CLASSIC,NETCDF4
+    python -m benchmarks.suite --size 4 --reads 20 --save base.json
+    python -m benchmarks.suite --size 4 --reads 20 --compare base.json
+"""
+
+import os
+import sys
+import json
+import errno
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import multiprocessing
+import threading
+import time
+import numpy
+import netCDF4 as ncpy
+from fuse import FuseOSError
+from fusenetcdf.fusenetcdf import NCFS
+from fusenetcdf.fusenetcdf import ReprCache
+from fusenetcdf.fusenetcdf import VARDATA_FORMATS
+from fusenetcdf.fusenetcdf import vardata_plugins
+from fusenetcdf.fusenetcdf import AttributesAsTextFiles
+from fusenetcdf.fusenetcdf import DimNamesAsTextFiles
+
+
+NTIME = 4
+NCOLS = 512
+
+
+def create_dataset(path, fmt, size_mb, chunk_rows, complevel):
+    """
+    Create NetCDF file with a float32 variable field(time, y, x) of the
+    given size, and coordinate variables
+    """
+    nrows = max(1, size_mb * 2**20 // (4 * NTIME * NCOLS))
+    ds = ncpy.Dataset(path, 'w', format=fmt)
+    ds.title = 'NCFS benchmark'
+    ds.createDimension('time', NTIME)
+    ds.createDimension('y', nrows)
+    ds.createDimension('x', NCOLS)
+    options = {}
+    if fmt.startswith('NETCDF4'):
+        if chunk_rows:
+            options['chunksizes'] = (1, min(chunk_rows, nrows), NCOLS)
+        if complevel:
+            options.update(zlib=True, complevel=complevel)
+    time_var = ds.createVariable('time', 'f8', ('time',))
+    time_var.units = 'days since 2000-01-01'
+    time_var[:] = numpy.arange(NTIME)
+    ds.createVariable('y', 'f8', ('y',))[:] = numpy.linspace(-90, 90, nrows)
+    ds.createVariable('x', 'f8', ('x',))[:] = numpy.linspace(0, 360, NCOLS)
+    var = ds.createVariable('field', 'f4', ('time', 'y', 'x'), **options)
+    var.units = 'K'
+    rng = numpy.random.RandomState(0)
+    step = 256
+    for t in range(NTIME):
+        for start in range(0, nrows, step):
+            stop = min(start + step, nrows)
+            var[t, start:stop] = 250 + 50 * rng.random_sample(
+                    (stop - start, NCOLS))
+    ds.close()
+
+
+def make_ncfs(ncpath, fmt):
+    """ Return NCFS presenting all data representations, as main() does """
+    cache = ReprCache()
+    lock = threading.RLock()
+    vardata_repr, data_reprs = vardata_plugins(
+            list(VARDATA_FORMATS), cache, lock, fmt=fmt)
+    ds = ncpy.Dataset(ncpath, 'r+')
+    return NCFS(ds, vardata_repr, AttributesAsTextFiles(),
+                DimNamesAsTextFiles(), lock=lock, data_reprs=data_reprs)
+
+
+def timed(function, *args):
+    """ Return (result, duration) of a call """
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def summary(latencies, nbytes=None):
+    """ Return statistics of a list of latencies (in seconds) """
+    ms = numpy.array(latencies) * 1000
+    result = dict(n=len(ms), p50=numpy.percentile(ms, 50),
+                  p90=numpy.percentile(ms, 90),
+                  p99=numpy.percentile(ms, 99), max=ms.max())
+    if nbytes is not None:
+        result['mb_s'] = nbytes / 2.**20 / max(sum(latencies), 1e-9)
+    return result
+
+
+def peak_rss_mb():
+    """ Return peak resident memory of this process, in MB """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2.**20 if sys.platform == 'darwin' else 2.**10)
+
+
+def run_case(ncpath, ext, fmt, read_size, nreads):
+    """ Run all operations on the data file of one plugin """
+    results = {}
+    ncfs = make_ncfs(ncpath, fmt)
+    path = '/field/DATA.' + ext
+    # the first getattr builds indexes (or renders) if the plugin has to
+    _, cold = timed(ncfs.getattr, path)
+    results['getattr (first)'] = summary([cold])
+    size = ncfs.getattr(path)['st_size']
+    paths = ['/field/' + name for name in ncfs.readdir('/field')
+             if name not in ('.', '..')]
+    # other data files may have to build indexes too
+    for p in paths:
+        ncfs.getattr(p)
+    results['getattr'] = summary(
+            [timed(ncfs.getattr, p)[1] for _ in range(20) for p in paths])
+    results['readdir'] = summary(
+            [timed(ncfs.readdir, p)[1] for _ in range(20)
+             for p in ('/', '/field')])
+    # sequential read of the whole file, like cat(1)
+    latencies = []
+    offset = 0
+    while offset < size:
+        data, duration = timed(ncfs.read, path, read_size, offset)
+        if not data:
+            break
+        latencies.append(duration)
+        offset += len(data)
+    results['read (sequential)'] = summary(latencies, offset)
+    # random reads of a fresh NCFS, i.e. with cold caches
+    ncfs.close()
+    ncfs = make_ncfs(ncpath, fmt)
+    ncfs.getattr(path)
+    rng = random.Random(0)
+    latencies = []
+    nbytes = 0
+    for _ in range(nreads):
+        offset = rng.randrange(max(size - read_size, 1))
+        data, duration = timed(ncfs.read, path, read_size, offset)
+        latencies.append(duration)
+        nbytes += len(data)
+    results['read (random)'] = summary(latencies, nbytes)
+    # rewrite the first read_size bytes of a coordinate variable's data
+    coord = '/y/DATA.' + ext
+    latencies = []
+    for _ in range(5):
+        data = ncfs.read(coord, read_size, 0)
+        # text representations are str, binary ones bytes or memoryview
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        start = time.time()
+        try:
+            fh = ncfs.open(coord, os.O_WRONLY)
+            ncfs.write(coord, data, 0, fh)
+            ncfs.release(coord, fh)
+        except FuseOSError as e:
+            if e.errno != errno.EACCES:
+                raise
+            # representation cannot be written
+            results['write'] = dict(unsupported=errno.errorcode[e.errno])
+            break
+        latencies.append(time.time() - start)
+    if latencies:
+        results['write'] = summary(latencies, 5 * len(data))
+    ncfs.close()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def in_subprocess(function, *args):
+    """ Return result of function called in a new process """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(fmt, ext, results):
+    for op in ('getattr (first)', 'getattr', 'readdir', 'read (sequential)',
+               'read (random)', 'write'):
+        if op not in results:
+            continue
+        r = results[op]
+        if 'unsupported' in r:
+            print('{:<22} {:<5} {:<18} not supported ({})'.format(
+                fmt, ext, op, r['unsupported']))
+            continue
+        throughput = ('{:9.1f}MB/s'.format(r['mb_s'])
+                      if 'mb_s' in r else ' ' * 13)
+        print('{:<22} {:<5} {:<18} n={:<6d} {} p50={:9.3f}ms '
+              'p90={:9.3f}ms p99={:9.3f}ms max={:9.3f}ms'.format(
+                  fmt, ext, op, r['n'], throughput, r['p50'], r['p90'],
+                  r['p99'], r['max']))
+    print('{:<22} {:<5} {:<18} {:.1f} MB'.format(
+        fmt, ext, 'peak RSS', results['peak_rss_mb']))
+
+
+def regressions(results, baseline, tolerance):
+    """ Return list of descriptions of results worse than baseline's """
+    found = []
+    for case, ops in results.items():
+        for op, r in ops.items():
+            old = baseline.get(case, {}).get(op, None)
+            if not isinstance(r, dict) or old is None:
+                continue
+            if 'unsupported' in r or 'unsupported' in old:
+                if 'unsupported' in r and 'unsupported' not in old:
+                    found.append('{} {}: not supported ({})'.format(
+                        case, op, r['unsupported']))
+                continue
+            if r['n'] < 2 or old['n'] < 2:
+                # a single sample says little about percentiles
+                continue
+            if 'mb_s' in r and r['mb_s'] < old['mb_s'] * (1 - tolerance):
+                found.append('{} {}: {:.1f} MB/s (was {:.1f} MB/s)'.format(
+                    case, op, r['mb_s'], old['mb_s']))
+            if r['p99'] > old['p99'] * (1 + tolerance):
+                found.append('{} {}: p99 {:.3f}ms (was {:.3f}ms)'.format(
+                    case, op, r['p99'], old['p99']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=64, metavar='MB',
+                        help='size of the variable (default: %(default)s)')
+    parser.add_argument('--formats', default='NETCDF3_64BIT_OFFSET,NETCDF4',
+                        help='comma separated NetCDF file formats '
+                             '(default: %(default)s)')
+    parser.add_argument('--chunk-rows', type=int, default=64,
+                        help='rows per chunk of NetCDF4 files, 0 for '
+                             'contiguous storage (default: %(default)s)')
+    parser.add_argument('--complevel', type=int, default=0,
+                        help='zlib compression level of NetCDF4 files '
+                             '(default: %(default)s)')
+    parser.add_argument('--data-files', default=','.join(VARDATA_FORMATS),
+                        help='representations to benchmark '
+                             '(default: %(default)s)')
+    parser.add_argument('--format', dest='data_format', default='%f',
+                        help='format of text representations '
+                             '(default: %(default)s)')
+    parser.add_argument('--read-size', type=int, default=128 * 1024,
+                        help='bytes per read (default: %(default)s)')
+    parser.add_argument('--reads', type=int, default=100,
+                        help='number of random reads (default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare results with ones saved in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='relative slowdown reported as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for fmt in args.formats.split(','):
+            ncpath = os.path.join(tmpdir, fmt + '.nc')
+            create_dataset(ncpath, fmt, args.size, args.chunk_rows,
+                           args.complevel)
+            for ext in args.data_files.split(','):
+                case = in_subprocess(run_case, ncpath, ext, args.data_format,
+                                     args.read_size, args.reads)
+                report(fmt, ext, case)
+                results['{} {}'.format(fmt, ext)] = case
+    finally:
+        shutil.rmtree(tmpdir)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print('REGRESSION ' + line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
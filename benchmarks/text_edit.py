@@ -0,0 +1,104 @@
+"""
+Measure the time it takes to change a single value of a large
+coordinate variable through its text DATA_REPR file.
+
+Two ways of committing the edit are compared: re-parsing the whole
+edited representation (what a write which replaces the whole file
+does), and patching only the lines touched by the write (what a
+partial write, e.g. one made by dd conv=notrunc, does).
+
+Usage (from the top-level directory):
+
+    python -m benchmarks.text_edit --size 10000000
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import time
+import numpy
+import netCDF4 as ncpy
+from fusenetcdf.fusenetcdf import NCFS
+from fusenetcdf.fusenetcdf import VardataAsFlatTextFiles
+from fusenetcdf.fusenetcdf import AttributesAsTextFiles
+from fusenetcdf.fusenetcdf import DimNamesAsTextFiles
+from fusenetcdf.fusenetcdf import write_to_string
+
+
+PATH = '/x/DATA_REPR'
+
+
+def create_dataset(path, size):
+    """ Create NetCDF file with a single coordinate variable """
+    ds = ncpy.Dataset(path, 'w', format='NETCDF4')
+    ds.createDimension('x', size)
+    var = ds.createVariable('x', 'f8', ('x',))
+    step = 2**20
+    for start in range(0, size, step):
+        stop = min(start + step, size)
+        var[start:stop] = numpy.arange(start, stop) * 0.5
+    ds.close()
+
+
+def edit_whole_file(ncfs, offset, text):
+    """ Render, edit and parse the whole representation """
+    var = ncfs.get_variable(PATH)
+    data = ncfs.vardata_repr(var)
+    data = write_to_string(data, text, offset)
+    ncfs.vardata_repr.update(var, data.encode('utf-8'))
+
+
+def edit_in_place(ncfs, offset, text):
+    """ Write a line through a file handle, as a user would """
+    fh = ncfs.open(PATH, os.O_WRONLY)
+    ncfs.write(PATH, text, offset, fh)
+    ncfs.release(PATH, fh)
+
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=10**7,
+                        help='number of elements (default: %(default)s)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ncpath = os.path.join(tmpdir, 'bench.nc')
+        create_dataset(ncpath, args.size)
+        ds = ncpy.Dataset(ncpath, 'r+')
+        ncfs = NCFS(ds, VardataAsFlatTextFiles(), AttributesAsTextFiles(),
+                    DimNamesAsTextFiles())
+        # change the leading digit of the element in the middle,
+        # so that the length of the line stays the same
+        element = args.size // 2
+        text = ncfs.read(PATH, args.size * 32, 0)
+        offset = len('\n'.join(text.split('\n', element)[:element])) + 1
+        line = text[offset:text.index('\n', offset)]
+        del text
+        print('{:<32} {:8.3f}s'.format(
+            'whole file', timed(edit_whole_file, ncfs, offset,
+                                '1' + line[1:])))
+        # build the index, as reading the file (e.g. by an editor) does
+        ncfs.getattr(PATH)
+        print('{:<32} {:8.3f}s'.format(
+            'patch (index cached)', timed(edit_in_place, ncfs, offset,
+                                          '2' + line[1:])))
+        ncfs.vardata_repr.invalidate(ds['x'])
+        print('{:<32} {:8.3f}s'.format(
+            'patch (index not cached)', timed(edit_in_place, ncfs, offset,
+                                              '3' + line[1:])))
+        assert ds['x'][element] == float('3' + line[1:])
+        ds.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,14 +12,31 @@ Developed during ECMWF Summer of Weather Code (2018).
 import os
 import sys
 import netCDF4 as ncpy
+import cftime
 import re
+import mmap
+import struct
+import tempfile
 import time
 import numpy
 import inspect
 import argparse
+import bisect
 import logging as log
 from fuse import FUSE, FuseOSError, Operations
 import errno
+import glob
+import hashlib
+import io
+import functools
+import itertools
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class InternalError(Exception):
@@ -30,20 +47,122 @@ class NotFoundError(Exception):
     pass
 
 
-def memoize(function):
+class ReprCache(object):
     """
-    Caching decorator; caches return
-    values of the decorated function.
+    Size-bounded LRU cache for (parts of) data representations,
+    shared by all representation plugins.
+
+    Every entry belongs to an owner (usually a NetCDF Variable), so that
+    all entries of a Variable can be dropped at once when it changes.
+    Entries of a VariableSlice are dropped together with its Variable.
+    If data never changes (read-only mounts), owners need not be tracked.
     """
-    memo = {}
 
-    def wrapper(*args):
-        if args in memo:
-            return memo[args]
-        else:
-            rv = function(*args)
-            memo[args] = rv
-            return rv
+    def __init__(self, max_bytes=64 * 2**20, track_owners=True):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # (owner, key) -> (value, size of value in bytes)
+        self._entries = OrderedDict()
+        # owner (Variable of a VariableSlice) -> set of (owner, key)
+        self._owners = {}
+        self._track_owners = track_owners
+        # the cache is shared by threads serving FUSE requests
+        self._lock = threading.Lock()
+
+    def get(self, owner, key, default=None):
+        """ Return cached value and mark it as recently used """
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop((owner, key))
+            except KeyError:
+                return default
+            self._entries[(owner, key)] = (value, nbytes)
+            return value
+
+    def put(self, owner, key, value, nbytes=None):
+        """ Store value, evicting least recently used entries if needed """
+        if nbytes is None:
+            nbytes = getattr(value, 'nbytes', None) or len(value)
+        with self._lock:
+            self._remove(owner, key)
+            if nbytes > self.max_bytes:
+                # would evict everything else and not fit anyway
+                return
+            while self.nbytes + nbytes > self.max_bytes:
+                (lru_owner, lru_key), _ = next(iter(self._entries.items()))
+                self._remove(lru_owner, lru_key)
+            self._entries[(owner, key)] = (value, nbytes)
+            if self._track_owners:
+                self._owners.setdefault(self._group(owner), set()).add(
+                        (owner, key))
+            self.nbytes += nbytes
+
+    @classmethod
+    def _group(cls, owner):
+        """ Return the Variable of a VariableSlice or ScaledVariable """
+        while isinstance(owner, (VariableSlice, ScaledVariable)):
+            owner = owner.variable
+        return owner
+
+    def _remove(self, owner, key):
+        try:
+            _, nbytes = self._entries.pop((owner, key))
+        except KeyError:
+            return
+        self.nbytes -= nbytes
+        if not self._track_owners:
+            return
+        group = self._group(owner)
+        keys = self._owners[group]
+        keys.discard((owner, key))
+        if not keys:
+            del self._owners[group]
+
+    def invalidate(self, owner, keep=()):
+        """
+        Drop all entries belonging to owner's Variable (and to its slices
+        and scaled views), apart from entries of owner with keys in keep
+        """
+        if not self._track_owners:
+            # entries of owner are not known
+            self.clear()
+            return
+        with self._lock:
+            group = self._group(owner)
+            for entry_owner, key in list(self._owners.get(group, ())):
+                if entry_owner == owner and key in keep:
+                    continue
+                self._remove(entry_owner, key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self.nbytes = 0
+
+
+def writable(method):
+    """
+    Decorator for methods modifying the Dataset; they fail
+    with EROFS if the filesystem is mounted read-only.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.read_only:
+            raise FuseOSError(errno.EROFS)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def synchronized(method):
+    """
+    Decorator for methods which must be run holding
+    the instance's lock (self.lock).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
     return wrapper
 
 
@@ -58,6 +177,761 @@ def write_to_string(string, buf, offset):
     return part1 + part2 + part3
 
 
+def flat_slabs(shape, start, stop):
+    """
+    Split range [start, stop) of flat (C-order) element indices of an
+    array of given shape into a sequence of rectangular hyperslabs.
+    Each hyperslab is a tuple of slices, one per dimension.
+    """
+    if start >= stop:
+        return
+    if len(shape) <= 1:
+        yield tuple(slice(start, stop) for _ in shape)
+        return
+    inner = int(numpy.prod(shape[1:]))
+    row0, col0 = divmod(start, inner)
+    row1, col1 = divmod(stop, inner)
+    if row0 == row1:
+        # range lies within a single row
+        for slab in flat_slabs(shape[1:], col0, col1):
+            yield (slice(row0, row0 + 1),) + slab
+        return
+    if col0 > 0:
+        # partial leading row
+        for slab in flat_slabs(shape[1:], col0, inner):
+            yield (slice(row0, row0 + 1),) + slab
+        row0 += 1
+    if row1 > row0:
+        # full rows in the middle
+        yield (slice(row0, row1),) + tuple(slice(None) for _ in shape[1:])
+    if col1 > 0:
+        # partial trailing row
+        for slab in flat_slabs(shape[1:], 0, col1):
+            yield (slice(row1, row1 + 1),) + slab
+
+
+def read_flat(variable, start, stop):
+    """
+    Return elements [start, stop) of Variable's flattened data array,
+    reading only the hyperslabs which cover that range.
+    """
+    if not variable.shape:
+        return numpy.ma.ravel(variable[...])[start:stop]
+    pieces = [variable[slab].ravel()
+              for slab in flat_slabs(variable.shape, start, stop)]
+    return concatenate_flat(pieces, variable.dtype)
+
+
+def write_flat(variable, start, values):
+    """
+    Write values into elements [start, start + len(values)) of
+    Variable's flattened data array, one hyperslab at a time.
+    """
+    if not variable.shape:
+        variable[...] = values[0]
+        return
+    pos = 0
+    for slab in flat_slabs(variable.shape, start, start + len(values)):
+        shape = tuple(len(range(*s.indices(n)))
+                      for s, n in zip(slab, variable.shape))
+        count = int(numpy.prod(shape))
+        variable[slab] = values[pos:pos+count].reshape(shape)
+        pos += count
+
+
+def parse_text(data, dtype):
+    """
+    Parse bytes holding whitespace separated numbers (one per line)
+    into an array of given dtype. Integers are parsed as floats and
+    rounded, so that values formatted as e.g. '1.000000' are accepted.
+    If any number is invalid, the result is empty; callers compare the
+    number of values with the number they expect.
+    """
+    dtype = numpy.dtype(dtype)
+    parse_dtype = dtype if dtype.kind == 'f' else numpy.float64
+    try:
+        values = numpy.array(bytes(data).split(), dtype=parse_dtype)
+    except ValueError:
+        return numpy.array([], dtype=dtype)
+    if dtype.kind in 'iu':
+        values = numpy.rint(values)
+    return values.astype(dtype, copy=False)
+
+
+def parse_fields(fields, dtype):
+    """
+    Parse sequence of (bytes) fields, each holding a single number,
+    into a masked array of given dtype. Empty fields and 'nan' are
+    missing values, and are masked. Raises ValueError if a field is
+    not a number.
+    """
+    dtype = numpy.dtype(dtype)
+    fields = numpy.char.strip(numpy.asarray(fields, dtype=bytes))
+    missing = (fields == b'') | (numpy.char.lower(fields) == b'nan')
+    parse_dtype = dtype if dtype.kind == 'f' else numpy.float64
+    values = numpy.zeros(len(fields), dtype=parse_dtype)
+    values[~missing] = fields[~missing].astype(parse_dtype)
+    if dtype.kind in 'iu':
+        values = numpy.rint(values)
+    return numpy.ma.masked_array(values.astype(dtype), mask=missing)
+
+
+def concatenate_flat(pieces, dtype):
+    """ Join flat (possibly masked) arrays """
+    if not pieces:
+        return numpy.array([], dtype=dtype)
+    if len(pieces) == 1:
+        return pieces[0]
+    masked = [p for p in pieces if isinstance(p, numpy.ma.MaskedArray)]
+    if masked:
+        # numpy.ma.concatenate drops fill_value (e.g. Variable's
+        # _FillValue); netCDF4 only sets it if elements are masked
+        fill_values = [p.fill_value for p in masked if numpy.ma.is_masked(p)]
+        data = numpy.ma.concatenate(pieces)
+        if fill_values:
+            data.fill_value = fill_values[0]
+        return data
+    return numpy.concatenate(pieces)
+
+
+def chunk_shape(variable):
+    """
+    Return shape of HDF5 chunks of Variable (or VariableSlice),
+    or None if its data is not stored in chunks.
+    """
+    try:
+        chunking = variable.chunking()
+    except (AttributeError, RuntimeError):
+        return None
+    if not chunking or chunking == 'contiguous' or not variable.ndim:
+        return None
+    return tuple(chunking[len(chunking)-variable.ndim:])
+
+
+class VariableSlice(object):
+    """
+    Part of a Variable with leading dimensions fixed at given indices
+    (e.g. a single time step), which can be used in place of a Variable
+    by the data representation plugins.
+
+    Variable's metadata (VariableMetadata) can be given, so that its
+    shape and dimensions are not read from the Variable (by libnetcdf).
+    """
+
+    def __init__(self, variable, index, metadata=None):
+        self.variable = variable
+        self.index = tuple(index)
+        if metadata is None:
+            metadata = variable
+        self.dimensions = tuple(metadata.dimensions[len(self.index):])
+        self.shape = tuple(metadata.shape[len(self.index):])
+        self.ndim = len(self.shape)
+        self.size = int(numpy.prod(self.shape))
+        # flat index (within Variable) of the first element of the slice;
+        # as only leading dimensions are fixed, the slice is contiguous
+        self.start = 0
+        if self.index:
+            self.start = self.size * int(numpy.ravel_multi_index(
+                    self.index, metadata.shape[:len(self.index)]))
+
+    def __getitem__(self, key):
+        if key is Ellipsis:
+            key = ()
+        elif not isinstance(key, tuple):
+            key = (key,)
+        return self.variable[self.index + key]
+
+    def __getattr__(self, name):
+        # dtype, name, ncattrs() etc. are those of the Variable
+        return getattr(self.variable, name)
+
+    def __eq__(self, other):
+        return (isinstance(other, VariableSlice) and
+                self.variable == other.variable and
+                self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.variable, self.index))
+
+
+class ScaledVariable(object):
+    """
+    Variable with netCDF4 automatic unpacking (applying scale_factor and
+    add_offset) turned on (scale=True) or off, regardless of how the
+    Variable itself is set up. It can be used in place of a Variable by
+    the data representation plugins; unpacking is switched only for the
+    duration of each read or write, which must be made holding the lock
+    serializing calls to libnetcdf (as all reads and writes are).
+    """
+
+    def __init__(self, variable, scale):
+        self.variable = variable
+        self.scale = scale
+
+    def _call(self, method, *args):
+        scale = getattr(self.variable, 'scale', True)
+        self.variable.set_auto_scale(self.scale)
+        try:
+            return method(*args)
+        finally:
+            self.variable.set_auto_scale(scale)
+
+    def __getitem__(self, key):
+        return self._call(self.variable.__getitem__, key)
+
+    def __setitem__(self, key, value):
+        return self._call(self.variable.__setitem__, key, value)
+
+    def __getattr__(self, name):
+        # dtype, shape, ncattrs() etc. are those of the Variable
+        return getattr(self.variable, name)
+
+    def __eq__(self, other):
+        return (isinstance(other, ScaledVariable) and
+                self.variable == other.variable and
+                self.scale == other.scale)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.variable, self.scale))
+
+
+class VariableMetadata(object):
+    """
+    Metadata of a Variable from a DatasetSnapshot (its VariableInfo),
+    which can be used in place of the Variable by the data representation
+    plugins to compute sizes that do not depend on the data (fixed_size),
+    without entering libnetcdf. It has no data.
+    """
+
+    def __init__(self, name, info):
+        self.name = name.rpartition('/')[2]
+        self.dimensions = info.dimensions
+        self.shape = info.shape
+        self.ndim = len(self.shape)
+        self.size = int(numpy.prod(self.shape))
+        self.dtype = info.dtype
+        self.scale = info.scale
+        self._attrs = info.attrs
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+
+class ChunkPrefetcher(object):
+    """
+    Reads data of chunked Variables in chunk-aligned bands (chunk rows
+    along the first dimension, spanning all other dimensions), so that
+    each chunk is decompressed once, not once per read(2). When reads
+    are sequential, the next band is read ahead in a background thread.
+
+    Bands are kept in the shared ReprCache, so they are invalidated
+    (and bounded) like any other cached representation; so is the last
+    band read of every Variable, used to tell sequential reads. Background
+    reads are made holding lock - the same lock as NCFS uses.
+    """
+
+    # cache key of the last band read, and (roughly) the memory it takes
+    LAST_BAND = ('last band',)
+    LAST_BAND_BYTES = 256
+
+    def __init__(self, cache, lock, max_band_bytes=None, queue_size=2):
+        self._cache = cache
+        self._lock = lock
+        # bands larger than this are not worth caching
+        self._max_band_bytes = max_band_bytes or cache.max_bytes // 8
+        # bounded, so that read-ahead never runs far ahead of readers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def _band_size(self, variable):
+        """ Return number of elements in a band, or None """
+        chunks = chunk_shape(variable)
+        if chunks is None:
+            return None
+        band_size = chunks[0] * int(numpy.prod(variable.shape[1:]))
+        if band_size * data_dtype(variable).itemsize > self._max_band_bytes:
+            return None
+        return band_size
+
+    def _band(self, variable, band, band_size):
+        """ Return (cached) band of Variable's flattened data """
+        key = ('band', band_size, band)
+        data = self._cache.get(variable, key)
+        if data is None:
+            with self._lock:
+                # band may have been read while waiting for the lock
+                data = self._cache.get(variable, key)
+                if data is None:
+                    start = band * band_size
+                    stop = min(start + band_size, variable.size)
+                    data = read_flat(variable, start, stop)
+                    self._cache.put(variable, key, data)
+        return data
+
+    def read_flat(self, variable, start, stop):
+        """ Drop-in replacement for read_flat() """
+        band_size = self._band_size(variable)
+        if band_size is None:
+            return read_flat(variable, start, stop)
+        first = start // band_size
+        last = -(-stop // band_size)
+        pieces = []
+        for band in range(first, last):
+            data = self._band(variable, band, band_size)
+            base = band * band_size
+            pieces.append(data[max(start-base, 0):stop-base])
+        # read ahead only if reads are sequential
+        previous = self._cache.get(variable, self.LAST_BAND, -1)
+        if previous in (first - 1, first, last - 1):
+            if last * band_size < variable.size:
+                self._schedule(variable, last, band_size)
+        self._cache.put(variable, self.LAST_BAND, last - 1,
+                        self.LAST_BAND_BYTES)
+        return concatenate_flat(pieces, variable.dtype)
+
+    def _schedule(self, variable, band, band_size):
+        if self._cache.get(variable, ('band', band_size, band)) is not None:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker)
+            self._thread.daemon = True
+            self._thread.start()
+        try:
+            self._queue.put_nowait((variable, band, band_size))
+        except queue.Full:
+            pass
+
+    def _worker(self):
+        while True:
+            variable, band, band_size = self._queue.get()
+            try:
+                self._band(variable, band, band_size)
+            except Exception as e:
+                # e.g. Variable renamed or deleted in the meantime
+                log.info('prefetching {} failed: {}'.format(variable, e))
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """ Wait until all scheduled bands are read """
+        self._queue.join()
+
+
+def data_dtype(variable):
+    """
+    Return dtype of the data returned by reading a Variable, i.e. after
+    netCDF4 has applied scale_factor and add_offset (if it does so).
+    Only Variable's metadata is used; no data is read.
+    """
+    dtype = numpy.dtype(variable.dtype)
+    if not getattr(variable, 'scale', False) or dtype.kind not in 'iuf':
+        return dtype
+    attrs = variable.ncattrs()
+    # mirror the arithmetic netCDF4 applies to unpack data,
+    # so that numpy type promotion rules give the same result
+    sample = numpy.zeros(1, dtype=dtype)
+    if 'scale_factor' in attrs and 'add_offset' in attrs:
+        scale_factor = variable.getncattr('scale_factor')
+        add_offset = variable.getncattr('add_offset')
+        if add_offset != 0.0 or scale_factor != 1.0:
+            return (sample * scale_factor + add_offset).dtype
+        return numpy.asarray(scale_factor).dtype
+    elif 'scale_factor' in attrs:
+        scale_factor = variable.getncattr('scale_factor')
+        if scale_factor != 1.0:
+            return (sample * scale_factor).dtype
+    elif 'add_offset' in attrs:
+        add_offset = variable.getncattr('add_offset')
+        if add_offset != 0.0:
+            return (sample + add_offset).dtype
+    return dtype
+
+
+def fixed_width(fmt, dtype):
+    """
+    Return width of every element of dtype formatted using fmt,
+    if it is the same for all possible values, otherwise None.
+    This is the case for formats with explicit field width large
+    enough for any value of dtype, e.g. '%+14.6e' or '%6d' for int16.
+    """
+    match = re.match(
+            r'^%([-+ 0#]*)(\d+)?(?:\.(\d+))?([diouxXeEfFgGs])$', fmt)
+    if match is None or match.group(2) is None:
+        return None
+    flags, width, precision, conversion = match.groups()
+    width = int(width)
+    if dtype.kind in 'iu' and conversion in 'di':
+        info = numpy.iinfo(dtype)
+        sign = 1 if ('+' in flags or ' ' in flags) else 0
+        max_width = max(len(str(info.min)), len(str(info.max)) + sign)
+    elif dtype.kind == 'f' and conversion in 'eE' and dtype.itemsize <= 8:
+        precision = 6 if precision is None else int(precision)
+        mantissa = 1
+        if precision > 0 or '#' in flags:
+            mantissa += 1 + precision
+        # exponent has at least two digits; float64 may need three
+        exponent = 2 if dtype.itemsize <= 4 else 3
+        # sign, mantissa, 'e', exponent sign and digits
+        max_width = 1 + mantissa + 2 + exponent
+    else:
+        return None
+    return width if width >= max_width else None
+
+
+# sizes of NetCDF classic format data types, by nc_type
+CLASSIC_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8,
+                      7: 1, 8: 2, 9: 4, 10: 8, 11: 8}
+
+
+def parse_classic_header(buf):
+    """
+    Parse header of a NetCDF classic format (CDF-1, CDF-2 or CDF-5) file.
+    Return dictionary mapping names of non-record variables to the
+    offsets of their data in the file.
+    """
+    version = struct.unpack_from('>3sB', buf, 0)
+    if version[0] != b'CDF' or version[1] not in (1, 2, 5):
+        raise ValueError('not a NetCDF classic format file')
+    version = version[1]
+    # CDF-5 uses 64-bit sizes, CDF-2 and CDF-5 use 64-bit offsets
+    size_fmt = '>Q' if version == 5 else '>I'
+    offset_fmt = '>I' if version == 1 else '>Q'
+    pos = [4]
+
+    def unpack(fmt):
+        value, = struct.unpack_from(fmt, buf, pos[0])
+        pos[0] += struct.calcsize(fmt)
+        return value
+
+    def name():
+        length = unpack(size_fmt)
+        value = bytes(buf[pos[0]:pos[0]+length]).decode('utf-8')
+        pos[0] += -(-length // 4) * 4
+        return value
+
+    def skip_attrs():
+        unpack('>I')  # NC_ATTRIBUTE tag, or ABSENT
+        for _ in range(unpack(size_fmt)):
+            name()
+            nc_type = unpack('>I')
+            nelems = unpack(size_fmt)
+            pos[0] += -(-nelems * CLASSIC_TYPE_SIZES[nc_type] // 4) * 4
+
+    unpack(size_fmt)  # numrecs
+    # dimensions
+    unpack('>I')
+    dim_lengths = []
+    for _ in range(unpack(size_fmt)):
+        name()
+        dim_lengths.append(unpack(size_fmt))
+    skip_attrs()
+    # variables
+    unpack('>I')
+    offsets = {}
+    for _ in range(unpack(size_fmt)):
+        varname = name()
+        dimids = [unpack(size_fmt) for _ in range(unpack(size_fmt))]
+        skip_attrs()
+        unpack('>I')  # nc_type
+        unpack(size_fmt)  # vsize
+        begin = unpack(offset_fmt)
+        # data of record variables (with the unlimited dimension,
+        # which has length 0 in the header) is interleaved
+        if not dimids or dim_lengths[dimids[0]] != 0:
+            offsets[varname] = begin
+    return offsets
+
+
+class ClassicFileMap(object):
+    """
+    Read-only memory map of a NetCDF classic format file, giving direct
+    access to data of its non-record variables, which are stored
+    contiguously (in big-endian byte order).
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = parse_classic_header(self._mmap)
+
+    def read(self, varname, dtype, start, stop):
+        """ Return elements [start, stop) of Variable's data """
+        stored = numpy.frombuffer(
+                self._mmap, dtype=dtype.newbyteorder('>'), count=stop-start,
+                offset=self.offsets[varname] + start * dtype.itemsize)
+        # no copy is made if native byte order is big-endian
+        return stored.astype(dtype.newbyteorder('='), copy=False)
+
+
+def classic_numrecs(path):
+    """
+    Return number of records in a NetCDF classic format file, read
+    directly from its header, or None if it is not known.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if len(head) < 12 or head[:3] != b'CDF':
+        return None
+    version = struct.unpack_from('>B', head, 3)[0]
+    numrecs = struct.unpack_from('>Q' if version == 5 else '>I', head, 4)[0]
+    # all bits set: "streaming", number of records not in header
+    if numrecs in (2**32 - 1, 2**64 - 1):
+        return None
+    return numrecs
+
+
+#
+# Aggregation of multiple files along their record dimension
+#
+
+
+class DatasetPool(object):
+    """
+    Bounded pool of open (read-only) Datasets; files are opened when
+    first needed and the least recently used one is closed when the
+    pool is full. Must be used holding the NCFS lock.
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        # path -> Dataset
+        self._datasets = OrderedDict()
+
+    def get(self, path):
+        dataset = self._datasets.pop(path, None)
+        if dataset is None:
+            while len(self._datasets) >= self.max_open:
+                _, lru = self._datasets.popitem(last=False)
+                lru.close()
+            log.debug('opening {}'.format(path))
+            dataset = ncpy.Dataset(path, 'r')
+        self._datasets[path] = dataset
+        return dataset
+
+    def close(self):
+        while self._datasets:
+            self._datasets.popitem()[1].close()
+
+
+class AggregatedDimension(object):
+
+    def __init__(self, aggregation, name, size):
+        self._aggregation = aggregation
+        self.name = name
+        self._size = size
+
+    def __len__(self):
+        if self.name == self._aggregation.dimension:
+            return self._aggregation.offsets()[-1]
+        return self._size
+
+    def isunlimited(self):
+        return self.name == self._aggregation.dimension
+
+
+class AggregatedVariable(object):
+    """
+    Variable of an AggregatedDataset. Metadata come from the first file;
+    data are read from the files overlapping the requested indices.
+    """
+
+    def __init__(self, aggregation, template):
+        self._aggregation = aggregation
+        self.name = template.name
+        self.dimensions = tuple(template.dimensions)
+        self.dtype = template.dtype
+        self.ndim = template.ndim
+        self.scale = getattr(template, 'scale', False)
+        self._attrs = get_attrs(template)
+        self._chunking = template.chunking()
+        self._shape = template.shape
+        # position of the aggregation dimension, if Variable has it
+        self._axis = None
+        if aggregation.dimension in self.dimensions:
+            self._axis = self.dimensions.index(aggregation.dimension)
+
+    @property
+    def shape(self):
+        if self._axis is None:
+            return self._shape
+        shape = list(self._shape)
+        shape[self._axis] = self._aggregation.offsets()[-1]
+        return tuple(shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def chunking(self):
+        return self._chunking
+
+    def group(self):
+        return self._aggregation
+
+    def set_auto_scale(self, scale):
+        """ Turn unpacking of data (in all files) on or off """
+        self.scale = scale
+
+    def _read(self, path, key):
+        dataset = self._aggregation.pool.get(path)
+        variable = dataset.variables[self.name]
+        variable.set_auto_scale(self.scale)
+        return variable[key]
+
+    def _expand(self, key):
+        """ Return key as a tuple of one int or slice per dimension """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:i] + fill + key[i+1:]
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def __getitem__(self, key):
+        paths = self._aggregation.paths
+        if self._axis is None:
+            # same data in all files
+            return self._read(paths[0], key)
+        key = self._expand(key)
+        offsets = self._aggregation.offsets()
+        index = key[self._axis]
+        if isinstance(index, slice):
+            if (index.step or 1) < 0:
+                raise IndexError('negative steps are not supported')
+            indices = numpy.arange(*index.indices(offsets[-1]))
+        elif -offsets[-1] <= index < offsets[-1]:
+            indices = numpy.array([index % offsets[-1]])
+        else:
+            raise IndexError('index {} out of range'.format(index))
+        pieces = []
+        # read only from files holding requested records
+        for i, path in enumerate(paths):
+            local = indices[(indices >= offsets[i]) &
+                            (indices < offsets[i+1])] - offsets[i]
+            if not len(local):
+                continue
+            step = int(local[1] - local[0]) if len(local) > 1 else 1
+            local_key = list(key)
+            local_key[self._axis] = slice(
+                    int(local[0]), int(local[-1]) + 1, step)
+            pieces.append(self._read(path, tuple(local_key)))
+        if not pieces:
+            shape = [len(range(*k.indices(n))) for k, n in
+                     zip(key, self.shape) if isinstance(k, slice)]
+            return numpy.zeros(shape, dtype=self.dtype)
+        # position of aggregation axis in the result (ints drop axes)
+        axis = sum(isinstance(k, slice) for k in key[:self._axis])
+        if any(isinstance(p, numpy.ma.MaskedArray) for p in pieces):
+            data = numpy.ma.concatenate(pieces, axis=axis)
+        else:
+            data = numpy.concatenate(pieces, axis=axis)
+        if not isinstance(index, slice):
+            data = data.squeeze(axis=axis)
+        return data
+
+
+class AggregatedDataset(object):
+    """
+    Read-only virtual Dataset concatenating files (of identical
+    structure) along their unlimited (or time) dimension - like
+    netCDF4.MFDataset, but files are only opened when needed, and
+    only a bounded number of them is kept open.
+
+    Metadata come from the first file. Numbers of records of the other
+    files are needed as soon as the length of the aggregated dimension
+    is (which, for NCFS, is when it is mounted): those of classic format
+    files are read from their headers, other (NetCDF4) files are opened
+    once to find them.
+    """
+
+    data_model = 'aggregation'
+
+    def __init__(self, paths, dimension=None, max_open=16):
+        self.paths = list(paths)
+        self.pool = DatasetPool(max_open)
+        first = self.pool.get(self.paths[0])
+        if dimension is None:
+            dimension = self._find_dimension(first)
+        if dimension not in first.dimensions:
+            raise ValueError('cannot aggregate {}: no dimension {}'.format(
+                self.paths[0], dimension))
+        self.dimension = dimension
+        self._unlimited = first.dimensions[dimension].isunlimited()
+        self._attrs = get_attrs(first)
+        self.dimensions = OrderedDict(
+            (name, AggregatedDimension(self, name, len(dim)))
+            for name, dim in first.dimensions.items())
+        self.variables = OrderedDict(
+            (name, AggregatedVariable(self, var))
+            for name, var in first.variables.items())
+        # cumulative numbers of records, found when first needed
+        self._offsets = None
+
+    @classmethod
+    def _find_dimension(cls, dataset):
+        for name, dim in dataset.dimensions.items():
+            if dim.isunlimited():
+                return name
+        for name, var in dataset.variables.items():
+            if var.dimensions == (name,) and cf_axis(get_attrs(var)) == 'T':
+                return name
+        raise ValueError('no unlimited or time dimension to aggregate along')
+
+    def offsets(self):
+        """
+        Return index of the first record of each file (and total number
+        of records). Numbers of records of classic format files are read
+        from their headers, without opening them; other files are opened
+        (once - the offsets are kept).
+        """
+        if self._offsets is None:
+            offsets = [0]
+            for path in self.paths:
+                numrecs = classic_numrecs(path) if self._unlimited else None
+                if numrecs is None:
+                    dataset = self.pool.get(path)
+                    numrecs = len(dataset.dimensions[self.dimension])
+                offsets.append(offsets[-1] + numrecs)
+            self._offsets = offsets
+        return self._offsets
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def set_auto_scale(self, scale):
+        """ Turn unpacking of data of all Variables on or off """
+        for variable in self.variables.values():
+            variable.set_auto_scale(scale)
+
+    def filepath(self):
+        return self.paths[0]
+
+    def sync(self):
+        pass
+
+    def close(self):
+        self.pool.close()
+
+
 def valid_name(name):
     """
     Check if name is a valid NetCDF name.
@@ -78,61 +952,847 @@ def valid_name(name):
 
 
 class VardataAsBinaryFiles(object):
+    """
+    Variable's data as raw bytes, in C order and native byte order.
 
-    def __init__(self):
-        pass
+    Reads are mapped to the hyperslabs holding the requested elements,
+    so memory used is bounded by the size of the request, not by the size
+    of the Variable. Data of non-record Variables of NetCDF classic format
+    files is read directly from a memory map of the file.
+    """
+
+    # attributes which make data read by netCDF4 differ from stored data
+    UNPACKING_ATTRS = ('scale_factor', 'add_offset', 'missing_value',
+                       'valid_min', 'valid_max', 'valid_range')
+
+    # data cannot be updated from the representation (files are not
+    # opened for writing)
+    WRITABLE = False
+
+    def __init__(self, cache=None, reader=read_flat, missing='fill'):
+        self._cache = cache if cache is not None else ReprCache()
+        # function reading a range of elements of flattened data
+        self._read_flat = reader
+        # Dataset -> ClassicFileMap (or None if file can't be mapped)
+        self._file_maps = {}
+        # masked elements are presented as the fill value, or ('nan')
+        # as NaN if data is floating point
+        self._missing = missing
+
+    def _filled(self, data):
+        """ Return (part of) data array with masked elements filled """
+        if self._missing == 'nan' and data.dtype.kind in 'fc':
+            return numpy.ma.filled(data, numpy.nan)
+        return numpy.ma.filled(data)
+
+    def fixed_size(self, variable):
+        """
+        Return size (in bytes) of data representation, if it only depends
+        on Variable's metadata, otherwise None
+        """
+        dtype = data_dtype(variable)
+        if dtype.kind not in 'biufc':
+            # e.g. strings; size can only be found by reading the data
+            return None
+        return variable.size * dtype.itemsize
 
     def size(self, variable):
         """ Return size (in bytes) of data representation """
-        return len(self(variable))
+        size = self.fixed_size(variable)
+        if size is None:
+            return len(self._bytes(variable))
+        return size
 
-    @memoize
     def __call__(self, variable):
         """ Return Variable's data representation """
-        data = variable[:].tobytes()
+        return self._bytes(variable)
+
+    def _bytes(self, variable):
+        """ Return Variable's (whole) data as bytes """
+        key = ('bytes', self._missing)
+        data = self._cache.get(variable, key)
+        if data is None:
+            data = self._filled(variable[:]).tobytes()
+            self._cache.put(variable, key, data)
         return data
 
-    def write(self, variable, buf, offset):
+    def _file_map(self, variable):
+        """
+        Return ClassicFileMap of the file holding Variable,
+        if Variable's data can be read through it, otherwise None.
+        """
+        attrs = variable.ncattrs()
+        if any(attr in attrs for attr in self.UNPACKING_ATTRS):
+            return None
+        if self._missing == 'nan' and data_dtype(variable).kind in 'fc':
+            # fill values in the file would have to be replaced
+            return None
+        dataset = variable.group()
+        if dataset not in self._file_maps:
+            file_map = None
+            if dataset.data_model.startswith('NETCDF3'):
+                try:
+                    # make sure all changes are written to the file
+                    dataset.sync()
+                    file_map = ClassicFileMap(dataset.filepath())
+                except (IOError, OSError, ValueError) as e:
+                    log.info('cannot map {}: {}'.format(
+                        dataset.filepath(), e))
+            self._file_maps[dataset] = file_map
+        file_map = self._file_maps[dataset]
+        if file_map is None or variable.name not in file_map.offsets:
+            return None
+        return file_map
+
+    def read(self, variable, size, offset):
+        """
+        Return part of Variable's data representation
+        (as a memoryview, to avoid copying it again)
+        """
+        dtype = data_dtype(variable)
+        if dtype.kind not in 'biufc':
+            return self._bytes(variable)[offset:offset+size]
+        itemsize = dtype.itemsize
+        end = min(offset + size, variable.size * itemsize)
+        if offset >= end:
+            return b''
+        first = offset // itemsize
+        last = -(-end // itemsize)
+        file_map = self._file_map(variable)
+        if file_map is not None:
+            start = 0
+            if isinstance(variable, VariableSlice):
+                start = variable.start
+            data = file_map.read(
+                    variable.name, dtype, start + first, start + last)
+        else:
+            # masked elements are represented by their fill values
+            data = self._filled(self._read_flat(variable, first, last))
+        data = numpy.ascontiguousarray(data).view(numpy.uint8)
+        base = first * itemsize
+        return memoryview(data[offset-base:end-base])
+
+    def update(self, variable, data):
+        raise NotImplementedError()
+
+    def invalidate(self, variable, keep=()):
+        """
+        Forget everything cached about Variable's data
+        (apart from cache entries with keys in keep)
+        """
+        self._cache.invalidate(variable, keep)
+        # file layout may have changed as well
+        self._file_maps.pop(variable.group(), None)
+
+    def forget(self, variable):
+        """ Forget everything about Variable, e.g. when its file is closed """
+        self._cache.invalidate(variable)
+        self._file_maps.pop(variable.group(), None)
+
+    def invalidate_layout(self, dataset):
+        """
+        Forget the file map of dataset's file, after a change to its
+        header (which can move the data of all Variables)
+        """
+        self._file_maps.pop(dataset, None)
+
+
+class VardataAsNpyFiles(VardataAsBinaryFiles):
+    """
+    Variable's data as a .npy file: a header describing the dtype and
+    shape of the data, followed by the data as in VardataAsBinaryFiles.
+
+    The header is padded so that the data is aligned, so the file can be
+    memory mapped (numpy.load(path, mmap_mode='r')); only the parts of
+    the data which are then used are read from the Variable.
+    """
+
+    def _header(self, variable):
+        """ Return .npy header (format version 1.0) of Variable's data """
+        header = io.BytesIO()
+        numpy.lib.format.write_array_header_1_0(header, {
+            'descr': numpy.lib.format.dtype_to_descr(data_dtype(variable)),
+            'fortran_order': False,
+            'shape': tuple(variable.shape),
+        })
+        return header.getvalue()
+
+    def fixed_size(self, variable):
+        """
+        Return size (in bytes) of data representation, if it only depends
+        on Variable's metadata, otherwise None
+        """
+        size = VardataAsBinaryFiles.fixed_size(self, variable)
+        if size is None:
+            return None
+        return len(self._header(variable)) + size
+
+    def size(self, variable):
+        """ Return size (in bytes) of data representation """
+        size = self.fixed_size(variable)
+        if size is None:
+            return len(self._header(variable)) + len(self._bytes(variable))
+        return size
+
+    def __call__(self, variable):
+        """ Return Variable's data representation """
+        return self._header(variable) + bytes(self._bytes(variable))
+
+    def read(self, variable, size, offset):
+        """
+        Return part of Variable's data representation; reads of data
+        only (past the header) are served as by VardataAsBinaryFiles
+        """
+        header = self._header(variable)
+        if offset >= len(header):
+            return VardataAsBinaryFiles.read(
+                    self, variable, size, offset - len(header))
+        data = VardataAsBinaryFiles.read(
+                self, variable, offset + size - len(header), 0)
+        return header[offset:offset+size] + bytes(data)
+
+
+# colour map of PNG images (viridis), sampled at equally spaced points
+COLORMAP = [(68, 1, 84), (71, 44, 122), (59, 81, 139), (44, 113, 142),
+            (33, 144, 141), (39, 173, 129), (92, 200, 99), (170, 220, 50),
+            (253, 231, 37)]
+
+
+def encode_png(indices, palette, alpha):
+    """
+    Return PNG image (8-bit, palette colour type) with pixels given by
+    2D array of palette indices; palette is a list of (r, g, b) tuples,
+    alpha a list of opacities of (the first few) palette entries
+    """
+    height, width = indices.shape
+    # each scanline starts with filter type 0 (none)
+    scanlines = numpy.zeros((height, width + 1), dtype=numpy.uint8)
+    scanlines[:, 1:] = indices
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+        chunk(b'PLTE', b''.join(struct.pack('BBB', *rgb) for rgb in palette)),
+        chunk(b'tRNS', bytes(bytearray(alpha))),
+        chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ])
+
+
+class VardataAsPngFiles(object):
+    """
+    Variable's data as a colour-mapped PNG image (quicklook) of its
+    last two dimensions. Only the first 2D slab (e.g. the first time
+    step) of Variables with more dimensions is rendered; every slab has
+    its own image in slice directories (see --split). Images larger than
+    max_side pixels are subsampled; rows are flipped if the coordinate
+    of the second last dimension increases, so that north is up.
+
+    Encoded images are kept in the cache, keyed by a version number of
+    the Variable's data, so that size() and read() of the same image
+    never encode it again. Masked elements are transparent.
+    """
+
+    # data cannot be updated from images
+    WRITABLE = False
+
+    def __init__(self, cache=None, reader=read_flat, missing='fill',
+                 max_side=1024):
+        self._cache = cache if cache is not None else ReprCache()
+        # function reading a range of elements of flattened data
+        self._read_flat = reader
+        # missing elements are always transparent
+        self._missing = missing
+        self._max_side = max_side
+        # Variable -> version of its data, increased on every change
+        self._versions = {}
+        palette = numpy.array(COLORMAP, dtype=float)
+        points = numpy.linspace(0, 1, len(COLORMAP))
+        steps = numpy.linspace(0, 1, 255)
+        # palette entry 255 is for missing elements
+        self._palette = [
+            tuple(int(round(numpy.interp(x, points, palette[:, i])))
+                  for i in range(3)) for x in steps] + [(0, 0, 0)]
+        self._alpha = [255] * 255 + [0]
+
+    def size(self, variable):
+        """ Return size (in bytes) of data representation """
+        return len(self(variable))
+
+    def __call__(self, variable):
+        """ Return Variable's data representation (encoded image) """
+        group = ReprCache._group(variable)
+        key = ('png', self._versions.get(group, 0), self._max_side)
+        image = self._cache.get(variable, key)
+        if image is None:
+            image = encode_png(self._indices(variable),
+                               self._palette, self._alpha)
+            self._cache.put(variable, key, image)
+        return image
+
+    def read(self, variable, size, offset):
+        """ Return part of Variable's data representation """
+        return self(variable)[offset:offset+size]
+
+    def _slab(self, variable):
+        """ Return (subsampled) first 2D slab of Variable's data """
+        shape = tuple(variable.shape) or (1,)
+        rows = shape[-2] if len(shape) > 1 else 1
+        cols = shape[-1]
+        step = max(1, -(-max(rows, cols) // self._max_side))
+        slab = []
+        # read the slab a band of rows at a time, keeping every step-th
+        band = max(step, (2**20 // max(cols, 1)) // step * step)
+        for row in range(0, rows, band):
+            stop = min(row + band, rows)
+            data = self._read_flat(variable, row * cols, stop * cols)
+            slab.append(data.reshape(stop - row, cols)[::step, ::step])
+        if any(isinstance(part, numpy.ma.MaskedArray) for part in slab):
+            return numpy.ma.concatenate(slab)
+        return numpy.concatenate(slab)
+
+    def _north_up(self, variable):
+        """ Test if rows have to be flipped to put north up """
+        if len(variable.shape) < 2:
+            return False
+        dim = variable.dimensions[-2]
+        coord = getattr(variable.group(), 'variables', {}).get(dim, None)
+        if coord is None or len(coord.shape) != 1 or coord.shape[0] < 2:
+            return False
+        return coord[0] < coord[-1]
+
+    def _range(self, variable, data):
+        """ Return range of values spanned by the colour map """
+        attrs = variable.ncattrs()
+        if 'scale_factor' in attrs or 'add_offset' in attrs:
+            # valid range of packed data is given in packed units
+            attrs = ()
+        if 'valid_range' in attrs:
+            vmin, vmax = variable.getncattr('valid_range')
+        elif 'valid_min' in attrs and 'valid_max' in attrs:
+            vmin = variable.getncattr('valid_min')
+            vmax = variable.getncattr('valid_max')
+        else:
+            valid = data.compressed()
+            valid = valid[numpy.isfinite(valid)]
+            if not len(valid):
+                return 0., 1.
+            vmin, vmax = valid.min(), valid.max()
+        return float(vmin), float(vmax)
+
+    def _indices(self, variable):
+        """ Return 2D array of palette indices of the image """
+        if data_dtype(variable).kind not in 'biuf' or not variable.size:
+            return numpy.full((1, 1), 255, dtype=numpy.uint8)
+        data = numpy.ma.masked_invalid(self._slab(variable).astype(float))
+        if self._north_up(variable):
+            data = data[::-1]
+        vmin, vmax = self._range(variable, data)
+        scale = 254. / (vmax - vmin) if vmax > vmin else 0.
+        with numpy.errstate(invalid='ignore'):
+            indices = numpy.clip((data.filled(vmin) - vmin) * scale, 0, 254)
+        indices = numpy.rint(indices).astype(numpy.uint8)
+        indices[numpy.ma.getmaskarray(data)] = 255
+        return indices
+
+    def update(self, variable, data):
         raise NotImplementedError()
 
+    def invalidate(self, variable, keep=()):
+        """
+        Forget everything cached about Variable's data
+        (apart from cache entries with keys in keep)
+        """
+        group = ReprCache._group(variable)
+        self._versions[group] = self._versions.get(group, 0) + 1
+        self._cache.invalidate(variable, keep)
+
+    def forget(self, variable):
+        """ Forget everything about Variable, e.g. when its file is closed """
+        self._cache.invalidate(variable)
+        self._versions.pop(ReprCache._group(variable), None)
+
 
 class VardataAsFlatTextFiles(object):
+    """
+    Variable's data as text, one element per line.
+
+    Formatted elements can differ in length, so a sparse index holding
+    the byte offset of every block_size-th element is built (in a single
+    pass, a few blocks at a time) when a Variable is first accessed.
+    Reads then render only the blocks which overlap the requested range.
+
+    If index_dir is given, indexes are also saved there, in sidecar files
+    named after the NetCDF file (its path, modification time and size)
+    and the Variable, so that they need not be built again when the
+    same, unchanged file is mounted again.
+    """
+
+    # edited text is converted back to data
+    WRITABLE = True
 
-    def __init__(self, fmt='%f'):
+    def __init__(self, fmt='%f', block_size=4096, cache=None,
+                 reader=read_flat, missing='fill', index_dir=None):
         self._fmt = fmt
+        self._block_size = block_size
+        self._cache = cache if cache is not None else ReprCache()
+        self._index_dir = index_dir
+        # Variables changed since mounted; their saved indexes (named
+        # after the file as it was before) are not used
+        self._changed = set()
+        # function reading a range of elements of flattened data
+        self._read_flat = reader
+        # masked elements are presented as the fill value ('fill'),
+        # as 'nan' or as an empty field ('empty'); with the last two,
+        # nan and empty fields written to the file are stored as missing
+        self._missing = missing
+
+    def fixed_size(self, variable):
+        """
+        Return size (in bytes) of data representation, if it only depends
+        on Variable's metadata (i.e. elements have fixed width), otherwise
+        None
+        """
+        width = self._fixed_width(variable)
+        if width is None:
+            return None
+        return variable.size * (width + 1)
 
     def size(self, variable):
         """ Return size (in bytes) of data representation """
-        return len(self(variable))
+        size = self.fixed_size(variable)
+        if size is None:
+            return int(self._index(variable)[-1])
+        return size
+
+    def _fixed_width(self, variable):
+        """ Return width of formatted elements, if they all are the same """
+        width = fixed_width(self._fmt, data_dtype(variable))
+        if width is not None and self._missing == 'nan' and width < 3:
+            return None
+        return width
+
+    def _missing_text(self, variable):
+        """ Return text presenting masked elements """
+        text = 'nan' if self._missing == 'nan' else ''
+        width = self._fixed_width(variable)
+        # padded, so that the layout of fixed width formats is kept
+        return text.rjust(width) if width is not None else text
+
+    def _format(self, variable, data, suffix=''):
+        """
+        Return array of formatted elements of (part of) data array,
+        each followed by suffix; only the given part is ever unmasked
+        """
+        strings = numpy.char.mod(self._fmt + suffix, numpy.ma.getdata(data))
+        mask = numpy.ma.getmask(data)
+        if (self._missing != 'fill' and mask is not numpy.ma.nomask and
+                mask.any()):
+            strings = numpy.where(
+                    mask, self._missing_text(variable) + suffix, strings)
+        return strings
+
+    # name of the representation, distinguishing its cached blocks
+    NAME = 'text'
+
+    def _render(self, variable, data, start=0):
+        """
+        Return text representation of (part of) data array,
+        starting at element start of Variable's flattened data
+        """
+        return ''.join(self._format(variable, data, '\n'))
+
+    def _parse(self, data, dtype):
+        """ Return array of values parsed from (part of) representation """
+        if self._missing == 'fill':
+            return parse_text(data, dtype)
+        try:
+            return parse_fields(self._split(data), dtype)
+        except ValueError:
+            # not a number; the (short) result is rejected by callers
+            return numpy.array([], dtype=dtype)
+
+    def _split(self, data):
+        """ Return list of formatted elements of (part of) representation """
+        if self._missing != 'empty':
+            return bytes(data).split()
+        # empty lines are elements too
+        lines = bytes(data).split(b'\n')
+        if lines and not lines[-1].strip():
+            lines.pop()
+        return lines
+
+    def _block_key(self, block):
+        return (self.NAME, self._fmt, self._missing, self._block_size, block)
+
+    def _index(self, variable):
+        """
+        Return (cached) block index of Variable's representation: array
+        of byte offsets of the first element of each block; last item is
+        the size of the whole representation.
+        """
+        key = self._index_key()
+        index = self._cache.get(variable, key)
+        if index is None:
+            path = self._sidecar_path(variable)
+            index = self._load_index(variable, path)
+            if index is None:
+                index = self._build_index(variable)
+                self._save_index(index, path)
+            self._cache.put(variable, key, index)
+        return index
+
+    def _index_key(self):
+        return ('text-index', self._fmt, self._missing, self._block_size)
+
+    def _sidecar_path(self, variable):
+        """
+        Return path of the file in index_dir holding Variable's index,
+        or None if indexes are not saved or cannot be saved reliably
+        """
+        if (self._index_dir is None or
+                ReprCache._group(variable) in self._changed):
+            return None
+        key = [self.NAME, self._fmt, self._missing, self._block_size]
+        while isinstance(variable, (VariableSlice, ScaledVariable)):
+            if isinstance(variable, VariableSlice):
+                key.append(('slice', variable.index))
+            else:
+                key.append(('scale', variable.scale))
+            variable = variable.variable
+        group = variable.group()
+        dataset = group
+        while getattr(dataset, 'parent', None) is not None:
+            dataset = dataset.parent
+        state = []
+        try:
+            # all files of an aggregation
+            for path in getattr(dataset, 'paths', None) or [
+                    dataset.filepath()]:
+                stat = os.stat(path)
+                key.append(os.path.abspath(path))
+                state.append((stat.st_mtime, stat.st_size))
+        except (OSError, ValueError) as e:
+            # e.g. in-memory dataset
+            log.debug('index of {} not saved: {}'.format(variable.name, e))
+            return None
+        key.extend([getattr(group, 'path', '/'), variable.name,
+                    getattr(variable, 'scale', True), tuple(variable.shape)])
+        # <Variable>-<version of the files>, so that indexes of other
+        # versions of the same Variable can be found (and removed)
+        name = '{}-{}'.format(
+                hashlib.sha1(repr(key).encode('utf-8')).hexdigest(),
+                hashlib.sha1(repr(state).encode('utf-8')).hexdigest()[:16])
+        return os.path.join(self._index_dir, name + '.npy')
+
+    def _load_index(self, variable, path):
+        """ Return index saved in file path, or None if there is none """
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            index = numpy.load(path)
+        except (IOError, OSError, ValueError) as e:
+            log.warning('cannot load index {}: {}'.format(path, e))
+            return None
+        nblocks = -(-variable.size // self._block_size)
+        if index.shape != (nblocks + 1,) or index.dtype != numpy.int64:
+            log.warning('ignoring invalid index {}'.format(path))
+            return None
+        return index
+
+    def _save_index(self, index, path):
+        """
+        Save index into file path (atomically), if path is given, and
+        remove saved indexes of other versions of the same Variable
+        """
+        if path is None:
+            return
+        tmp = None
+        try:
+            if not os.path.isdir(self._index_dir):
+                os.makedirs(self._index_dir)
+            # concurrent mounts may save the same index at the same time
+            f = tempfile.NamedTemporaryFile(
+                    dir=self._index_dir, suffix='.tmp', delete=False)
+            tmp = f.name
+            with f:
+                numpy.save(f, index)
+            os.rename(tmp, path)
+            tmp = None
+        except (IOError, OSError) as e:
+            log.warning('cannot save index {}: {}'.format(path, e))
+            return
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        stem = os.path.basename(path).split('-')[0]
+        for stale in glob.glob(os.path.join(self._index_dir,
+                                            stem + '-*.npy')):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError as e:
+                    log.debug('cannot remove index {}: {}'.format(stale, e))
+
+    def _build_index(self, variable):
+        """ Compute byte offsets of all blocks of Variable's data """
+        nelems = variable.size
+        nblocks = -(-nelems // self._block_size)
+        lengths = numpy.zeros(nblocks, dtype=numpy.int64)
+        # read many blocks at once, to amortise per-read overhead
+        step = self._block_size * 64
+        for start in range(0, nelems, step):
+            stop = min(start + step, nelems)
+            data = self._read_flat(variable, start, stop)
+            # add 1 for the newline after each element
+            elem_lengths = numpy.char.str_len(
+                    self._format(variable, data)) + 1
+            block_starts = numpy.arange(0, stop - start, self._block_size)
+            first = start // self._block_size
+            lengths[first:first+len(block_starts)] = numpy.add.reduceat(
+                    elem_lengths, block_starts)
+        index = numpy.zeros(nblocks + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=index[1:])
+        return index
+
+    def _blocks(self, variable, index, first, last):
+        """ Return list of rendered blocks [first, last) """
+        blocks = []
+        block = first
+        while block < last:
+            text = self._cache.get(variable, self._block_key(block))
+            if text is not None:
+                blocks.append(text)
+                block += 1
+                continue
+            # render the whole run of blocks missing from the cache at once
+            stop = block + 1
+            while (stop < last and
+                    self._cache.get(variable, self._block_key(stop)) is None):
+                stop += 1
+            data = self._read_flat(variable,
+                                   block * self._block_size,
+                                   min(stop * self._block_size, variable.size))
+            text = self._render(variable, data, block * self._block_size)
+            base = int(index[block])
+            for b in range(block, stop):
+                part = text[int(index[b])-base:int(index[b+1])-base]
+                self._cache.put(variable, self._block_key(b), part)
+                blocks.append(part)
+            block = stop
+        return blocks
 
-#    @memoize
     def __call__(self, variable):
         """ Return Variable's data representation """
-        return ''.join(numpy.char.mod(
-            '{}\n'.format(self._fmt), variable[:].flatten()))
-
-    def write(self, variable, buf, offset):
-        """
-        Write buf into data array through its
-        string representation, starting at offset.
-        """
-        cur_repr = self(variable)
-        new_repr = write_to_string(cur_repr, buf, offset)
-        # Truncate the result so that there is no garbage at
-        # the end; TODO: this is a bad hack - we assume
-        # that writing is done in a single call to write(2);
-        # whether this is true will obviously depend on how
-        # writing is implemented in a particular editor/application.
-        new_repr = new_repr[0:offset+len(buf)]
-        var_type = variable[:].dtype
-        new_data = numpy.fromstring(new_repr, dtype=var_type, sep='\n')
+        # rendered a few blocks at a time, so that only the text
+        # (not the whole data array and its mask) takes memory
+        step = self._block_size * 64
+        return ''.join(
+                self._render(variable,
+                             self._read_flat(variable, start,
+                                             min(start + step, variable.size)),
+                             start)
+                for start in range(0, variable.size, step))
+
+    def read(self, variable, size, offset):
+        """
+        Return part of Variable's data representation,
+        formatting only the elements overlapping the requested range.
+        """
+        width = self._fixed_width(variable)
+        if width is not None:
+            # element offsets can be computed directly, index is not needed
+            end = min(offset + size, variable.size * (width + 1))
+            if offset >= end:
+                return ''
+            first = offset // (width + 1)
+            last = -(-end // (width + 1))
+            base = first * (width + 1)
+            data = self._read_flat(variable, first, last)
+            return self._render(variable, data, first)[offset-base:end-base]
+        index = self._index(variable)
+        end = min(offset + size, int(index[-1]))
+        if offset >= end:
+            return ''
+        first = int(numpy.searchsorted(index, offset, side='right')) - 1
+        last = int(numpy.searchsorted(index, end, side='left'))
+        base = int(index[first])
+        text = ''.join(self._blocks(variable, index, first, last))
+        return text[offset-base:end-base]
+
+    def invalidate(self, variable, keep=()):
+        """
+        Forget everything cached about Variable's data
+        (apart from cache entries with keys in keep)
+        """
+        self._changed.add(ReprCache._group(variable))
+        self._cache.invalidate(variable, keep)
+
+    def forget(self, variable):
+        """ Forget everything about Variable, e.g. when its file is closed """
+        self._cache.invalidate(variable)
+        self._changed.discard(ReprCache._group(variable))
+
+    def update(self, variable, data):
+        """
+        Replace data array with values parsed from
+        (edited) string representation data.
+        """
+        # cached index and blocks will no longer be valid after the write
+        self.invalidate(variable)
+        new_data = self._parse(data, data_dtype(variable))
         # data size must not change, if after edit the size is different
         # then ignore edit and we present "Permission denied" error to the user
-        if new_data.size != variable[:].size:
+        if new_data.size != variable.size:
             log.warning('write() ignored - would change data array size')
             raise FuseOSError(errno.EACCES)
         else:
-            variable[:] = new_data
+            variable[:] = new_data.reshape(variable.shape)
+
+    def _span(self, variable, start, end):
+        """
+        Return (first, last, base, stop): range [first, last) of elements
+        whose lines cover bytes [start, end) of the representation, and
+        the range [base, stop) of bytes taken by those lines. Whole blocks
+        are used if elements are not all formatted with the same width.
+        """
+        width = self._fixed_width(variable)
+        if width is not None:
+            first = min(start // (width + 1), variable.size)
+            last = min(-(-end // (width + 1)), variable.size)
+            return first, last, first * (width + 1), last * (width + 1)
+        index = self._index(variable)
+        nblocks = len(index) - 1
+        first = int(numpy.searchsorted(index, start, side='right')) - 1
+        first = min(first, nblocks)
+        last = min(int(numpy.searchsorted(index, end, side='left')), nblocks)
+        last = max(first, last)
+        return (first * self._block_size,
+                min(last * self._block_size, variable.size),
+                int(index[first]), int(index[last]))
+
+    def patch(self, variable, edits):
+        """
+        Apply edits, a list of (offset, bytes) writes made to Variable's
+        data representation (without reading it first), to Variable's
+        data. Only the lines touched by the edits are parsed, and only
+        the elements whose lines were changed are written back; cached
+        blocks of the rest of the representation, and its index, stay
+        valid. Return keys of cache entries which are still valid, to be
+        kept when other plugins sharing the cache invalidate theirs.
+        """
+        start = min(offset for offset, _ in edits)
+        end = max(offset + len(buf) for offset, buf in edits)
+        first, last, base, stop = self._span(variable, start, end)
+        old_text = self.read(variable, stop - base, base).encode()
+        text = bytearray(old_text)
+        for offset, buf in edits:
+            offset -= base
+            if offset > len(text):
+                text.extend(b' ' * (offset - len(text)))
+            text[offset:offset+len(buf)] = buf
+        new_data = self._parse(text, data_dtype(variable))
+        # as in update(), edits must not change the number of elements
+        if new_data.size != last - first:
+            log.warning('write() ignored - would change data array size')
+            raise FuseOSError(errno.EACCES)
+        # keep values of unchanged lines, which are formatted with
+        # limited precision, and write only the range of changed ones
+        changed = (numpy.array(self._split(old_text), dtype=bytes) !=
+                   numpy.array(self._split(text), dtype=bytes))
+        if not changed.any():
+            return ()
+        changed_first = int(numpy.argmax(changed))
+        changed_last = len(changed) - int(numpy.argmax(changed[::-1]))
+        old_data = read_flat(variable, first + changed_first,
+                             first + changed_last)
+        new_data = numpy.ma.where(
+                changed[changed_first:changed_last],
+                new_data[changed_first:changed_last], old_data)
+        index = None
+        if self._fixed_width(variable) is None:
+            index = self._index(variable)
+        self.invalidate(variable)
+        write_flat(variable, first + changed_first, new_data)
+        if index is None:
+            return ()
+        self._cache.put(variable, self._index_key(),
+                        self._patch_index(variable, index, first, last))
+        return (self._index_key(),)
+
+    def _patch_index(self, variable, index, first, last):
+        """
+        Return block index updated after elements [first, last), which
+        span whole blocks (or end at the last element), were rewritten
+        """
+        b0 = first // self._block_size
+        b1 = -(-last // self._block_size)
+        # format values as stored, i.e. after conversion to Variable's type
+        data = read_flat(variable, first, last)
+        elem_lengths = numpy.char.str_len(self._format(variable, data)) + 1
+        lengths = numpy.add.reduceat(
+                elem_lengths, numpy.arange(0, last - first, self._block_size))
+        new_index = index.copy()
+        new_index[b0+1:b1+1] = index[b0] + numpy.cumsum(lengths)
+        new_index[b1+1:] += new_index[b1] - index[b1]
+        return new_index
+
+
+class VardataAsCsvFiles(VardataAsFlatTextFiles):
+    """
+    Variable's data as comma separated values, one row (along the last
+    dimension) per line; 1D Variables have one element per line.
+
+    Every element is followed by exactly one separator, as in the text
+    representation, so the layout of the file and its block index are
+    the same - only the separators differ.
+    """
+
+    NAME = 'csv'
+
+    def _render(self, variable, data, start=0):
+        """
+        Return CSV representation of (part of) data array,
+        starting at element start of Variable's flattened data
+        """
+        row = variable.shape[-1] if len(variable.shape) > 1 else 1
+        ends = (numpy.arange(start + 1, start + len(data) + 1) % row) == 0
+        return ''.join(numpy.char.add(self._format(variable, data),
+                                      numpy.where(ends, '\n', ',')))
+
+    def _parse(self, data, dtype):
+        if self._missing == 'fill':
+            return parse_text(bytes(data).replace(b',', b'\n'), dtype)
+        return VardataAsFlatTextFiles._parse(self, data, dtype)
+
+    def _split(self, data):
+        if self._missing != 'empty':
+            return bytes(data).replace(b',', b' ').split()
+        # empty fields are elements too
+        fields = re.split(b'[,\n]', bytes(data))
+        if fields and not fields[-1].strip():
+            fields.pop()
+        return fields
+
+
+# registry of data representation plugins: file name extension -> class;
+# representations selected with --data-files are presented as DATA.<ext>
+# files next to DATA_REPR. Classes take (cache=, reader=, missing=)
+# keyword arguments, text representations also fmt= and index_dir=.
+VARDATA_FORMATS = OrderedDict([
+    ('txt', VardataAsFlatTextFiles),
+    ('csv', VardataAsCsvFiles),
+    ('bin', VardataAsBinaryFiles),
+    ('npy', VardataAsNpyFiles),
+    ('png', VardataAsPngFiles),
+])
+# presented unless --data-files says otherwise; images are opt-in, as
+# their sizes are only known once they are encoded (e.g. by ls -l)
+DEFAULT_DATA_FILES = ['txt', 'csv', 'bin', 'npy']
 
 
 class AttributesAsTextFiles(object):
@@ -179,26 +1839,592 @@ class DimNamesAsTextFiles(object):
 # NetCDF filesystem implementation
 #
 
+VariableInfo = namedtuple(
+        'VariableInfo',
+        ['dimensions', 'attrs', 'dtype', 'shape', 'scale'])
+GroupInfo = namedtuple('GroupInfo', ['attrs', 'groups', 'dimensions'])
+
+# kinds of nodes of the filesystem namespace
+ROOT = 'root'
+VAR_DIR = 'var_dir'
+VAR_ATTR = 'var_attr'
+VAR_DATA = 'var_data'
+VAR_DIMENSIONS = 'var_dimensions'
+GLOBAL_ATTR = 'global_attr'
+GROUP_DIR = 'group_dir'
+SLICE_DIR = 'slice_dir'
+SLICE_DATA = 'slice_data'
+
+# a Variable split along an axis has a subdirectory for each coordinate
+SliceAxis = namedtuple('SliceAxis', ['dimension', 'labels', 'indices'])
+
+VERTICAL_STANDARD_NAMES = set([
+    'air_pressure', 'altitude', 'depth', 'height', 'model_level_number',
+    'height_above_geopotential_datum', 'atmosphere_sigma_coordinate',
+    'atmosphere_hybrid_sigma_pressure_coordinate',
+    'atmosphere_hybrid_height_coordinate', 'ocean_sigma_coordinate',
+    'ocean_s_coordinate', 'ocean_double_sigma_coordinate'])
+
+PRESSURE_UNITS = set(['Pa', 'hPa', 'kPa', 'mbar', 'millibar', 'bar', 'atm'])
+
+
+def cf_axis(attrs):
+    """
+    Return 'T' or 'Z' if coordinate Variable with given attributes is
+    a time or a vertical axis (according to CF Conventions), else None.
+    """
+    axis = str(attrs.get('axis', '')).upper()
+    if axis in ('T', 'Z'):
+        return axis
+    standard_name = attrs.get('standard_name', None)
+    units = str(attrs.get('units', ''))
+    if standard_name == 'time' or ' since ' in units:
+        return 'T'
+    if ('positive' in attrs or standard_name in VERTICAL_STANDARD_NAMES or
+            units in PRESSURE_UNITS):
+        return 'Z'
+    return None
+
+
+def axis_labels(axis, values, attrs):
+    """
+    Return names of subdirectories for coordinate values of an axis;
+    dates for time axes, values for vertical axes. Indices are used
+    if the names would not be unique.
+    """
+    values = numpy.ma.getdata(values)
+    labels = None
+    if axis == 'T' and 'units' in attrs:
+        try:
+            dates = cftime.num2date(
+                    values, attrs['units'],
+                    calendar=attrs.get('calendar', 'standard'))
+        except ValueError:
+            dates = None
+        if dates is not None:
+            fmt = '%Y-%m-%d'
+            if any((d.hour, d.minute, d.second) != (0, 0, 0) for d in dates):
+                fmt = '%Y-%m-%dT%H:%M:%S'
+            labels = [d.strftime(fmt) for d in dates]
+    elif axis == 'Z':
+        labels = ['{:g}'.format(value) for value in values]
+    if labels is None or len(set(labels)) != len(labels):
+        labels = [str(i) for i in range(len(values))]
+    return labels
+
+
+def get_attrs(obj):
+    """ Return an ordered dictionary of attributes of a Variable/Dataset """
+    return OrderedDict(
+            (name, obj.getncattr(name)) for name in obj.ncattrs())
+
+
+def variable_paths(name, info):
+    """ Return list of (path, kind) of all nodes representing Variable """
+    vardir = '/' + name
+    paths = [(vardir, VAR_DIR)]
+    paths.extend((vardir + '/' + attr, VAR_ATTR) for attr in info.attrs)
+    # these take precedence over attributes with the same names
+    paths.append((vardir + '/DATA_REPR', VAR_DATA))
+    paths.append((vardir + '/DIMENSIONS', VAR_DIMENSIONS))
+    return paths
+
+
+class DatasetSnapshot(object):
+    """
+    Immutable snapshot of Dataset's metadata (names of variables, their
+    dimensions, attributes, dtypes and shapes, global attributes, sizes
+    of dimensions).
+
+    Groups are loaded lazily: the snapshot knows names of subgroups of
+    every loaded group, but their contents are added (by with_group)
+    only when they are first accessed. Variables of groups are named
+    by their path within the Dataset, e.g. 'group/subgroup/var'.
+    Attributes of groups are (like global attributes) GLOBAL_ATTRs.
+
+    Metadata operations are served from the snapshot, so they do not
+    need to enter libnetcdf (and do not need to take its lock).
+    Snapshots are never modified; after a change to the Dataset
+    a new, updated snapshot replaces the old one.
+
+    The snapshot also holds an index of the filesystem namespace,
+    mapping every existing path to the kind of node it represents.
+    """
+
+    def __init__(self, variables, attrs, paths=None, groups=None):
+        # variable name -> VariableInfo
+        self.variables = variables
+        # global attribute name -> value
+        self.attrs = attrs
+        # path of loaded group ('' for the root group) -> GroupInfo
+        if groups is None:
+            groups = {'': GroupInfo(attrs, [], OrderedDict())}
+        self.groups = groups
+        # path -> kind of node
+        if paths is None:
+            paths = {'/': ROOT}
+            for name, info in variables.items():
+                paths.update(variable_paths(name, info))
+            self._add_group_paths(paths, '', groups[''])
+        self.paths = paths
+
+    @classmethod
+    def of(cls, dataset):
+        """ Take a snapshot of metadata of the Dataset's root group """
+        variables = OrderedDict(
+                (name, cls.variable_info(var))
+                for name, var in dataset.variables.items())
+        attrs = get_attrs(dataset)
+        groups = {'': cls.group_info(dataset, attrs)}
+        return cls(variables, attrs, groups=groups)
+
+    @classmethod
+    def variable_info(cls, variable):
+        return VariableInfo(tuple(variable.dimensions), get_attrs(variable),
+                            getattr(variable, 'dtype', None),
+                            tuple(getattr(variable, 'shape', ())),
+                            getattr(variable, 'scale', False))
+
+    @classmethod
+    def group_info(cls, group, attrs=None):
+        if attrs is None:
+            attrs = get_attrs(group)
+        dimensions = OrderedDict(
+                (name, len(dim))
+                for name, dim in getattr(group, 'dimensions', {}).items())
+        return GroupInfo(attrs, list(getattr(group, 'groups', ())),
+                         dimensions)
+
+    @classmethod
+    def _prefix(cls, grouppath):
+        """ Return prefix of paths of nodes in group """
+        return '/' + grouppath + '/' if grouppath else '/'
+
+    def _add_group_paths(self, paths, grouppath, info):
+        """ Add paths of subgroups and attributes of a group """
+        prefix = self._prefix(grouppath)
+        for name in info.groups:
+            paths[prefix + name] = GROUP_DIR
+        self._add_attr_paths(paths, info.attrs, grouppath)
+
+    def _add_attr_paths(self, paths, attrs, grouppath=''):
+        """ Add global attribute paths, unless shadowed by variables """
+        prefix = self._prefix(grouppath)
+        for attr in attrs:
+            paths.setdefault(prefix + attr, GLOBAL_ATTR)
+
+    def with_group(self, grouppath, group):
+        """ Return a copy of this snapshot with contents of group added """
+        variables = OrderedDict(self.variables)
+        paths = dict(self.paths)
+        groups = dict(self.groups)
+        prefix = grouppath + '/'
+        for name, var in group.variables.items():
+            info = self.variable_info(var)
+            variables[prefix + name] = info
+            paths.update(variable_paths(prefix + name, info))
+        info = self.group_info(group)
+        groups[grouppath] = info
+        self._add_group_paths(paths, grouppath, info)
+        return DatasetSnapshot(variables, self.attrs, paths, groups)
+
+    def group_variables(self, grouppath):
+        """ Return names (within group) of variables of a loaded group """
+        if not grouppath:
+            return [name for name in self.variables if '/' not in name]
+        prefix = grouppath + '/'
+        return [name[len(prefix):] for name in self.variables
+                if name.startswith(prefix) and
+                '/' not in name[len(prefix):]]
+
+    def with_variable(self, name, variable):
+        """
+        Return a copy of this snapshot with updated metadata of a single
+        Variable, or with the Variable removed if variable is None.
+        """
+        variables = OrderedDict(self.variables)
+        paths = dict(self.paths)
+        old_info = variables.pop(name, None)
+        if old_info is not None:
+            for path, _ in variable_paths(name, old_info):
+                paths.pop(path, None)
+        if variable is not None:
+            info = self.variable_info(variable)
+            variables[name] = info
+            paths.update(variable_paths(name, info))
+        else:
+            grouppath, _, attr = name.rpartition('/')
+            group = self.groups.get(grouppath, None)
+            if group is not None and attr in group.attrs:
+                # global attribute is no longer shadowed by the Variable
+                paths['/' + name] = GLOBAL_ATTR
+        return DatasetSnapshot(variables, self.attrs, paths, self.groups)
+
+    def with_variable_attr(self, varname, name, value):
+        """
+        Return a copy of this snapshot with attribute of a Variable set
+        (before it is written to the Dataset)
+        """
+        info = self.variables[varname]
+        attrs = OrderedDict(info.attrs)
+        attrs[name] = value
+        variables = OrderedDict(self.variables)
+        variables[varname] = info._replace(attrs=attrs)
+        paths = dict(self.paths)
+        paths.update(variable_paths(varname, variables[varname]))
+        return DatasetSnapshot(variables, self.attrs, paths, self.groups)
+
+    def with_attrs(self, dataset, grouppath='', attrs=None):
+        """ Return a copy of this snapshot with updated global attributes
+        (or attributes of a group), read from dataset unless given """
+        if attrs is None:
+            attrs = get_attrs(dataset)
+        paths = dict(self.paths)
+        prefix = self._prefix(grouppath)
+        old = self.groups[grouppath]
+        for attr in old.attrs:
+            if paths[prefix + attr] == GLOBAL_ATTR:
+                del paths[prefix + attr]
+        self._add_attr_paths(paths, attrs, grouppath)
+        groups = dict(self.groups)
+        groups[grouppath] = old._replace(attrs=attrs)
+        root_attrs = attrs if not grouppath else self.attrs
+        return DatasetSnapshot(self.variables, root_attrs, paths, groups)
+
+
+class WriteBuffer(object):
+    """
+    Edited contents of a data representation (or attribute) file,
+    collected from all writes and truncates made through a single file
+    handle. Variable's data (or the attribute) is only updated when
+    the buffer is committed.
+    """
+
+    def __init__(self, path, data=None, kind=VAR_DATA):
+        self.path = path
+        # kind of the node (VAR_DATA, VAR_ATTR or GLOBAL_ATTR)
+        self.kind = kind
+        # None means "not read yet" - current representation is only
+        # generated if a write does not replace the whole file, and
+        # the plugin cannot apply the writes (edits) on its own
+        self.data = bytearray(data) if data is not None else None
+        # writes made while data was not read: list of (offset, bytes)
+        self.edits = []
+        self.dirty = False
+
+    def load(self, data):
+        """ Set current contents of the file, and replay edits on it """
+        self.data = bytearray(data)
+        edits, self.edits = self.edits, []
+        for offset, buf in edits:
+            self.write(buf, offset)
+
+    def write(self, buf, offset):
+        if not isinstance(buf, (bytes, bytearray)):
+            buf = buf.encode('utf-8')
+        if self.data is None:
+            self.edits.append((offset, bytes(buf)))
+            self.dirty = True
+            return
+        if offset > len(self.data):
+            # writing past the end leaves a hole, filled with blanks
+            self.data.extend(b' ' * (offset - len(self.data)))
+        self.data[offset:offset+len(buf)] = buf
+        self.dirty = True
+
+    def truncate(self, length):
+        if length > len(self.data):
+            self.data.extend(b' ' * (length - len(self.data)))
+        else:
+            del self.data[length:]
+        self.dirty = True
+
+
 class NCFS(object):
     """
     Main object for netCDF-filesytem operations
     """
-    def __init__(self, dataset, vardata_repr, attr_repr, dimnames_repr):
+    def __init__(self, dataset, vardata_repr, attr_repr, dimnames_repr,
+                 split_axes=False, read_only=False, lock=None,
+                 data_reprs=None, preload=False, attr_batch=0):
         self.dataset = dataset
         # plugin for generating Variable's data representations
         self.vardata_repr = vardata_repr
+        # file name (e.g. DATA.bin) -> plugin generating an additional
+        # representation of Variable's data, presented next to DATA_REPR
+        self.data_reprs = OrderedDict(data_reprs or ())
         # plugin for generation Atributes representations
         self.attr_repr = attr_repr
         # plugin for generating a list of variable's dimensions
         self.dimnames_repr = dimnames_repr
         # store mount time, for file timestamps
         self.mount_time = time.time()
+        # path -> modification time of nodes modified since mount (or
+        # since epoch, which is the modification time of all other nodes)
+        self._mtimes = {}
+        self._epoch = self.mount_time
+        # libnetcdf/HDF5 are not thread-safe; every call into the library
+        # (apart from reading metadata, which comes from the snapshot)
+        # must be made holding this lock (shared with background readers)
+        self.lock = lock if lock is not None else threading.RLock()
+        # metadata snapshot; replaced (never modified) on every change
+        self.snapshot = DatasetSnapshot.of(dataset)
+        # Dataset is never modified; data representations never change
+        self.read_only = read_only
+        # present time steps/vertical levels of variables as subdirectories
+        self.split_axes = split_axes
+        # variable name -> list of SliceAxis, built when first needed
+        self._slice_axes = {}
+        # file handle -> WriteBuffer of edited data representation
+        self._write_buffers = {}
+        self._file_handles = itertools.count(1)
+        # path -> size of data representation file, computed (holding
+        # the lock) when first needed; forgotten whenever data changes
+        self._data_sizes = {}
+        # (VAR_DIR, varname) or (GROUP_DIR, grouppath) -> attributes set
+        # but not yet written to the Dataset; changes are collected for
+        # attr_batch seconds, so that all changes of a Variable (or group)
+        # are written together, entering define mode (and rewriting the
+        # header of classic files) once
+        self._pending_attrs = OrderedDict()
+        self.attr_batch = attr_batch
+        self._attr_timer = None
+        self._attrs_failed = False
+        self._closed = False
+        if preload:
+            # contents of all groups are added to the snapshot in the
+            # background, while requests are already being served
+            preloader = threading.Thread(target=self.preload)
+            preloader.daemon = True
+            preloader.start()
+
+    def preload(self):
+        """
+        Add contents of all groups to the snapshot, one group at a time
+        (holding the lock only while a group is being read)
+        """
+        pending = list(self.snapshot.groups[''].groups)
+        while pending:
+            grouppath = pending.pop(0)
+            with self.lock:
+                if self._closed:
+                    return
+                self.load_group(grouppath)
+            info = self.snapshot.groups.get(grouppath, None)
+            if info is not None:
+                pending.extend(grouppath + '/' + name for name in info.groups)
+        log.debug('metadata of all groups loaded')
+
+    def refresh(self):
+        """ Take a new snapshot of all metadata (of loaded groups) """
+        with self.lock:
+            loaded = sorted(self.snapshot.groups, key=len)
+            # built aside, so that no partial snapshot is ever served
+            snapshot = DatasetSnapshot.of(self.dataset)
+            for grouppath in loaded:
+                group = self.get_group(grouppath)
+                if grouppath and group is not None:
+                    snapshot = snapshot.with_group(grouppath, group)
+            self.snapshot = snapshot
+            self._slice_axes = {}
+            self._data_sizes = {}
+            self.header_changed()
+
+    def refresh_variable(self, varname):
+        """ Update snapshot of Variable's metadata """
+        with self.lock:
+            var = self.find_variable(varname)
+            self.snapshot = self.snapshot.with_variable(varname, var)
+            self._slice_axes = {}
+            self._data_sizes = {}
+            self.header_changed()
+
+    def refresh_global_attrs(self, grouppath=''):
+        """ Update snapshot of global attributes (or of group's ones) """
+        with self.lock:
+            self.snapshot = self.snapshot.with_attrs(
+                    self.get_group(grouppath), grouppath)
+            self.header_changed()
+
+    def header_changed(self):
+        """
+        Tell plugins that metadata in the file's header changed; in
+        classic format files, data of all Variables may have moved
+        (e.g. when a global attribute grew)
+        """
+        for plugin in self.vardata_plugins():
+            if hasattr(plugin, 'invalidate_layout'):
+                plugin.invalidate_layout(self.dataset)
+
+    def get_group(self, grouppath):
+        """ Return Dataset's group (Dataset itself for ''), or None """
+        group = self.dataset
+        for name in grouppath.split('/') if grouppath else ():
+            group = getattr(group, 'groups', {}).get(name, None)
+            if group is None:
+                return None
+        return group
+
+    def find_variable(self, varname):
+        """ Return Variable, given its name (path within Dataset) """
+        grouppath, _, name = varname.rpartition('/')
+        group = self.get_group(grouppath)
+        if group is None:
+            return None
+        return group.variables.get(name, None)
+
+    def load_group(self, grouppath):
+        """ Add contents of a group to the snapshot, if not there yet """
+        if grouppath in self.snapshot.groups:
+            return
+        with self.lock:
+            group = self.get_group(grouppath)
+            if group is not None and grouppath not in self.snapshot.groups:
+                log.debug('loading group {}'.format(grouppath))
+                self.snapshot = self.snapshot.with_group(grouppath, group)
+
+    def split_group(self, path):
+        """
+        Split path into path of the innermost group holding the node
+        ('' for the root group) and path relative to that group.
+        Groups along the path are loaded if needed.
+        """
+        parts = path.strip('/').split('/')
+        depth = 0
+        grouppath = ''
+        for part in parts[:-1]:
+            subgroup = grouppath + '/' + part if grouppath else part
+            if self.snapshot.paths.get('/' + subgroup, None) != GROUP_DIR:
+                break
+            self.load_group(subgroup)
+            grouppath = subgroup
+            depth += 1
+        return grouppath, '/' + '/'.join(parts[depth:])
+
+    def touch(self, *paths):
+        """ Set modification time of nodes at paths to now """
+        now = time.time()
+        for path in paths:
+            self._mtimes[path] = now
+
+    def touch_all(self):
+        """ Set modification time of all nodes to now """
+        self._mtimes = {}
+        self._epoch = time.time()
+
+    def mtime(self, path):
+        """
+        Return modification time of node at path; the kernel uses it
+        to decide if its cached pages of the file are still valid.
+        """
+        return max(self._mtimes.get(path, self._epoch), self._epoch)
+
+    def kind(self, path):
+        """ Return kind of node at path, or None if path does not exist """
+        kind = self.snapshot.paths.get(path, None)
+        if kind is None and '/' in path.strip('/'):
+            # path may be in a group that was not loaded yet
+            if self.split_group(path)[0]:
+                kind = self.snapshot.paths.get(path, None)
+        if kind is None and os.path.basename(path).startswith('DATA'):
+            dirname, basename = os.path.split(path)
+            if (self.snapshot.paths.get(dirname, None) == VAR_DIR and
+                    basename in self.data_files(dirname.lstrip('/'))):
+                kind = VAR_DATA
+        if kind is None and self.split_axes and '=' in path:
+            resolved = self.resolve_slice(path)
+            if resolved is not None:
+                kind = SLICE_DATA if resolved[2] else SLICE_DIR
+        return kind
+
+    def slice_axes(self, varname):
+        """
+        Return list of SliceAxis of leading dimensions of a Variable which
+        are CF time or vertical axes. The last two dimensions (e.g. lat/lon)
+        are never split, so that every slice is still a 2D field.
+        """
+        axes = self._slice_axes.get(varname, None)
+        if axes is not None:
+            return axes
+        axes = []
+        info = self.snapshot.variables.get(varname, None)
+        dimensions = info.dimensions[:-2] if info is not None else ()
+        # coordinate variables live in the Variable's group
+        grouppath = varname.rpartition('/')[0]
+        prefix = grouppath + '/' if grouppath else ''
+        for dim in dimensions:
+            coord = self.snapshot.variables.get(prefix + dim, None)
+            if coord is None or coord.dimensions != (dim,):
+                break
+            axis = cf_axis(coord.attrs)
+            if axis is None:
+                break
+            with self.lock:
+                values = self.find_variable(prefix + dim)[:]
+            labels = axis_labels(axis, values, coord.attrs)
+            indices = dict((label, i) for i, label in enumerate(labels))
+            axes.append(SliceAxis(dim, labels, indices))
+        self._slice_axes[varname] = axes
+        return axes
+
+    def resolve_slice(self, path):
+        """
+        Resolve path of the form /var/dim=label[/dim=label...][/DATA_REPR]
+        into tuple (varname, index, is_data), or None if it is not a valid
+        path of a slice of a Variable.
+        """
+        grouppath, path = self.split_group(path)
+        parts = path.strip('/').split('/')
+        varname, parts = parts[0], parts[1:]
+        if grouppath:
+            varname = grouppath + '/' + varname
+        if varname not in self.snapshot.variables:
+            return None
+        is_data = bool(parts) and parts[-1] in self.data_files(varname)
+        if is_data:
+            parts = parts[:-1]
+        axes = self.slice_axes(varname)
+        if not parts or len(parts) > len(axes):
+            return None
+        index = []
+        for part, axis in zip(parts, axes):
+            dim, _, label = part.partition('=')
+            if dim != axis.dimension or label not in axis.indices:
+                return None
+            index.append(axis.indices[label])
+        return varname, tuple(index), is_data
+
+    def get_slice(self, path):
+        """ Return VariableSlice for slice path, or None """
+        resolved = self.resolve_slice(path)
+        if resolved is None:
+            return None
+        varname, index, is_data = resolved
+        variable = self.find_variable(varname)
+        if is_data:
+            variable = self.data_view(variable, path)
+        # shape from the snapshot, as this is called not holding the lock
+        return VariableSlice(variable, index,
+                             self.variable_metadata(varname))
+
+    def slice_entries(self, varname, depth):
+        """ Return names of slice subdirectories at given depth """
+        axes = self.slice_axes(varname)
+        if depth >= len(axes):
+            return []
+        axis = axes[depth]
+        return ['{}={}'.format(axis.dimension, label) for label in axis.labels]
 
     def is_var_dir(self, path):
         """ Test if path is a valid Variable directory path """
-        potential_vardir = self.get_varname(path)
+        kind = self.kind(path)
+        if kind is not None:
+            return kind == VAR_DIR
+        # path does not exist (yet), classify it by its form
+        grouppath, path = self.split_group(path)
+        potential_vardir = path.lstrip('/').split('/', 1)[0]
         # Don't return True if it is a Global Attribute
-        if potential_vardir not in self.dataset.ncattrs():
+        if potential_vardir not in self.snapshot.groups[grouppath].attrs:
             return re.search('^/[^/]+$', path) is not None
         else:
             return False
@@ -207,68 +2433,173 @@ class NCFS(object):
         """ Test if path is a vaild path to Variable data representation
             TODO: data representation could be a file or a directory.
         """
+        kind = self.kind(path)
+        if kind is not None:
+            return kind == VAR_DATA
         dirname, basename = os.path.split(path)
-        return self.is_var_dir(dirname) and basename == 'DATA_REPR'
+        return self.is_var_dir(dirname) and basename in self.data_files()
+
+    def is_read_only_data(self, path):
+        """ Test if path is a data representation which cannot be written,
+            as its plugin cannot convert it back to data
+        """
+        return (self.is_var_data(path) and
+                not getattr(self.data_repr(path), 'WRITABLE', True))
+
+    def data_files(self, varname=None):
+        """
+        Return names of files holding representations of data (of
+        Variable varname). Packed Variables also have DATA_RAW and
+        DATA_SCALED files (and DATA_RAW.<ext>, DATA_SCALED.<ext>),
+        presenting data with unpacking turned off and on respectively.
+        """
+        names = ['DATA_REPR'] + list(self.data_reprs)
+        if varname is not None and self.is_packed(varname):
+            for stem in ('DATA_RAW', 'DATA_SCALED'):
+                names.append(stem)
+                names.extend(stem + name[len('DATA'):]
+                             for name in self.data_reprs)
+        return names
+
+    def is_packed(self, varname):
+        """ Test if Variable has scale_factor or add_offset attributes """
+        info = self.snapshot.variables.get(varname, None)
+        return info is not None and (
+                'scale_factor' in info.attrs or 'add_offset' in info.attrs)
+
+    def data_repr(self, path):
+        """ Return plugin generating data representation at path """
+        name = os.path.basename(path)
+        for stem in ('DATA_RAW', 'DATA_SCALED'):
+            if name.startswith(stem):
+                name = 'DATA' + name[len(stem):]
+        return self.data_reprs.get(name, self.vardata_repr)
+
+    def data_view(self, variable, path):
+        """
+        Return Variable whose data is presented at path: the Variable
+        itself, or its ScaledVariable for DATA_RAW and DATA_SCALED files
+        """
+        name = os.path.basename(path)
+        if name.startswith('DATA_RAW'):
+            return ScaledVariable(variable, False)
+        if name.startswith('DATA_SCALED'):
+            return ScaledVariable(variable, True)
+        return variable
+
+    def vardata_plugins(self):
+        """ Return list of all (distinct) data representation plugins """
+        plugins = [self.vardata_repr] if self.vardata_repr else []
+        for plugin in self.data_reprs.values():
+            if all(plugin is not p for p in plugins):
+                plugins.append(plugin)
+        return plugins
 
     def is_var_dimensions(self, path):
         """ Test if path is a valid path for Variable's 'DIMENSIONS' file """
+        kind = self.kind(path)
+        if kind is not None:
+            return kind == VAR_DIMENSIONS
         dirname, basename = os.path.split(path)
         return self.is_var_dir(dirname) and basename == 'DIMENSIONS'
 
-    def rename_dim_and_dimvar(self, old_name, new_name):
+    def dimension_group(self, varname, dimname):
+        """
+        Return path of the group defining dimension of Variable varname:
+        Variable's own group, or the nearest parent group defining it
+        """
+        grouppath = varname.rpartition('/')[0]
+        while True:
+            group = self.snapshot.groups.get(grouppath, None)
+            if group is not None and dimname in group.dimensions:
+                return grouppath
+            if not grouppath:
+                raise ValueError('{} not a dimension of {}'.format(
+                    dimname, varname))
+            grouppath = grouppath.rpartition('/')[0]
+
+    def rename_dim_and_dimvar(self, old_name, new_name, grouppath=''):
         if new_name == old_name:
             return
-        self.dataset.renameDimension(old_name, new_name)
+        group = self.get_group(grouppath)
+        group.renameDimension(old_name, new_name)
         try:
             # rename Dimension Variable (if exists)
-            self.dataset.renameVariable(old_name, new_name)
+            group.renameVariable(old_name, new_name)
         except KeyError:
             pass
 
-    def rename_dims_and_dimvars(self, old_names, new_names):
-        """ Rename dimensions and corresponding dimension variables """
+    def rename_dims_and_dimvars(self, old_names, new_names, varname=''):
+        """
+        Rename dimensions (of Variable varname) and corresponding
+        dimension variables, in the groups defining them
+        """
         # number of dimensions should remain the same; if it is
         # different, print warning message and abort renaming.
         if len(old_names) != len(new_names):
             log.warning("number of dimensions of a variable cannot change")
             raise ValueError(
                     'old and new dimension list must have the same lenght')
+        if len(set(new_names)) != len(set(old_names)):
+            # e.g. dimensions of different groups renamed alike
+            raise ValueError(
+                    'invalid dimension names {}'.format(','.join(new_names)))
+        grouppaths = [self.dimension_group(varname, old) for old in old_names]
         # Simulate renaming to check if it results in duplicates.
         # This would cause NetCDF to abort; instead we cancel renaming.
         # We also add temporary prefix to dimension names
         # - otherwise SWAPPING dimension names would not work.
         # Maybe there's a better way to do it...
-        dimnames = [x for x in self.dataset.dimensions]
-        for old in old_names:
-            dimnames = [
-                    'RENAMING_' + x if x == old else x for x in dimnames]
-        old_names_tmp = ['RENAMING_' + x for x in old_names]
-        for old, new in zip(old_names_tmp, new_names):
-            dimnames = [new if x == old else x for x in dimnames]
-        # Check for duplicates; abort renaming if duplicates found
-        if len(dimnames) != len(set(dimnames)):
-            log.warn('renaming dimensions would result in duplicates')
-            raise ValueError(
-                    'invalid dimension names {}'.format(','.join(new_names)))
+        for grouppath in set(grouppaths):
+            renames = [(old, new) for old, new, path
+                       in zip(old_names, new_names, grouppaths)
+                       if path == grouppath]
+            dimnames = list(self.snapshot.groups[grouppath].dimensions)
+            for old, _ in renames:
+                dimnames = [
+                        'RENAMING_' + x if x == old else x for x in dimnames]
+            for old, new in renames:
+                dimnames = [new if x == 'RENAMING_' + old else x
+                            for x in dimnames]
+            # Check for duplicates; abort renaming if duplicates found
+            if len(dimnames) != len(set(dimnames)):
+                log.warn('renaming dimensions would result in duplicates')
+                raise ValueError('invalid dimension names {}'.format(
+                    ','.join(new_names)))
         # Renaming is safe - do it.
-        for old in old_names:
-            self.rename_dim_and_dimvar(old, 'RENAMING_' + old)
-        for old, new in zip(old_names_tmp, new_names):
-            self.rename_dim_and_dimvar(old, new)
+        with self.lock:
+            try:
+                for old, path in zip(old_names, grouppaths):
+                    self.rename_dim_and_dimvar(old, 'RENAMING_' + old, path)
+                for old, new, path in zip(old_names, new_names, grouppaths):
+                    self.rename_dim_and_dimvar('RENAMING_' + old, new, path)
+            finally:
+                self.refresh()
+                # shapes of data representations may change anywhere
+                self.touch_all()
 
     def is_var_attr(self, path):
         """ Test if path is a valid path for Variable's Attribute """
+        kind = self.kind(path)
+        if kind is not None:
+            return kind == VAR_ATTR
         if '.Trash' in path:
             return False
-        if re.search('^/[^/]+/[^/]+$', path) is not None:
+        if re.search('^/[^/]+/[^/]+$', self.split_group(path)[1]) is not None:
             return not (self.is_var_data(path) or self.is_var_dimensions(path))
 
     def is_global_attr(self, path):
         """ Test if path is a valid path for a Dataset's Global Attributes"""
-        potential_glob_attr = self.get_global_attr_name(path)
+        kind = self.kind(path)
+        if kind is not None:
+            return kind == GLOBAL_ATTR
+        grouppath, path = self.split_group(path)
+        potential_glob_attr = path.lstrip('/').split('/', 1)[0]
         log.debug("Checking if global attr: {}".format(potential_glob_attr))
         # if potential_glob_attr in self.getncGlobalAttrs():
-        if potential_glob_attr not in self.getncVariables():
+        if grouppath:
+            potential_glob_attr = grouppath + '/' + potential_glob_attr
+        if potential_glob_attr not in self.snapshot.variables:
             log.debug("Checking if global attr {} in Dataset".format(
                       potential_glob_attr))
             return re.search('^/[^/]+$', path) is not None
@@ -279,35 +2610,18 @@ class NCFS(object):
         """ Test if the path is a valid path for the Dataset dimension
         variables. Uses the names the dimension variable from get_var_dimnames.
         """
-        dimnames = self.get_var_dimnames(path)
-        varname = self.get_varname(path)
-
-        dirname, basename = os.path.split(path)
-
-        if self.is_var_data(path) and (varname in dimnames):
-            return self.is_var_dir(dirname) and basename == 'DATA_REPR'
-        else:
-            return False
+        dimnames = self.get_var_dimnames(path) or ()
+        varname = self.get_varname(path).rpartition('/')[2]
+        return self.is_var_data(path) and varname in dimnames
 
     def exists(self, path):
         """ Test if path exists """
-        if (self.is_var_dir(path) or
-                self.is_var_data(path) or
-                self.is_var_dimensions(path)):
-            return self.get_variable(path) is not None
-        elif self.is_global_attr(path):
-            log.debug("Exists method: Checking glob attr {}".format(path))
-            return self.get_global_attr(path) is not None
-        elif self.is_var_attr(path):
-            return self.get_var_attr(path) is not None
-        elif path == '/':
-            return True
-        else:
-            return False
+        return self.kind(path) is not None
 
     def is_dir(self, path):
         """ Test if path corresponds to a directory-like object """
-        return self.is_var_dir(path) or path == '/'
+        return (self.is_var_dir(path) or path == '/' or
+                self.kind(path) in (SLICE_DIR, GROUP_DIR))
 
     def is_blacklisted(self, path):
         """ Test if a special file/directory """
@@ -317,21 +2631,22 @@ class NCFS(object):
         """ Test if path corresponds to a file-like object """
         return not self.is_dir(path)
 
-    @classmethod
-    def get_varname(cls, path):
+    def get_varname(self, path):
         """
         Return NetCDF variable name, given its path.
-        The path can be variable, attribute, data repr or dimensions path
+        The path can be variable, attribute, data repr or dimensions path.
+        Variables in groups are named by their path within the Dataset.
         """
-        return path.lstrip('/').split('/', 1)[0]
+        grouppath, path = self.split_group(path)
+        varname = path.lstrip('/').split('/', 1)[0]
+        return grouppath + '/' + varname if grouppath else varname
 
-    @classmethod
-    def get_global_attr_name(cls, path):
+    def get_global_attr_name(self, path):
         """
         Return NetCDF global attribute name, given its path.
         The path can be variable, attribute, data repr or dimensions path
         """
-        return path.lstrip('/').split('/', 1)[0]
+        return self.split_group(path)[1].lstrip('/').split('/', 1)[0]
 
     @classmethod
     def get_attrname(cls, path):
@@ -340,36 +2655,50 @@ class NCFS(object):
 
     def get_variable(self, path):
         """ Return NetCDF Variable object, given its path, or None """
-        varname = self.get_varname(path)
-        return self.dataset.variables.get(varname, None)
+        return self.find_variable(self.get_varname(path))
+
+    def invalidate(self, path):
+        """
+        Drop cached data representations of the Variable at path.
+        Must be called before any change which can affect Variable's
+        data - including its attributes, e.g. scale_factor or _FillValue.
+        """
+        if self.read_only:
+            return
+        var = self.get_variable(path)
+        if var is not None:
+            self.touch('/' + self.get_varname(path) + '/DATA_REPR')
+            for plugin in self.vardata_plugins():
+                plugin.invalidate(var)
+        # values of coordinate variables (i.e. slice names) may change
+        self._slice_axes = {}
+        self._data_sizes = {}
 
     def get_global_attr(self, path):
-        """Return global attribute"""
-        global_attr_name = self.get_global_attr_name(path)
-        try:
-            return self.dataset.getncattr(global_attr_name)
-        except AttributeError:
+        """Return global attribute (or attribute of a group)"""
+        grouppath, path = self.split_group(path)
+        global_attr_name = path.lstrip('/').split('/', 1)[0]
+        group = self.snapshot.groups.get(grouppath, None)
+        if group is None:
             return None
+        return group.attrs.get(global_attr_name, None)
 
     def get_var_attr(self, path):
         """ Return NetCDF Attribute object, given its path, or None """
         varname = self.get_varname(path)
         attrname = self.get_attrname(path)
-        var = self.dataset.variables.get(varname, None)
-        if var is None:
-            return None
-        try:
-            return var.getncattr(attrname)
-        except AttributeError:
+        info = self.snapshot.variables.get(varname, None)
+        if info is None:
             return None
+        return info.attrs.get(attrname, None)
 
     def get_var_dimnames(self, path):
         """ Return NetCDF Variable Dimensions """
         varname = self.get_varname(path)
-        var = self.dataset.variables.get(varname, None)
-        if var is None:
+        info = self.snapshot.variables.get(varname, None)
+        if info is None:
             return None
-        return var.dimensions
+        return info.dimensions
 
     def set_var_attr(self, path, value):
         """
@@ -379,37 +2708,123 @@ class NCFS(object):
         stripped_value = value.rstrip()  # \n should be stripped by default
         attrname = self.get_attrname(path)
         if valid_name(attrname):
-            var = self.get_variable(path)
-            var.setncattr(attrname, stripped_value)
+            self.queue_attr((VAR_DIR, self.get_varname(path)),
+                            attrname, stripped_value)
 
     def set_global_attr(self, path, value):
         stripped_value = value.rstrip()  # \n should be stripped by default
+        grouppath = self.split_group(path)[0]
         glob_attrname = self.get_global_attr_name(path)
         if valid_name(glob_attrname):
-            self.dataset.setncattr(glob_attrname, stripped_value)
+            self.queue_attr((GROUP_DIR, grouppath),
+                            glob_attrname, stripped_value)
+
+    # attributes changing how data is read; written without delay
+    DATA_ATTRS = ('scale_factor', 'add_offset', '_FillValue',
+                  'missing_value', 'valid_min', 'valid_max', 'valid_range')
+
+    def queue_attr(self, owner, name, value):
+        """
+        Set attribute of owner, (VAR_DIR, varname) or (GROUP_DIR,
+        grouppath). It is written to the Dataset at once, or (if
+        attr_batch is set) together with other changes made within
+        attr_batch seconds; the snapshot shows it in the meantime.
+        """
+        with self.lock:
+            self._pending_attrs.setdefault(owner, OrderedDict())[name] = value
+            if not self.attr_batch or name in self.DATA_ATTRS:
+                self.write_attrs()
+                self.check_attrs()
+                return
+            kind, ownername = owner
+            if kind == VAR_DIR:
+                self.snapshot = self.snapshot.with_variable_attr(
+                        ownername, name, value)
+            else:
+                attrs = OrderedDict(self.snapshot.groups[ownername].attrs)
+                attrs[name] = value
+                self.snapshot = self.snapshot.with_attrs(
+                        None, ownername, attrs)
+            if self._attr_timer is None:
+                self._attr_timer = threading.Timer(
+                        self.attr_batch, self._write_attrs_later)
+                self._attr_timer.daemon = True
+                self._attr_timer.start()
+
+    def _write_attrs_later(self):
+        try:
+            self.write_attrs()
+        except Exception as e:
+            log.error('writing attributes failed: {}'.format(e))
+
+    def write_attrs(self):
+        """
+        Write attributes set (by queue_attr) but not yet written, all
+        attributes of each Variable (or group) with a single setncatts
+        """
+        with self.lock:
+            if self._attr_timer is not None:
+                self._attr_timer.cancel()
+                self._attr_timer = None
+            while self._pending_attrs:
+                (kind, name), attrs = self._pending_attrs.popitem(last=False)
+                try:
+                    if kind == VAR_DIR:
+                        var = self.find_variable(name)
+                        if var is None:
+                            # Variable was deleted (or renamed) since
+                            continue
+                        # attributes can change Variable's data
+                        self.invalidate('/' + name)
+                        var.setncatts(attrs)
+                    else:
+                        self.get_group(name).setncatts(attrs)
+                except Exception as e:
+                    log.error('cannot write attributes {} of {}: {}'.format(
+                        ', '.join(attrs), name or '/', e))
+                    # reported by check_attrs (i.e. the next fsync)
+                    self._attrs_failed = True
+                # the snapshot shows what was actually written
+                if kind == VAR_DIR:
+                    self.refresh_variable(name)
+                else:
+                    self.refresh_global_attrs(name)
+
+    def check_attrs(self):
+        """ Raise EIO if writing attributes failed since last checked """
+        with self.lock:
+            failed, self._attrs_failed = self._attrs_failed, False
+        if failed:
+            raise FuseOSError(errno.EIO)
 
     def del_var_attr(self, path):
         attrname = self.get_attrname(path)
         var = self.get_variable(path)
-        var.delncattr(attrname)
+        with self.lock:
+            var.delncattr(attrname)
+            self.refresh_variable(self.get_varname(path))
 
     def del_global_attr(self, path):
+        grouppath = self.split_group(path)[0]
         glob_attr_name = self.get_global_attr_name(path)
-        self.dataset.delncattr(glob_attr_name)
+        with self.lock:
+            self.get_group(grouppath).delncattr(glob_attr_name)
+            self.refresh_global_attrs(grouppath)
 
     def getncVariables(self):
         """ Return the names of NetCDF variables in the file"""
-        return [item.encode('utf-8') for item in self.dataset.variables]
+        return [item.encode('utf-8')
+                for item in self.snapshot.group_variables('')]
 
     def getncAttrs(self, path):
         """ Return name of NetCDF attributes, given variable's path """
         varname = self.get_varname(path)
-        attrs = self.dataset.variables[varname].ncattrs()
+        attrs = self.snapshot.variables[varname].attrs
         return [attr for attr in attrs]
 
     def getncGlobalAttrs(self):
         """ Return a list of the Dataset's global attributes"""
-        glob_attrs = self.dataset.ncattrs()
+        glob_attrs = self.snapshot.attrs
         return [glob_attr.encode('utf-8') for glob_attr in glob_attrs]
 
     def rename_var_attr(self, old, new):
@@ -419,31 +2834,46 @@ class NCFS(object):
         old_attr_name = self.get_attrname(old)
         new_attr_name = self.get_attrname(new)
         if valid_name(new_attr_name):
-            cur_var.renameAttribute(old_attr_name, new_attr_name)
+            with self.lock:
+                cur_var.renameAttribute(old_attr_name, new_attr_name)
+                self.refresh_variable(self.get_varname(old))
 
     def rename_global_attr(self, old, new):
         """ Renames a global attribute """
+        grouppath = self.split_group(old)[0]
         old_attr_name = self.get_global_attr_name(old)
         new_attr_name = self.get_global_attr_name(new)
         if valid_name(new_attr_name):
-            self.dataset.renameAttribute(old_attr_name, new_attr_name)
+            with self.lock:
+                self.get_group(grouppath).renameAttribute(
+                        old_attr_name, new_attr_name)
+                self.refresh_global_attrs(grouppath)
 
     def rename_variable(self, old, new):
         """Renames a variale (i.e. a directory)"""
         # cur_var = self.get_variable(old)
         # print(cur_var)
-        old_var_name = self.get_varname(old)
-        new_var_name = self.get_varname(new)
-        self.dataset.renameVariable(old_var_name, new_var_name)
-        # if this is a Dimension Variable,
-        # also rename corresponding dimension
-        if old_var_name in self.dataset.dimensions:
-            self.dataset.renameDimension(old_var_name, new_var_name)
+        grouppath = self.split_group(old)[0]
+        old_var_name = self.get_varname(old).rpartition('/')[2]
+        new_var_name = self.get_varname(new).rpartition('/')[2]
+        group = self.get_group(grouppath)
+        with self.lock:
+            try:
+                group.renameVariable(old_var_name, new_var_name)
+                # if this is a Dimension Variable,
+                # also rename corresponding dimension
+                if old_var_name in group.dimensions:
+                    group.renameDimension(old_var_name, new_var_name)
+            finally:
+                # dimension names of other variables may have changed too
+                self.refresh()
 
     def set_variable(self, newvariable):
         """Creates a variable in the dataset if it does not exist
         TODO: More user control over type etc."""
-        self.dataset.createVariable(newvariable, datatype='i')
+        with self.lock:
+            self.dataset.createVariable(newvariable, datatype='i')
+            self.refresh_variable(self.get_varname(newvariable))
 
     def set_dimension_variable(self, path, values_buf):
         """Update a dimension variable (lat/lon) given its path
@@ -487,27 +2917,39 @@ class NCFS(object):
                 st_nlink=1,
                 st_size=4096,
                 st_uid=os.getuid())
-        if path == "/":
+        if self.read_only:
+            statdict['st_mode'] = 0o100444
+        # classify path with a single lookup in the namespace index
+        kind = self.kind(path)
+        if kind in (SLICE_DIR, SLICE_DATA, VAR_DATA):
+            # slices change together with their Variable's data, and
+            # all representations of data with DATA_REPR
+            node = '/' + self.get_varname(path)
+            if kind != SLICE_DIR:
+                node += '/DATA_REPR'
+            statdict['st_mtime'] = statdict['st_ctime'] = self.mtime(node)
+        else:
+            statdict['st_mtime'] = statdict['st_ctime'] = self.mtime(path)
+        if kind == ROOT:
             statdict = self.makeIntoDir(statdict)
         elif self.is_blacklisted(path):
             return statdict
-        elif not self.exists(path):
+        elif kind is None:
             log.debug('getattr: %s does not exist' % path)
             raise FuseOSError(errno.ENOENT)
-        elif self.is_var_dir(path):
+        elif kind in (VAR_DIR, SLICE_DIR, GROUP_DIR):
             statdict = self.makeIntoDir(statdict)
             statdict["st_size"] = 4096
-        elif self.is_var_attr(path):
+        elif kind == VAR_ATTR:
             attr = self.get_var_attr(path)
             statdict["st_size"] = self.attr_repr.size(attr)
-        elif self.is_var_data(path):
-            var = self.get_variable(path)
-            statdict["st_size"] = self.vardata_repr.size(var)
-        elif self.is_global_attr(path):
+        elif kind in (VAR_DATA, SLICE_DATA):
+            statdict["st_size"] = self.data_size(path, kind)
+        elif kind == GLOBAL_ATTR:
             # make sensible statdict entry for global attrs
             global_attr = self.get_global_attr(path)
             statdict["st_size"] = self.attr_repr.size(global_attr)
-        elif self.is_var_dimensions(path):
+        elif kind == VAR_DIMENSIONS:
             dimnames = self.get_var_dimnames(path)
             statdict["st_size"] = self.dimnames_repr.size(dimnames)
         else:
@@ -515,10 +2957,62 @@ class NCFS(object):
             raise InternalError('getattr: unexpected path {}'.format(path))
         return statdict
 
+    def data_size(self, path, kind=VAR_DATA):
+        """
+        Return size of data representation file at path. Sizes which only
+        depend on metadata are computed from the snapshot, others (e.g. of
+        text whose elements differ in width) holding the lock, when first
+        needed, and remembered.
+        """
+        size = self._data_sizes.get(path, None)
+        if size is not None:
+            return size
+        plugin = self.data_repr(path)
+        if hasattr(plugin, 'fixed_size'):
+            var = self.data_metadata(path, kind)
+            if var is not None:
+                size = plugin.fixed_size(var)
+                if size is not None:
+                    return size
+        if kind == SLICE_DATA:
+            var = self.get_slice(path)
+        else:
+            var = self.data_view(self.get_variable(path), path)
+        with self.lock:
+            size = self.data_repr(path).size(var)
+            self._data_sizes[path] = size
+        return size
+
+    def variable_metadata(self, varname):
+        """ Return VariableMetadata of Variable in the snapshot, or None """
+        info = self.snapshot.variables.get(varname, None)
+        if info is None or info.dtype is None:
+            return None
+        return VariableMetadata(varname, info)
+
+    def data_metadata(self, path, kind=VAR_DATA):
+        """
+        Return VariableMetadata (or its view) of data presented at path,
+        like data_view (or get_slice) return the Variable, or None
+        """
+        if kind == SLICE_DATA:
+            resolved = self.resolve_slice(path)
+            if resolved is None:
+                return None
+            varname, index, _ = resolved
+        else:
+            varname, index = self.get_varname(path), None
+        var = self.variable_metadata(varname)
+        if var is None:
+            return None
+        var = self.data_view(var, path)
+        return var if index is None else VariableSlice(var, index)
+
     def getxattr(self, name):
         """ for now it is fake """
         return 'foo'
 
+    @writable
     def removexattr(self, name):
         return 0
 
@@ -532,12 +3026,28 @@ class NCFS(object):
         if path == "":
             # Get a list of netCDF variables and the global attrs
             all_variables = self.getncVariables()
+            groups = self.snapshot.groups[''].groups
             global_attributes = self.getncGlobalAttrs()
-            return (['.', '..'] + all_variables + global_attributes)
+            return (['.', '..'] + all_variables + groups + global_attributes)
+        # If we are in a group directory
+        elif self.kind('/' + path) == GROUP_DIR:
+            path = path.rstrip('/')
+            self.load_group(path)
+            group = self.snapshot.groups[path]
+            return (['.', '..'] + self.snapshot.group_variables(path) +
+                    group.groups + list(group.attrs))
         # If we are in a variable directory
-        elif path in self.dataset.variables:
+        elif path in self.snapshot.variables:
             local_attrs = self.getncAttrs(path)
-            return ['.', '..'] + local_attrs + ["DATA_REPR"] + ["DIMENSIONS"]
+            entries = local_attrs + self.data_files(path) + ["DIMENSIONS"]
+            if self.split_axes:
+                entries += self.slice_entries(path, 0)
+            return ['.', '..'] + entries
+        # If we are in a slice (e.g. time step) of a variable
+        elif self.kind('/' + path) == SLICE_DIR:
+            varname, index, _ = self.resolve_slice(path)
+            return (['.', '..'] + self.data_files(varname) +
+                    self.slice_entries(varname, len(index)))
         else:
             return ['.', '..']
 
@@ -552,8 +3062,18 @@ class NCFS(object):
 
     def open(self, path, flags):
         if not self.is_file(path):
-            return errno.ENOENT
-        return 0
+            raise FuseOSError(errno.ENOENT)
+        if self.read_only and flags & (os.O_WRONLY | os.O_RDWR | os.O_TRUNC):
+            raise FuseOSError(errno.EROFS)
+        if flags & (os.O_WRONLY | os.O_RDWR) and self.is_read_only_data(path):
+            # rather than failing when the written file is released
+            raise FuseOSError(errno.EACCES)
+        fh = next(self._file_handles)
+        # mounted with atomic_o_trunc, so that O_TRUNC comes with open
+        # rather than as truncate of a file which is not open yet
+        if flags & os.O_TRUNC and flags & (os.O_WRONLY | os.O_RDWR):
+            self.truncate(path, 0, fh)
+        return fh
 
     def read(self, path, size, offset):
         if self.is_var_attr(path):
@@ -563,25 +3083,37 @@ class NCFS(object):
             glob_attr = self.get_global_attr(path)
             return self.attr_repr(glob_attr)[offset:offset+size]
         elif self.is_var_data(path):
-            var = self.get_variable(path)
-            return self.vardata_repr(var)[offset:offset+size]
+            var = self.data_view(self.get_variable(path), path)
+            with self.lock:
+                return self.data_repr(path).read(var, size, offset)
+        elif self.kind(path) == SLICE_DATA:
+            var_slice = self.get_slice(path)
+            with self.lock:
+                return self.data_repr(path).read(var_slice, size, offset)
         elif self.is_var_dimensions(path):
             dimnames = self.get_var_dimnames(path)
             return self.dimnames_repr.encode(dimnames)[offset:offset+size]
         else:
             raise InternalError('read(): unexpected path %s' % path)
 
+    @writable
+    @synchronized
     def create(self, path, mode):
+        self.invalidate(path)
         if self.is_var_attr(path):
             self.set_var_attr(path, '')
         elif self.is_global_attr(path):
             self.set_global_attr(path, '')
         else:
             raise InternalError('create(): unexpected path %s' % path)
-        return 0
+        self.touch(path, os.path.dirname(path))
+        return next(self._file_handles)
 
+    @writable
+    @synchronized
     def mkdir(self, path, mode):
         """Directories are variables in the ncfs"""
+        self.write_attrs()
         log.debug("Attempting mkdir with %s" % path)
         if self.is_var_dir(path):
             log.debug("is_dir_true!")
@@ -589,9 +3121,110 @@ class NCFS(object):
         else:
             raise InternalError('Cannot create a variable (directory) here: %s'
                                 % path)
+        self.touch(path, '/')
         return 0
 
+    def write_buffer(self, path, fh, overwrite=False, edit=False):
+        """
+        Return WriteBuffer of data representation opened as fh. Its
+        current contents are only generated if it is not overwritten,
+        and (for edits) if the plugin cannot patch Variable's data.
+        """
+        buf = self._write_buffers.get(fh, None)
+        if buf is None or buf.path != path:
+            buf = WriteBuffer(path)
+            self._write_buffers[fh] = buf
+        if buf.data is None:
+            if overwrite:
+                buf.load(b'')
+            elif not (edit and hasattr(self.data_repr(path), 'patch')):
+                var = self.data_view(self.get_variable(path), path)
+                data = self.data_repr(path)(var)
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                buf.load(data)
+        return buf
+
+    def attr_buffer(self, path, fh):
+        """ Return WriteBuffer of attribute file opened as fh """
+        buf = self._write_buffers.get(fh, None)
+        if buf is None or buf.path != path:
+            if self.is_var_attr(path):
+                kind, value = VAR_ATTR, self.get_var_attr(path)
+            else:
+                kind, value = GLOBAL_ATTR, self.get_global_attr(path)
+            buf = WriteBuffer(path, self.attr_repr(value).encode('utf-8'),
+                              kind)
+            self._write_buffers[fh] = buf
+        return buf
+
+    @synchronized
+    def commit(self, fh):
+        """
+        Update Variable's data (or attribute) from edited representation
+        in write buffer of file handle fh (if it was modified)
+        """
+        buf = self._write_buffers.get(fh, None)
+        if buf is None or not buf.dirty:
+            return
+        buf.dirty = False
+        if buf.kind != VAR_DATA:
+            value = bytes(buf.data).decode('utf-8')
+            self.touch(buf.path)
+            if buf.kind == VAR_ATTR:
+                if self.get_variable(buf.path) is None:
+                    raise FuseOSError(errno.ENOENT)
+                self.set_var_attr(buf.path, value)
+            else:
+                self.set_global_attr(buf.path, value)
+            return
+        # data may depend on attributes set but not written yet
+        self.write_attrs()
+        # all data files of the Variable share the mtime of DATA_REPR
+        self.touch('/' + self.get_varname(buf.path) + '/DATA_REPR')
+        self._slice_axes = {}
+        self._data_sizes = {}
+        var = self.get_variable(buf.path)
+        if var is None:
+            # variable was deleted or renamed while file was open
+            raise FuseOSError(errno.ENOENT)
+        var = self.data_view(var, buf.path)
+        # the plugin drops whatever it has cached that the edit made stale,
+        # others drop everything (but what the plugin says is still valid)
+        plugin = self.data_repr(buf.path)
+        try:
+            if buf.data is None:
+                edits, buf.edits = buf.edits, []
+                keep = plugin.patch(var, edits)
+            else:
+                keep = plugin.update(var, buf.data) or ()
+        except NotImplementedError:
+            # representation cannot be converted back to data
+            raise FuseOSError(errno.EACCES)
+        for other in self.vardata_plugins():
+            if other is not plugin:
+                other.invalidate(var, keep)
+
+    @writable
+    @synchronized
     def write(self, path, buf, offset, fh=0):
+        if self.is_read_only_data(path):
+            # e.g. PNG images; never reach plugin's update
+            raise FuseOSError(errno.EACCES)
+        # Writing to a Variable file that is a dimension (i.e. lat/lon);
+        # edits are buffered and committed on flush/fsync/release
+        if self.is_dimension_variable(path):
+            overwrite = (offset == 0 and
+                         len(buf) >= self.getattr(path)['st_size'])
+            self.write_buffer(path, fh, overwrite, edit=True).write(
+                    buf, offset)
+            return len(buf)
+        if fh and (self.is_var_attr(path) or self.is_global_attr(path)):
+            # so are writes to attributes, which are set on close
+            self.attr_buffer(path, fh).write(buf, offset)
+            return len(buf)
+        self.invalidate(path)
+        self.touch(path)
         # Writing to a Variable Attribute
         if self.is_var_attr(path):
             attr = self.get_var_attr(path)
@@ -615,41 +3248,60 @@ class NCFS(object):
             # convert updated string representation back to list of names
             new_dimnames = self.dimnames_repr.decode(new_dimnames_repr)
             try:
-                self.rename_dims_and_dimvars(old_dimnames, new_dimnames)
-            except ValueError:
+                self.rename_dims_and_dimvars(old_dimnames, new_dimnames,
+                                             self.get_varname(path))
+            except (ValueError, KeyError):
                 # ignore invalid edit, show "permission denied" to user
                 raise FuseOSError(errno.EACCES)
             return len(buf)
-        # Writing to a Variable file that is a dimension (i.e. lat/lon)
-        elif self.is_dimension_variable(path):
-            dimvar = self.get_variable(path)
-            self.vardata_repr.write(dimvar, buf, offset)
-            return len(buf)
         else:
             raise InternalError('write(): unexpected path %s' % path)
 
-    def truncate(self, path, length):
+    @writable
+    @synchronized
+    def truncate(self, path, length, fh=None):
         """ Truncate a file that is being writtem to, i.e. when
         removing lines etc. Note that truncate is also called when
         the size of the file is being extended as well as shrunk"""
+        if self.is_read_only_data(path):
+            raise FuseOSError(errno.EACCES)
+        if self.is_dimension_variable(path):
+            # like writes, truncates of data representation are buffered
+            if fh is not None:
+                self.write_buffer(path, fh, length == 0).truncate(length)
+            elif length != self.getattr(path)['st_size']:
+                # representation of other size cannot be converted back
+                raise FuseOSError(errno.EACCES)
+            return 0
+        if fh is not None and (self.is_var_attr(path) or
+                               self.is_global_attr(path)):
+            # attribute open for writing, set on close
+            self.attr_buffer(path, fh).truncate(length)
+            return 0
+        self.invalidate(path)
+        self.touch(path)
         if self.is_global_attr(path):
+            grouppath = self.split_group(path)[0]
             attr_name = self.get_global_attr_name(path)
             old_val = self.get_global_attr(path)
             new_val = old_val.ljust(length)[0:length]
-            self.dataset.setncattr(attr_name, new_val)
-        if self.is_var_attr(path):
-            var = self.get_variable(path)
+            self.queue_attr((GROUP_DIR, grouppath), attr_name, new_val)
+        elif self.is_var_attr(path):
             attr_name = self.get_attrname(path)
             old_val = self.get_var_attr(path)
             new_val = old_val.ljust(length)[0:length]
-            var.setncattr(attr_name, new_val)
-        else:
-            return 0
+            self.queue_attr((VAR_DIR, self.get_varname(path)),
+                            attr_name, new_val)
+        return 0
 
+    @writable
+    @synchronized
     def rename(self, old, new):
         """
         Rename a component of a netcdf variable
         """
+        self.write_attrs()
+        self.invalidate(old)
         # Rename a variable attribute
         if self.is_var_attr(old):
             self.rename_var_attr(old, new)
@@ -662,11 +3314,16 @@ class NCFS(object):
         else:
             raise InternalError('rename(): not implemented for this op on %s'
                                 % old)
+        self.touch(os.path.dirname(old), new, os.path.dirname(new))
         return 0
 
+    @writable
+    @synchronized
     def unlink(self, path):
         if not self.exists(path):
             return 0
+        self.write_attrs()
+        self.invalidate(path)
         if self.is_var_attr(path):
             self.del_var_attr(path)
         elif self.is_var_dir(path):
@@ -675,32 +3332,257 @@ class NCFS(object):
             self.del_global_attr(path)
         else:
             raise InternalError('unlink(): unexpected path %s' % path)
+        self.touch(os.path.dirname(path))
         return 0
 
-    def close(self, fh):
-        pass
+    def flush(self, path, fh=0):
+        """ Called on every close(2) of a file; errors are reported """
+        self.commit(fh)
+        return 0
+
+    def fsync(self, path, datasync, fh=0):
+        if not self.read_only:
+            self.commit(fh)
+            with self.lock:
+                self.write_attrs()
+                self.dataset.sync()
+            self.check_attrs()
+        return 0
 
+    def release(self, path, fh=0):
+        """ Called when the last reference to an open file is closed """
+        try:
+            self.commit(fh)
+        finally:
+            self._write_buffers.pop(fh, None)
+        return 0
 
-class NCFSOperations(Operations):
-    """Inherit from the base fusepy Operations class"""
+    def close(self):
+        """ Drop cached representations of all Variables, close Dataset """
+        with self.lock:
+            if not self.read_only:
+                self.write_attrs()
+            self._closed = True
+            for plugin in self.vardata_plugins():
+                # plugins must not keep (references to) closed Variables
+                forget = getattr(plugin, 'forget', plugin.invalidate)
+                for varname in self.snapshot.variables:
+                    var = self.find_variable(varname)
+                    if var is not None:
+                        forget(var)
+            self.dataset.close()
+
+
+class MountedFile(object):
+    """ NCFS of one file of an NCFSDirectory, and its usage """
+
+    def __init__(self, ncfs):
+        self.ncfs = ncfs
+        self.last_used = time.time()
+        # number of open file handles and of operations in progress
+        self.users = 0
 
-    def __getattribute__(self, name):
-        """ Intercept and print all method calls """
-        attr = object.__getattribute__(self, name)
-        if hasattr(attr, '__call__'):
-            def newfunc(*args, **kwargs):
-                func_args = [repr(x) for x in args]
-                func_kwargs = ['{}={}'.format(k, repr(v)) for k, v in kwargs]
-                func_args.extend(func_kwargs)
-                # print  name of the function and argument values
-                log.debug('{}({})'.format(name, ', '.join(func_args)))
-                result = attr(*args, **kwargs)
-                # print return value
-                # log.debug('{}() returned {}'.format(name, repr(result)))
-                return result
-            return newfunc
+
+class NCFSDirectory(object):
+    """
+    All NetCDF files of a directory under one mountpoint, as
+    /file.nc/<var>/... - a drop-in replacement for NCFS.
+
+    NCFS of a file is created (by open_ncfs(path)) when the file is
+    first accessed, and closed when it was not used for idle_timeout
+    seconds, or when more than max_open files are open. Files with
+    open file handles are never closed.
+    """
+
+    EXTENSIONS = ('.nc', '.nc4', '.cdf', '.netcdf')
+
+    def __init__(self, directory, open_ncfs, max_open=16, idle_timeout=300):
+        self.directory = directory
+        self._open_ncfs = open_ncfs
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.mount_time = time.time()
+        # file name -> MountedFile, least recently used first
+        self._mounted = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def names(self):
+        """ Return names of NetCDF files in the directory """
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.lower().endswith(self.EXTENSIONS) and
+            os.path.isfile(os.path.join(self.directory, name)))
+
+    def split(self, path):
+        """ Split path into file name and path within the file """
+        parts = path.lstrip('/').split('/', 1)
+        name = parts[0]
+        if name not in self._mounted and (
+                not name.lower().endswith(self.EXTENSIONS) or
+                not os.path.isfile(os.path.join(self.directory, name))):
+            raise FuseOSError(errno.ENOENT)
+        return name, '/' + (parts[1] if len(parts) > 1 else '')
+
+    def _acquire(self, name):
+        """ Return MountedFile of file name, mounting it if needed """
+        with self._lock:
+            mounted = self._mounted.pop(name, None)
+            if mounted is None:
+                self._close_idle(self.max_open - 1)
+                path = os.path.join(self.directory, name)
+                log.info('mounting {}'.format(path))
+                mounted = MountedFile(self._open_ncfs(path))
+            self._mounted[name] = mounted
+            mounted.users += 1
+            mounted.last_used = time.time()
+            if self._reaper is None and self.idle_timeout:
+                self._reaper = threading.Thread(target=self._reap)
+                self._reaper.daemon = True
+                self._reaper.start()
+            return mounted
+
+    def _release(self, mounted):
+        with self._lock:
+            mounted.users -= 1
+            mounted.last_used = time.time()
+
+    def _close_idle(self, max_open, now=None):
+        """
+        Close files not in use, least recently used first, while more
+        than max_open files are open or while they have been idle
+        for longer than idle_timeout. Must be called holding _lock.
+        """
+        now = now if now is not None else time.time()
+        for name, mounted in list(self._mounted.items()):
+            if mounted.users:
+                continue
+            idle = now - mounted.last_used
+            if len(self._mounted) > max_open or idle >= self.idle_timeout:
+                log.info('unmounting {}'.format(name))
+                del self._mounted[name]
+                mounted.ncfs.close()
+
+    def close_idle(self, now=None):
+        """ Close all files idle for longer than idle_timeout """
+        with self._lock:
+            self._close_idle(self.max_open, now)
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            self.close_idle()
+
+    def close(self):
+        """ Close all files """
+        with self._lock:
+            while self._mounted:
+                self._mounted.popitem()[1].ncfs.close()
+
+    def _call(self, method, path, *args):
+        """ Call method of NCFS of the file holding path """
+        name, subpath = self.split(path)
+        mounted = self._acquire(name)
+        try:
+            return getattr(mounted.ncfs, method)(subpath, *args)
+        finally:
+            self._release(mounted)
+
+    def getattr(self, path):
+        if path == '/':
+            st = os.stat(self.directory)
+        elif path.count('/') == 1:
+            # no need to open a file just to list it
+            st = os.stat(os.path.join(self.directory, self.split(path)[0]))
         else:
-            return attr
+            return self._call('getattr', path)
+        statdict = dict(
+                st_atime=st.st_atime,
+                st_ctime=st.st_ctime,
+                st_gid=os.getgid(),
+                st_mode=0o100644,
+                st_mtime=st.st_mtime,
+                st_nlink=1,
+                st_size=4096,
+                st_uid=os.getuid())
+        return NCFS.makeIntoDir(statdict)
+
+    def readdir(self, path):
+        if path == '/':
+            return ['.', '..'] + self.names()
+        return self._call('readdir', path)
+
+    def getxattr(self, name):
+        return 'foo'
+
+    def removexattr(self, name):
+        return 0
+
+    def access(self, mode):
+        if not os.access(self.directory, mode):
+            raise FuseOSError(errno.EACCES)
+
+    def open(self, path, flags):
+        name, subpath = self.split(path)
+        mounted = self._acquire(name)
+        try:
+            return mounted.ncfs.open(subpath, flags)
+        except Exception:
+            # file handle was not opened, file is not in use
+            self._release(mounted)
+            raise
+
+    def create(self, path, mode):
+        name, subpath = self.split(path)
+        mounted = self._acquire(name)
+        try:
+            return mounted.ncfs.create(subpath, mode)
+        except Exception:
+            self._release(mounted)
+            raise
+
+    def release(self, path, fh=0):
+        name, subpath = self.split(path)
+        mounted = self._mounted.get(name, None)
+        if mounted is None:
+            return 0
+        try:
+            return mounted.ncfs.release(subpath, fh)
+        finally:
+            # release the use taken by open() or create()
+            self._release(mounted)
+
+    def read(self, path, size, offset):
+        return self._call('read', path, size, offset)
+
+    def write(self, path, buf, offset, fh=0):
+        return self._call('write', path, buf, offset, fh)
+
+    def truncate(self, path, length, fh=None):
+        return self._call('truncate', path, length, fh)
+
+    def flush(self, path, fh=0):
+        return self._call('flush', path, fh)
+
+    def fsync(self, path, datasync, fh=0):
+        return self._call('fsync', path, datasync, fh)
+
+    def mkdir(self, path, mode):
+        return self._call('mkdir', path, mode)
+
+    def unlink(self, path):
+        return self._call('unlink', path)
+
+    def rename(self, old, new):
+        old_name, old_subpath = self.split(old)
+        new_name, new_subpath = self.split(new)
+        if old_name != new_name:
+            raise FuseOSError(errno.EXDEV)
+        return self._call('rename', old, new_subpath)
+
+
+class NCFSOperations(Operations):
+    """Inherit from the base fusepy Operations class"""
 
     def __init__(self, ncfs):
         self.ncfs = ncfs
@@ -718,7 +3600,11 @@ class NCFSOperations(Operations):
         self.ncfs.access(mode)
 
     def read(self, path, size, offset, fh):
-        return self.ncfs.read(path, size, offset)
+        data = self.ncfs.read(path, size, offset)
+        if isinstance(data, memoryview):
+            # fusepy needs bytes to copy into the kernel's buffer
+            return data.tobytes()
+        return data
 
     def write(self, path, data, offset):
         return self.ncfs.write(path, data, offset)
@@ -739,7 +3625,13 @@ class NCFSOperations(Operations):
         return self.ncfs.readdir(path)
 
     def release(self, path, fh):
-        return self.ncfs.close(fh)
+        return self.ncfs.release(path, fh)
+
+    def flush(self, path, fh):
+        return self.ncfs.flush(path, fh)
+
+    def fsync(self, path, datasync, fh):
+        return self.ncfs.fsync(path, datasync, fh)
 
     def statfs(self, path):
         # Need to think about this one some more...
@@ -769,7 +3661,7 @@ class NCFSOperations(Operations):
 
     def truncate(self, path, length, fh=None):
         """Used when shortening files etc. (I.e. removing lines) """
-        return self.ncfs.truncate(path, length)
+        return self.ncfs.truncate(path, length, fh)
 
     def unlink(self, path):
         return self.ncfs.unlink(path)
@@ -797,6 +3689,200 @@ class NCFSOperations(Operations):
     """
 
 
+#
+# Tracing and statistics of FUSE operations
+#
+
+
+class OperationStats(object):
+    """
+    Per-operation call counts, error counts, numbers of bytes
+    read/written and histograms of latencies.
+    """
+
+    # upper bounds (in microseconds) of latency histogram buckets
+    BUCKETS = [2**i for i in range(0, 25, 2)]
+
+    def __init__(self):
+        # operation name -> [calls, errors, bytes, seconds, histogram]
+        self._ops = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds, nbytes=0, error=False):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds * 1e6)
+        with self._lock:
+            counters = self._ops.get(op)
+            if counters is None:
+                counters = [0, 0, 0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+                self._ops[op] = counters
+            counters[0] += 1
+            counters[1] += int(error)
+            counters[2] += nbytes
+            counters[3] += seconds
+            counters[4][bucket] += 1
+
+    def calls(self, op):
+        with self._lock:
+            return self._ops[op][0] if op in self._ops else 0
+
+    def report(self):
+        """ Return text report of statistics of all operations """
+        lines = []
+        with self._lock:
+            for op in sorted(self._ops):
+                calls, errors, nbytes, seconds, hist = self._ops[op]
+                lines.append(
+                    '{} calls={} errors={} bytes={} total={:.6f}s '
+                    'mean={:.1f}us'.format(
+                        op, calls, errors, nbytes, seconds,
+                        seconds / calls * 1e6))
+                buckets = ['<{}us:{}'.format(bound, count) for bound, count
+                           in zip(self.BUCKETS, hist) if count]
+                if hist[-1]:
+                    buckets.append('>={}us:{}'.format(
+                        self.BUCKETS[-1], hist[-1]))
+                lines.append('  latency ' + ' '.join(buckets))
+        return ''.join(line + '\n' for line in lines)
+
+
+def short_repr(value, limit=64):
+    """ Return repr of value; long strings (e.g. write buffers) are
+    summarised instead of being printed in full """
+    if isinstance(value, (bytes, str)) and len(value) > limit:
+        return '<{} bytes>'.format(len(value))
+    return repr(value)
+
+
+def traced_method(name, method, stats, log_calls):
+    """ Wrap method of FUSE Operations so that its calls are logged
+    and/or recorded in stats """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if log_calls:
+            func_args = [short_repr(x) for x in args]
+            func_args.extend('{}={}'.format(k, short_repr(v))
+                             for k, v in kwargs.items())
+            log.debug('{}({})'.format(name, ', '.join(func_args)))
+        if stats is None:
+            return method(self, *args, **kwargs)
+        nbytes = 0
+        error = True
+        start = time.time()
+        try:
+            result = method(self, *args, **kwargs)
+            error = False
+            if name == 'read' and result:
+                nbytes = len(result)
+            elif name == 'write':
+                nbytes = len(args[1])
+            return result
+        finally:
+            stats.record(name, time.time() - start, nbytes, error)
+    return wrapper
+
+
+def traced(cls, stats=None, log_calls=False):
+    """
+    Return subclass of FUSE Operations class cls, with all operations
+    wrapped by traced_method. Wrappers are created once, when the class
+    is created, and only if tracing is enabled - cls itself is left
+    untouched and has no overhead.
+    """
+    methods = {}
+    for klass in reversed(cls.__mro__):
+        if not issubclass(klass, Operations):
+            continue
+        for name, attr in vars(klass).items():
+            if not name.startswith('_') and inspect.isfunction(attr):
+                methods[name] = traced_method(name, attr, stats, log_calls)
+    return type('Traced' + cls.__name__, (cls,), methods)
+
+
+class NCFSStatsOperations(NCFSOperations):
+    """
+    NCFSOperations with a virtual /.ncfs/stats file,
+    presenting statistics of FUSE operations.
+    """
+
+    STATS_DIR = '/.ncfs'
+    STATS_FILE = '/.ncfs/stats'
+
+    def __init__(self, ncfs, stats):
+        NCFSOperations.__init__(self, ncfs)
+        self.stats = stats
+        # report is generated when file is stat'ed (i.e. before
+        # it is opened), so that its size matches its contents
+        self._report = b''
+
+    def _statdict(self, size):
+        return dict(
+            st_atime=time.time(),
+            st_ctime=self.ncfs.mount_time,
+            st_gid=os.getgid(),
+            st_mode=0o100444,
+            st_mtime=time.time(),
+            st_nlink=1,
+            st_size=size,
+            st_uid=os.getuid())
+
+    def getattr(self, path, fh=None):
+        if path == self.STATS_DIR:
+            return NCFS.makeIntoDir(self._statdict(4096))
+        elif path == self.STATS_FILE:
+            self._report = self.stats.report().encode('utf-8')
+            return self._statdict(len(self._report))
+        return NCFSOperations.getattr(self, path, fh)
+
+    def readdir(self, path, fh):
+        if path == self.STATS_DIR:
+            return ['.', '..', 'stats']
+        entries = NCFSOperations.readdir(self, path, fh)
+        if path == '/':
+            entries = entries + [self.STATS_DIR.lstrip('/')]
+        return entries
+
+    def open(self, path, flags):
+        if path == self.STATS_FILE:
+            return 0
+        return NCFSOperations.open(self, path, flags)
+
+    def read(self, path, size, offset, fh):
+        if path == self.STATS_FILE:
+            return self._report[offset:offset+size]
+        return NCFSOperations.read(self, path, size, offset, fh)
+
+
+def vardata_plugins(extensions, cache, lock, fmt='%f', missing='fill',
+                    index_dir=None, prefetch=True):
+    """
+    Return plugin of DATA_REPR files, and mapping of names of the other
+    data files (e.g. 'DATA.bin') to their plugins, for the extensions.
+    All plugins share the cache, and the data reader: if prefetch is
+    set, data of chunked variables is read whole chunks at a time, and
+    ahead, holding the lock (which must be that of the NCFS).
+    """
+    reader = read_flat
+    if prefetch:
+        reader = ChunkPrefetcher(cache, lock).read_flat
+    vardata_repr = VardataAsFlatTextFiles(
+            fmt=fmt, cache=cache, reader=reader, missing=missing,
+            index_dir=index_dir)
+    # binary representations have no empty fields
+    binary_missing = 'nan' if missing == 'nan' else 'fill'
+    data_reprs = OrderedDict()
+    for ext in extensions:
+        cls = VARDATA_FORMATS[ext]
+        if cls is VardataAsFlatTextFiles:
+            plugin = vardata_repr
+        elif issubclass(cls, VardataAsFlatTextFiles):
+            plugin = cls(fmt=fmt, cache=cache, reader=reader,
+                         missing=missing, index_dir=index_dir)
+        else:
+            plugin = cls(cache=cache, reader=reader, missing=binary_missing)
+        data_reprs['DATA.' + ext] = plugin
+    return vardata_repr, data_reprs
+
+
 def main():
     """
     This function is our Composition Root & we are using Pure DI (a.k.a.
@@ -815,9 +3901,14 @@ def main():
             prog='ncfs')
 
     parser.add_argument(
-            dest='ncpath',
+            dest='ncpaths',
             metavar='PATH',
-            help='NetCDF file to be mounted')
+            nargs='+',
+            help='NetCDF file to be mounted; if more files (or a quoted '
+                 'glob pattern) are given, they are presented as one '
+                 'dataset, concatenated along the record dimension; '
+                 'if a directory is given, all its NetCDF files are '
+                 'presented as subdirectories')
 
     parser.add_argument(
             dest='mountpoint',
@@ -831,6 +3922,165 @@ def main():
             default=0,
             help='be verbose (-vv for debug messages)')
 
+    parser.add_argument(
+            '--trace',
+            dest='trace',
+            action='store_true',
+            help='collect statistics of filesystem operations '
+                 '(presented in /.ncfs/stats)')
+
+    parser.add_argument(
+            '-c', '--cache-size',
+            dest='cache_size',
+            metavar='MB',
+            type=int,
+            default=64,
+            help='memory budget for cached data representations '
+                 '(default: %(default)s MB)')
+
+    parser.add_argument(
+            '--attr-batch',
+            dest='attr_batch',
+            metavar='SEC',
+            type=float,
+            default=0,
+            help='collect changes of attributes for SEC seconds, and '
+                 'write all changes of a variable (or group) at once, '
+                 'updating the header of the file once (default: %(default)s)')
+
+    parser.add_argument(
+            '--no-preload',
+            dest='preload',
+            action='store_false',
+            help='read metadata of groups only when they are first '
+                 'accessed, instead of in the background after mounting')
+
+    parser.add_argument(
+            '--index-dir',
+            dest='index_dir',
+            metavar='DIR',
+            help='save indexes of text data files (with formats of '
+                 'varying width) in DIR, so that they need not be built '
+                 'again when an unchanged NetCDF file is mounted again')
+
+    parser.add_argument(
+            '-t', '--threads',
+            dest='threads',
+            action='store_true',
+            help='serve FUSE requests in multiple threads; metadata '
+                 'requests are then not blocked by slow data reads')
+
+    parser.add_argument(
+            '-f', '--format',
+            dest='data_format',
+            metavar='FMT',
+            default='%f',
+            help='printf-style format of data values in DATA_REPR files; '
+                 'use explicit field width (e.g. %%+14.6e) for fast access '
+                 'to large variables (default: %(default)s)')
+
+    parser.add_argument(
+            '-d', '--data-files',
+            dest='data_files',
+            metavar='EXT[,EXT...]',
+            default=','.join(DEFAULT_DATA_FILES),
+            help='additional representations of data, presented as '
+                 'DATA.<ext> files next to DATA_REPR; one or more of '
+                 '{} (default: %(default)s), or none'.format(
+                     ', '.join(VARDATA_FORMATS)))
+
+    parser.add_argument(
+            '--missing',
+            dest='missing',
+            choices=['fill', 'nan', 'empty'],
+            default='fill',
+            help='how missing (masked) values are presented in data files: '
+                 'as the fill value, as nan, or as empty fields (nan in '
+                 'binary files of floating point data) '
+                 '(default: %(default)s)')
+
+    parser.add_argument(
+            '--packed',
+            dest='packed',
+            action='store_true',
+            help='present packed values (without applying scale_factor '
+                 'and add_offset) in data files of packed variables; their '
+                 'DATA_RAW and DATA_SCALED files present both either way')
+
+    parser.add_argument(
+            '-s', '--split',
+            dest='split_axes',
+            action='store_true',
+            help='present time steps and vertical levels of variables as '
+                 'subdirectories (e.g. /temp/time=2000-01-01/DATA_REPR)')
+
+    parser.add_argument(
+            '-r', '--read-only',
+            dest='read_only',
+            action='store_true',
+            help='open NetCDF file for reading only (e.g. on read-only '
+                 'archive storage); all modifications fail with EROFS')
+
+    parser.add_argument(
+            '--kernel-cache',
+            dest='kernel_cache',
+            action='store_true',
+            help='never invalidate file contents cached by the kernel; '
+                 'only safe with --read-only')
+
+    parser.add_argument(
+            '--auto-cache',
+            dest='auto_cache',
+            action='store_true',
+            help='keep file contents cached by the kernel as long as '
+                 'modification time and size of the file do not change')
+
+    parser.add_argument(
+            '--attr-timeout',
+            dest='attr_timeout',
+            metavar='SEC',
+            type=float,
+            help='how long the kernel caches file attributes (default: 1)')
+
+    parser.add_argument(
+            '--entry-timeout',
+            dest='entry_timeout',
+            metavar='SEC',
+            type=float,
+            help='how long the kernel caches file names (default: 1)')
+
+    parser.add_argument(
+            '--no-prefetch',
+            dest='prefetch',
+            action='store_false',
+            help='do not read chunked variables in whole chunk rows, '
+                 'nor read ahead in the background')
+
+    parser.add_argument(
+            '--aggregate-dim',
+            dest='aggregate_dim',
+            metavar='DIM',
+            help='dimension along which multiple files are concatenated '
+                 '(default: the unlimited or time dimension)')
+
+    parser.add_argument(
+            '--max-open',
+            dest='max_open',
+            metavar='N',
+            type=int,
+            default=16,
+            help='maximum number of aggregated files, or files of a '
+                 'mounted directory, kept open (default: %(default)s)')
+
+    parser.add_argument(
+            '--idle-timeout',
+            dest='idle_timeout',
+            metavar='SEC',
+            type=float,
+            default=300,
+            help='close files of a mounted directory not accessed for '
+                 'this long (default: %(default)s)')
+
     cmdline = parser.parse_args()
 
     # setup logging
@@ -843,20 +4093,92 @@ def main():
         loglevel = log.DEBUG
     log.basicConfig(format='%(levelname)s:%(message)s', level=loglevel)
 
+    ncpaths = []
+    for pattern in cmdline.ncpaths:
+        ncpaths.extend(sorted(glob.glob(pattern)) or [pattern])
+    if len(ncpaths) > 1:
+        # aggregation of many files can only be read
+        cmdline.read_only = True
+    directory = len(ncpaths) == 1 and os.path.isdir(ncpaths[0])
+
+    data_file_extensions = []
+    if cmdline.data_files != 'none':
+        data_file_extensions = cmdline.data_files.split(',')
+    for ext in data_file_extensions:
+        if ext not in VARDATA_FORMATS:
+            parser.error('unknown data file extension: {}'.format(ext))
+
+    # options of kernel caches, passed to FUSE only if given
+    fuse_options = {}
+    for option in ('kernel_cache', 'auto_cache',
+                   'attr_timeout', 'entry_timeout'):
+        value = getattr(cmdline, option)
+        if value not in (None, False):
+            fuse_options[option] = value
+    if cmdline.kernel_cache and not cmdline.read_only:
+        log.warning('--kernel-cache without --read-only: files may show '
+                    'stale contents after being modified; use --auto-cache')
+
     # build the application
 
-    # open file for reading and writing
-    dataset = ncpy.Dataset(cmdline.ncpath, 'r+')
+    # cache of data representations, shared by all plugins (and files);
+    # if data cannot change, entries never need to be invalidated - but
+    # entries of a file of a directory are dropped when it is closed
+    cache = ReprCache(max_bytes=cmdline.cache_size * 2**20,
+                      track_owners=directory or not cmdline.read_only)
+    # lock serializing all calls to libnetcdf
+    lock = threading.RLock()
     # create plugins for generating data, atribute, dimension representations
-    vardata_repr = VardataAsFlatTextFiles(fmt='%f')
+    vardata_repr, data_reprs = vardata_plugins(
+            data_file_extensions, cache, lock, fmt=cmdline.data_format,
+            missing=cmdline.missing, index_dir=cmdline.index_dir,
+            prefetch=cmdline.prefetch)
     attr_repr = AttributesAsTextFiles()
     dimnames_repr = DimNamesAsTextFiles()
+
+    def open_ncfs(path):
+        # open file for reading and writing, unless mounted read-only
+        dataset = ncpy.Dataset(path, 'r' if cmdline.read_only else 'r+')
+        if cmdline.packed:
+            dataset.set_auto_scale(False)
+        return NCFS(dataset, vardata_repr, attr_repr, dimnames_repr,
+                    split_axes=cmdline.split_axes,
+                    read_only=cmdline.read_only, lock=lock,
+                    data_reprs=data_reprs, preload=cmdline.preload,
+                    attr_batch=cmdline.attr_batch)
+
     # create main object implementing NetCDF filesystem functionality
-    ncfs = NCFS(dataset, vardata_repr, attr_repr, dimnames_repr)
+    if directory:
+        # files are mounted when first accessed
+        ncfs = NCFSDirectory(ncpaths[0], open_ncfs, cmdline.max_open,
+                             cmdline.idle_timeout)
+    elif len(ncpaths) > 1:
+        # files are opened when their data is needed (NetCDF4 files also
+        # once at mount, to find their numbers of records)
+        dataset = AggregatedDataset(
+                ncpaths, cmdline.aggregate_dim, cmdline.max_open)
+        if cmdline.packed:
+            dataset.set_auto_scale(False)
+        ncfs = NCFS(dataset, vardata_repr, attr_repr, dimnames_repr,
+                    split_axes=cmdline.split_axes, read_only=True, lock=lock,
+                    data_reprs=data_reprs)
+    else:
+        ncfs = open_ncfs(ncpaths[0])
     # create FUSE Operations (does it need to be a separate class?)
-    ncfs_operations = NCFSOperations(ncfs)
+    # - tracing wrappers are only installed if they are needed
+    log_calls = loglevel <= log.DEBUG
+    if cmdline.trace:
+        stats = OperationStats()
+        ncfs_operations = traced(NCFSStatsOperations, stats, log_calls)(
+                ncfs, stats)
+    elif log_calls:
+        ncfs_operations = traced(NCFSOperations, None, log_calls)(ncfs)
+    else:
+        ncfs_operations = NCFSOperations(ncfs)
     # launch!
-    FUSE(ncfs_operations, cmdline.mountpoint, nothreads=True, foreground=True)
+    FUSE(ncfs_operations, cmdline.mountpoint,
+         nothreads=not cmdline.threads, foreground=True,
+         atomic_o_trunc=True, **fuse_options)
 
 
 if __name__ == "__main__":
@@ -5,11 +5,48 @@ from fusenetcdf.fusenetcdf import DimNamesAsTextFiles
 from fusenetcdf.fusenetcdf import VardataAsFlatTextFiles
 from fusenetcdf.fusenetcdf import AttributesAsTextFiles
 from fusenetcdf.fusenetcdf import write_to_string
+from fusenetcdf.fusenetcdf import flat_slabs
+from fusenetcdf.fusenetcdf import ReprCache
+from fusenetcdf.fusenetcdf import VardataAsBinaryFiles, VardataAsCsvFiles
+from fusenetcdf.fusenetcdf import VardataAsNpyFiles, VariableSlice
+from fusenetcdf.fusenetcdf import ScaledVariable
+from fusenetcdf.fusenetcdf import VardataAsPngFiles, encode_png
+from fusenetcdf.fusenetcdf import data_dtype
+from fusenetcdf.fusenetcdf import fixed_width
+from fusenetcdf.fusenetcdf import NCFSOperations
+from fusenetcdf.fusenetcdf import NCFSStatsOperations
+from fusenetcdf.fusenetcdf import OperationStats
+from fusenetcdf.fusenetcdf import traced
+from fusenetcdf.fusenetcdf import short_repr
+from fusenetcdf.fusenetcdf import ROOT, VAR_DIR, VAR_ATTR, VAR_DATA
+from fusenetcdf.fusenetcdf import VAR_DIMENSIONS, GLOBAL_ATTR
+from fusenetcdf.fusenetcdf import ClassicFileMap
+from fusenetcdf.fusenetcdf import ChunkPrefetcher, chunk_shape
+from fusenetcdf.fusenetcdf import AggregatedDataset, classic_numrecs
+from fusenetcdf.fusenetcdf import read_flat, write_flat, parse_text
+from fusenetcdf.fusenetcdf import NCFSDirectory
+from fusenetcdf.fusenetcdf import SLICE_DIR, SLICE_DATA, GROUP_DIR
+from fusenetcdf.fusenetcdf import cf_axis, axis_labels
 from fuse import FuseOSError
+import os
+import io
 import errno
+import numpy
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+import struct
 
 
 class FakeVariable(object):
+
+    dimensions = ()
+
+    def ncattrs(self):
+        return ['fooattr']
+
     def getncattr(self, name):
         if name == 'fooattr':
             return 'bar'
@@ -24,6 +61,9 @@ class FakeDataset(object):
     def ncattrs(self):
         return {'attr1': 'val1', 'attr2': 'val2'}
 
+    def getncattr(self, name):
+        return self.ncattrs()[name]
+
 
 class TestWriteToString(unittest.TestCase):
 
@@ -355,17 +395,21 @@ class TestEditingVariables(unittest.TestCase):
         self.ds.close()
 
     def test_editing_entire_text_of_dimension_variable(self):
+        self.ncfs.truncate('/y/DATA_REPR', 0, 0)
         self.ncfs.write('/y/DATA_REPR', '7.0\n8.0\n9.0\n', 0)
+        self.ncfs.release('/y/DATA_REPR')
         expected = [7., 8., 9.]
         self.assertEqual(list(self.testvar[:]), expected)
 
     def test_editing_partial_text_of_dimension_variable(self):
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_WRONLY | os.O_TRUNC)
+        self.ncfs.write('/y/DATA_REPR', '7.0\n8.0', 0, fh)
         with self.assertRaises(FuseOSError) as cm:
-            self.ncfs.write('/y/DATA_REPR', '7.0\n8.0', 0)
+            self.ncfs.release('/y/DATA_REPR', fh)
         self.assertEqual(cm.exception.errno, errno.EACCES)
 
-    @unittest.skip
     def test_2writes_followed_by_a_release(self):
+        self.ncfs.truncate('/y/DATA_REPR', 0, 0)
         self.ncfs.write('/y/DATA_REPR', '7.0\n8.0', 0)
         self.ncfs.write('/y/DATA_REPR', '\n9.0\n', 8)
         self.ncfs.release('/y/DATA_REPR')
@@ -373,6 +417,63 @@ class TestEditingVariables(unittest.TestCase):
         expected = [7., 8., 9.]
         self.assertEqual(list(v[:]), expected)
 
+    def test_data_not_changed_before_commit(self):
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_WRONLY)
+        self.ncfs.truncate('/y/DATA_REPR', 0, fh)
+        self.ncfs.write('/y/DATA_REPR', '7.0\n8.0\n9.0\n', 0, fh)
+        self.assertEqual(list(self.testvar[:]), [4., 5., 6.])
+        self.ncfs.fsync('/y/DATA_REPR', 0, fh)
+        self.assertEqual(list(self.testvar[:]), [7., 8., 9.])
+        self.ncfs.release('/y/DATA_REPR', fh)
+
+    def test_chunked_writes_after_truncate_on_open(self):
+        # e.g. shell redirection: open(O_TRUNC), writes
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_WRONLY | os.O_TRUNC)
+        for offset, chunk in [(0, '4.'), (2, '0\n5'), (5, '.0\n'), (8, '6.0')]:
+            self.ncfs.write('/y/DATA_REPR', chunk, offset, fh)
+        self.ncfs.flush('/y/DATA_REPR', fh)
+        self.ncfs.release('/y/DATA_REPR', fh)
+        self.assertEqual(list(self.testvar[:]), [4., 5., 6.])
+
+    def test_truncate_of_file_not_open(self):
+        size = self.ncfs.getattr('/y/DATA_REPR')['st_size']
+        self.assertEqual(self.ncfs.truncate('/y/DATA_REPR', size), 0)
+        with self.assertRaises(FuseOSError) as cm:
+            self.ncfs.truncate('/y/DATA_REPR', 0)
+        self.assertEqual(cm.exception.errno, errno.EACCES)
+        # a later open is not affected
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_RDWR)
+        self.ncfs.write('/y/DATA_REPR', '7', 9, fh)
+        self.ncfs.release('/y/DATA_REPR', fh)
+        self.assertEqual(list(self.testvar[:]), [4., 7., 6.])
+
+    def test_partial_write_keeps_rest_of_text(self):
+        mtime = self.ncfs.getattr('/y/DATA_REPR')['st_mtime']
+        time.sleep(0.01)
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_RDWR)
+        self.ncfs.write('/y/DATA_REPR', '7', 9, fh)
+        self.ncfs.release('/y/DATA_REPR', fh)
+        self.assertEqual(list(self.testvar[:]), [4., 7., 6.])
+        self.assertGreater(self.ncfs.getattr('/y/DATA_REPR')['st_mtime'],
+                           mtime)
+
+    def test_truncate_through_file_handle(self):
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_RDWR)
+        self.ncfs.write('/y/DATA_REPR', '7.0\n8.0\n9.0\n0.0\n', 0, fh)
+        self.ncfs.truncate('/y/DATA_REPR', 12, fh)
+        self.ncfs.release('/y/DATA_REPR', fh)
+        self.assertEqual(list(self.testvar[:]), [7., 8., 9.])
+
+    def test_file_handles_are_independent(self):
+        fh1 = self.ncfs.open('/y/DATA_REPR', os.O_RDWR)
+        fh2 = self.ncfs.open('/y/DATA_REPR', os.O_RDWR)
+        self.assertNotEqual(fh1, fh2)
+        self.ncfs.write('/y/DATA_REPR', '7', 0, fh1)
+        self.ncfs.release('/y/DATA_REPR', fh2)
+        self.assertEqual(list(self.testvar[:]), [4., 5., 6.])
+        self.ncfs.release('/y/DATA_REPR', fh1)
+        self.assertEqual(list(self.testvar[:]), [7., 5., 6.])
+
 
 class TestCreatingInvalidNames(unittest.TestCase):
 
@@ -398,3 +499,1795 @@ class TestCreatingInvalidNames(unittest.TestCase):
     def test_emacs_tempfile_as_variable_attr(self):
         self.ncfs.create('/foovar/foo~', mode=int('0100644', 8))
         self.assertFalse(self.ncfs.exists('/foovar/foo~'))
+
+
+class TestFlatSlabs(unittest.TestCase):
+
+    def check_range(self, shape, start, stop):
+        data = numpy.arange(int(numpy.prod(shape))).reshape(shape)
+        got = [data[slab].ravel() for slab in flat_slabs(shape, start, stop)]
+        got = numpy.concatenate(got) if got else numpy.array([])
+        self.assertEqual(list(got), list(range(start, stop)))
+
+    def test_1d(self):
+        self.check_range((10,), 3, 7)
+
+    def test_3d_all_ranges(self):
+        shape = (3, 4, 5)
+        for start in range(0, 60, 7):
+            for stop in range(start, 61, 11):
+                self.check_range(shape, start, stop)
+
+    def test_empty_range(self):
+        self.assertEqual(list(flat_slabs((3, 4), 5, 5)), [])
+
+
+def create_test_dataset_2():
+    ds = Dataset('test2.nc', mode='w', diskless=True, format='NETCDF4')
+    ds.createDimension('t', 7)
+    ds.createDimension('x', 13)
+    v = ds.createVariable('field', 'f8', dimensions=('t', 'x'))
+    # values of varying magnitude, so that lines differ in length
+    v[:] = (numpy.arange(7 * 13).reshape(7, 13) - 40) ** 3 / 7.
+    return ds
+
+
+class TestStreamingTextRepr(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_2()
+        self.var = self.ds.variables['field']
+        self.plugin = VardataAsFlatTextFiles(block_size=5)
+        self.full = VardataAsFlatTextFiles()(self.var)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_size(self):
+        self.assertEqual(self.plugin.size(self.var), len(self.full))
+
+    def test_reading_in_chunks(self):
+        for chunk in (1, 7, 64, 1000):
+            parts = []
+            offset = 0
+            while True:
+                part = self.plugin.read(self.var, chunk, offset)
+                if not part:
+                    break
+                parts.append(part)
+                offset += len(part)
+            self.assertEqual(''.join(parts), self.full)
+
+    def test_reading_at_random_offsets(self):
+        for offset in (0, 3, 17, 250, len(self.full) - 2):
+            self.assertEqual(self.plugin.read(self.var, 33, offset),
+                             self.full[offset:offset+33])
+
+    def test_reading_past_end(self):
+        self.assertEqual(self.plugin.read(self.var, 10, len(self.full)), '')
+
+    def test_index_is_rebuilt_after_write(self):
+        y = self.ds.createVariable('y', 'f8', dimensions=('x',))
+        y[:] = numpy.arange(13)
+        self.plugin.size(y)
+        self.plugin.update(y, b'1000.0\n' * 13)
+        self.assertEqual(self.plugin.size(y), len('1000.000000\n') * 13)
+
+
+class TestReprCache(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = ReprCache(max_bytes=100)
+        cache.put('var', 'key', 'abc')
+        self.assertEqual(cache.get('var', 'key'), 'abc')
+        self.assertEqual(cache.get('var', 'other'), None)
+        self.assertEqual(cache.nbytes, 3)
+
+    def test_evicting_least_recently_used(self):
+        cache = ReprCache(max_bytes=10)
+        cache.put('var', 1, 'aaaa')
+        cache.put('var', 2, 'bbbb')
+        cache.get('var', 1)
+        cache.put('var', 3, 'cccc')
+        self.assertEqual(cache.get('var', 2), None)
+        self.assertEqual(cache.get('var', 1), 'aaaa')
+        self.assertEqual(cache.get('var', 3), 'cccc')
+        self.assertEqual(cache.nbytes, 8)
+
+    def test_not_caching_values_over_budget(self):
+        cache = ReprCache(max_bytes=10)
+        cache.put('var', 1, 'aaaa')
+        cache.put('var', 2, 'b' * 11)
+        self.assertEqual(cache.get('var', 2), None)
+        self.assertEqual(cache.get('var', 1), 'aaaa')
+
+    def test_invalidating_owner(self):
+        cache = ReprCache()
+        cache.put('var1', 1, 'aaaa')
+        cache.put('var1', 2, 'bbbb')
+        cache.put('var2', 1, 'cccc')
+        cache.invalidate('var1')
+        self.assertEqual(cache.get('var1', 1), None)
+        self.assertEqual(cache.get('var1', 2), None)
+        self.assertEqual(cache.get('var2', 1), 'cccc')
+        self.assertEqual(cache.nbytes, 4)
+
+
+class TestCacheInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_2()
+        self.ds.createVariable('x', 'f8', dimensions=('x',))
+        self.ds.variables['x'][:] = numpy.arange(13)
+        self.cache = ReprCache()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(cache=self.cache),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_reading_after_write(self):
+        self.ncfs.read('/x/DATA_REPR', 4096, 0)
+        self.ncfs.truncate('/x/DATA_REPR', 0, 0)
+        self.ncfs.write('/x/DATA_REPR', '7.0\n' * 13, 0)
+        self.ncfs.release('/x/DATA_REPR')
+        self.assertEqual(self.ncfs.read('/x/DATA_REPR', 9, 0), '7.000000\n')
+
+    def test_attribute_edit_invalidates_variable(self):
+        self.ncfs.read('/x/DATA_REPR', 4096, 0)
+        self.assertTrue(self.cache.nbytes > 0)
+        self.ncfs.create('/x/units', mode=int('0100644', 8))
+        self.assertEqual(self.cache.nbytes, 0)
+
+
+class TestSizeFromMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_2()
+        v = self.ds.createVariable('packed', 'i2', dimensions=('t', 'x'))
+        v.scale_factor = numpy.float32(0.5)
+        v[:] = numpy.arange(7 * 13).reshape(7, 13)
+        self.ds.createVariable('count', 'i4', dimensions=('t', 'x'))
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_data_dtype(self):
+        v = self.ds.variables['packed']
+        self.assertEqual(data_dtype(v), v[:].dtype)
+        v.set_auto_scale(False)
+        self.assertEqual(data_dtype(v), numpy.dtype('i2'))
+
+    def test_binary_size(self):
+        plugin = VardataAsBinaryFiles()
+        for name in ('field', 'packed', 'count'):
+            v = self.ds.variables[name]
+            self.assertEqual(plugin.size(v), len(v[:].tobytes()))
+
+    def test_fixed_width(self):
+        self.assertEqual(fixed_width('%+14.6e', numpy.dtype('f8')), 14)
+        self.assertEqual(fixed_width('%+13.6e', numpy.dtype('f8')), None)
+        self.assertEqual(fixed_width('%+13.6e', numpy.dtype('f4')), 13)
+        self.assertEqual(fixed_width('%6d', numpy.dtype('i2')), 6)
+        self.assertEqual(fixed_width('%5d', numpy.dtype('i2')), None)
+        self.assertEqual(fixed_width('%20f', numpy.dtype('f8')), None)
+        self.assertEqual(fixed_width('%f', numpy.dtype('f8')), None)
+
+    def test_fixed_width_text(self):
+        v = self.ds.variables['field']
+        plugin = VardataAsFlatTextFiles(fmt='%+15.6e')
+        full = plugin(v)
+        self.assertEqual(plugin.size(v), len(full))
+        for offset in (0, 5, 16, 100, len(full) - 3):
+            self.assertEqual(plugin.read(v, 40, offset),
+                             full[offset:offset+40])
+
+
+class TestMetadataSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_1()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_metadata_served_without_lock(self):
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with self.ncfs.lock:
+                locked.set()
+                release.wait(5)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5)
+            self.assertTrue(self.ncfs.getattr('/foovar/fooattr'))
+            self.assertTrue('fooattr' in self.ncfs.readdir('/foovar'))
+            self.assertEqual(self.ncfs.read('/attr1', 100, 0), 'attrval1\n')
+        finally:
+            release.set()
+            holder.join()
+
+    def test_snapshot_updated_after_changes(self):
+        self.ncfs.create('/foovar/xyz', mode=int('0100644', 8))
+        self.ncfs.write('/attr1', 'new', offset=0)
+        self.assertTrue(self.ncfs.exists('/foovar/xyz'))
+        self.assertEqual(self.ncfs.get_global_attr('/attr1'), 'newrval1')
+
+    def test_old_snapshot_is_not_modified(self):
+        old = self.ncfs.snapshot
+        self.ncfs.unlink('/foovar/fooattr')
+        self.assertEqual(old.variables['foovar'].attrs['fooattr'], 'abc')
+        self.assertFalse(self.ncfs.exists('/foovar/fooattr'))
+
+    def test_types_shapes_and_dimensions(self):
+        info = self.ncfs.snapshot.variables['foovar']
+        var = self.ds['foovar']
+        self.assertEqual(info.dtype, var.dtype)
+        self.assertEqual(info.shape, var.shape)
+        self.assertEqual(info.scale, var.scale)
+        metadata = self.ncfs.variable_metadata('foovar')
+        self.assertEqual(data_dtype(metadata), data_dtype(var))
+        self.assertEqual((metadata.size, metadata.ncattrs()),
+                         (var.size, var.ncattrs()))
+        self.assertEqual(dict(self.ncfs.snapshot.groups[''].dimensions),
+                         dict((name, len(dim))
+                              for name, dim in self.ds.dimensions.items()))
+
+    def test_data_size_served_without_lock(self):
+        size = self.ncfs.getattr('/foovar/DATA_REPR')['st_size']
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with self.ncfs.lock:
+                locked.set()
+                release.wait(5)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5)
+            self.assertEqual(
+                    self.ncfs.getattr('/foovar/DATA_REPR')['st_size'], size)
+        finally:
+            release.set()
+            holder.join()
+
+    def test_fixed_sizes_computed_without_lock(self):
+        ncfs = NCFS(self.ds, VardataAsFlatTextFiles(fmt='%+14.6e'),
+                    AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                    data_reprs=[('DATA.bin', VardataAsBinaryFiles()),
+                                ('DATA.npy', VardataAsNpyFiles())])
+        paths = ['/foovar/DATA_REPR', '/foovar/DATA.bin', '/foovar/DATA.npy']
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with ncfs.lock:
+                locked.set()
+                release.wait(5)
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5)
+            sizes = [ncfs.getattr(path)['st_size'] for path in paths]
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(sizes, [len(ncfs.read(path, 10**6, 0))
+                                 for path in paths])
+
+    def test_data_size_updated_after_write(self):
+        path = '/y/DATA_REPR'
+        size = self.ncfs.getattr(path)['st_size']
+        text = self.ncfs.read(path, size, 0)
+        fh = self.ncfs.open(path, os.O_WRONLY)
+        self.ncfs.write(path, '400' + text[1:], 0, fh)
+        self.ncfs.release(path, fh)
+        self.assertEqual(self.ds['y'][0], 400.)
+        self.assertEqual(self.ncfs.getattr(path)['st_size'],
+                         len(self.ncfs.read(path, 10**6, 0)))
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_1()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+        self.stats = OperationStats()
+        self.ops = traced(NCFSStatsOperations, self.stats)(
+                self.ncfs, self.stats)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_untraced_operations_are_not_wrapped(self):
+        self.assertTrue(NCFSOperations.__getattribute__ is
+                        object.__getattribute__)
+        self.assertTrue(NCFSOperations.read is not
+                        traced(NCFSOperations).read)
+
+    def test_counting_calls_and_bytes(self):
+        self.ops.getattr('/foovar')
+        self.ops.read('/attr1', 100, 0, 0)
+        self.ops.read('/attr1', 100, 2, 0)
+        self.assertEqual(self.stats.calls('getattr'), 1)
+        self.assertEqual(self.stats.calls('read'), 2)
+        self.assertTrue('read calls=2 errors=0 bytes=16 '
+                        in self.stats.report())
+
+    def test_counting_errors(self):
+        self.assertRaises(FuseOSError, self.ops.getattr, '/nosuchvar/x')
+        self.assertTrue('getattr calls=1 errors=1 ' in self.stats.report())
+
+    def test_stats_file(self):
+        self.assertTrue('.ncfs' in self.ops.readdir('/', 0))
+        self.assertEqual(self.ops.readdir('/.ncfs', 0), ['.', '..', 'stats'])
+        self.ops.getattr('/foovar')
+        size = self.ops.getattr('/.ncfs/stats')['st_size']
+        report = self.ops.read('/.ncfs/stats', size, 0, 0)
+        self.assertEqual(len(report), size)
+        self.assertTrue(report.startswith(b'getattr calls=1 '))
+
+    def test_short_repr_of_write_buffers(self):
+        self.assertEqual(short_repr(b'x' * 1000), '<1000 bytes>')
+        self.assertEqual(short_repr('abc'), repr('abc'))
+
+
+class TestNamespaceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_1()
+        self.ncfs = NCFS(self.ds, None, AttributesAsTextFiles(), None)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_index_at_mount_time(self):
+        self.assertEqual(self.ncfs.kind('/'), ROOT)
+        self.assertEqual(self.ncfs.kind('/foovar'), VAR_DIR)
+        self.assertEqual(self.ncfs.kind('/foovar/fooattr'), VAR_ATTR)
+        self.assertEqual(self.ncfs.kind('/foovar/DATA_REPR'), VAR_DATA)
+        self.assertEqual(self.ncfs.kind('/foovar/DIMENSIONS'), VAR_DIMENSIONS)
+        self.assertEqual(self.ncfs.kind('/attr1'), GLOBAL_ATTR)
+        self.assertEqual(self.ncfs.kind('/foovar/nosuchattr'), None)
+
+    def test_index_after_create_and_unlink(self):
+        self.ncfs.create('/foovar/xyz', mode=int('0100644', 8))
+        self.ncfs.create('/attr2', mode=int('0100644', 8))
+        self.assertEqual(self.ncfs.kind('/foovar/xyz'), VAR_ATTR)
+        self.assertEqual(self.ncfs.kind('/attr2'), GLOBAL_ATTR)
+        self.ncfs.unlink('/foovar/xyz')
+        self.ncfs.unlink('/attr2')
+        self.assertEqual(self.ncfs.kind('/foovar/xyz'), None)
+        self.assertEqual(self.ncfs.kind('/attr2'), None)
+
+    def test_index_after_renames(self):
+        self.ncfs.rename('/foovar/fooattr', '/foovar/barattr')
+        self.ncfs.rename('/attr1', '/attr9')
+        self.ncfs.rename('/foovar', '/barvar')
+        self.assertEqual(self.ncfs.kind('/barvar/barattr'), VAR_ATTR)
+        self.assertEqual(self.ncfs.kind('/attr9'), GLOBAL_ATTR)
+        self.assertEqual(self.ncfs.kind('/attr1'), None)
+        self.assertEqual(self.ncfs.kind('/foovar'), None)
+        self.assertEqual(self.ncfs.kind('/foovar/fooattr'), None)
+
+    def test_index_after_mkdir(self):
+        self.ncfs.mkdir('/newvar', mode=int('0755', 8))
+        self.assertEqual(self.ncfs.kind('/newvar'), VAR_DIR)
+        self.assertEqual(self.ncfs.kind('/newvar/DATA_REPR'), VAR_DATA)
+
+    def test_nonexistent_paths_are_classified_by_form(self):
+        self.assertTrue(self.ncfs.is_var_attr('/foovar/newattr'))
+        self.assertTrue(self.ncfs.is_global_attr('/newattr'))
+        self.assertFalse(self.ncfs.is_global_attr('/foovar'))
+
+
+def create_classic_dataset(path, fmt):
+    ds = Dataset(path, mode='w', format=fmt)
+    ds.createDimension('t', None)
+    ds.createDimension('x', 5)
+    ds.createDimension('y', 3)
+    ds.title = 'classic'
+    v = ds.createVariable('fixed', 'f8', dimensions=('x', 'y'))
+    v.units = 'K'
+    v[:] = numpy.arange(15).reshape(5, 3) / 3.
+    v = ds.createVariable('rec', 'i2', dimensions=('t', 'y'))
+    v[0:4] = numpy.arange(12).reshape(4, 3)
+    v = ds.createVariable('masked', 'i4', dimensions=('x',),
+                          fill_value=-99)
+    v[0:3] = [1, 2, 3]
+    return ds
+
+
+class TestBinaryHyperslabReads(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_all(self, plugin, var, chunk):
+        parts = []
+        offset = 0
+        while True:
+            part = plugin.read(var, chunk, offset)
+            if not len(part):
+                break
+            parts.append(bytes(part))
+            offset += len(part)
+        return b''.join(parts)
+
+    def check_dataset(self, ds):
+        plugin = VardataAsBinaryFiles()
+        for var in ds.variables.values():
+            expected = var[:].tobytes()
+            for chunk in (1, 5, 8, 13, 1000):
+                self.assertEqual(self.read_all(plugin, var, chunk), expected)
+            self.assertEqual(bytes(plugin.read(var, 7, 3)), expected[3:10])
+
+    def test_classic_formats(self):
+        for fmt in ('NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET',
+                    'NETCDF3_64BIT_DATA'):
+            path = os.path.join(self.tmpdir, fmt + '.nc')
+            create_classic_dataset(path, fmt).close()
+            ds = Dataset(path, 'r')
+            self.check_dataset(ds)
+            ds.close()
+
+    def test_netcdf4_format(self):
+        path = os.path.join(self.tmpdir, 'nc4.nc')
+        create_classic_dataset(path, 'NETCDF4').close()
+        ds = Dataset(path, 'r')
+        self.check_dataset(ds)
+        ds.close()
+
+    def test_parsing_classic_header(self):
+        path = os.path.join(self.tmpdir, 'classic.nc')
+        create_classic_dataset(path, 'NETCDF3_CLASSIC').close()
+        file_map = ClassicFileMap(path)
+        # record variables are not contiguous, so are not mapped
+        self.assertEqual(sorted(file_map.offsets), ['fixed', 'masked'])
+        ds = Dataset(path, 'r')
+        data = file_map.read('fixed', numpy.dtype('f8'), 2, 6)
+        self.assertEqual(list(data), list(ds['fixed'][:].ravel()[2:6]))
+        ds.close()
+
+    def test_reading_memory_mapped_data_after_write(self):
+        path = os.path.join(self.tmpdir, 'classic.nc')
+        create_classic_dataset(path, 'NETCDF3_CLASSIC').close()
+        ds = Dataset(path, 'r+')
+        var = ds['fixed']
+        plugin = VardataAsBinaryFiles()
+        self.assertTrue(isinstance(plugin.read(var, 8, 0), memoryview))
+        var[:] = 7.
+        plugin.invalidate(var)
+        self.assertEqual(bytes(plugin.read(var, 8, 8)),
+                         numpy.float64(7.).tobytes())
+        ds.close()
+
+    def test_masked_elements_of_reads_spanning_rows(self):
+        ds = Dataset('masked_rows.nc', mode='w', diskless=True, persist=False)
+        ds.createDimension('y', 3)
+        ds.createDimension('x', 4)
+        var = ds.createVariable('v', 'i4', ('y', 'x'), fill_value=-999)
+        var[0] = [1, 2, 3, 4]
+        var[1, 0] = 5
+        var[2] = [6, 7, 8, 9]
+        plugin = VardataAsBinaryFiles()
+        expected = plugin(var)
+        self.assertEqual(numpy.frombuffer(expected, 'i4')[5], -999)
+        for offset, size in [(8, 12), (4, 40), (12, 32)]:
+            self.assertEqual(bytes(plugin.read(var, size, offset)),
+                             expected[offset:offset+size])
+        ds.close()
+
+    def test_reading_memory_mapped_data_after_header_change(self):
+        path = os.path.join(self.tmpdir, 'classic.nc')
+        create_classic_dataset(path, 'NETCDF3_CLASSIC').close()
+        ds = Dataset(path, 'r+')
+        ncfs = NCFS(ds, VardataAsFlatTextFiles(), AttributesAsTextFiles(),
+                    DimNamesAsTextFiles(),
+                    data_reprs=[('DATA.bin', VardataAsBinaryFiles())])
+        expected = ds['fixed'][:].tobytes()
+        self.assertEqual(bytes(ncfs.read('/fixed/DATA.bin', 1000, 0)),
+                         expected)
+        # the header grows, so the data section moves
+        ncfs.set_global_attr('/history', 'x' * 5000)
+        self.assertEqual(bytes(ncfs.read('/fixed/DATA.bin', 1000, 0)),
+                         expected)
+        ncfs.unlink('/history')
+        ncfs.set_var_attr('/fixed/comment', 'y' * 10000)
+        self.assertEqual(bytes(ncfs.read('/fixed/DATA.bin', 1000, 0)),
+                         expected)
+        ds.close()
+
+
+def create_test_dataset_3():
+    ds = Dataset('test3.nc', mode='w', diskless=True, persist=False)
+    ds.createDimension('time', 3)
+    ds.createDimension('lev', 2)
+    ds.createDimension('y', 2)
+    ds.createDimension('x', 3)
+    time = ds.createVariable('time', 'f8', ('time',))
+    time.units = 'days since 2000-01-01'
+    time.calendar = 'gregorian'
+    time[:] = [0, 1, 2]
+    lev = ds.createVariable('lev', 'f4', ('lev',))
+    lev.units = 'hPa'
+    lev[:] = [1000, 850]
+    temp = ds.createVariable('temp', 'f4', ('time', 'lev', 'y', 'x'))
+    temp[:] = numpy.arange(36).reshape(3, 2, 2, 3)
+    return ds
+
+
+class TestAxisSplitting(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_3()
+        self.vardata_repr = VardataAsFlatTextFiles(cache=ReprCache())
+        self.ncfs = NCFS(self.ds, self.vardata_repr, AttributesAsTextFiles(),
+                         DimNamesAsTextFiles(), split_axes=True)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def read(self, path):
+        size = self.ncfs.getattr(path)['st_size']
+        return self.ncfs.read(path, size, 0)
+
+    def test_detecting_cf_axes(self):
+        self.assertEqual(cf_axis({'units': 'hours since 1970-01-01'}), 'T')
+        self.assertEqual(cf_axis({'units': 'hPa'}), 'Z')
+        self.assertEqual(cf_axis({'positive': 'down'}), 'Z')
+        self.assertEqual(cf_axis({'axis': 'Y'}), None)
+        self.assertEqual(cf_axis({'units': 'degrees_north'}), None)
+
+    def test_axis_labels(self):
+        attrs = {'units': 'hours since 2000-01-01'}
+        self.assertEqual(axis_labels('T', [0, 6], attrs),
+                         ['2000-01-01T00:00:00', '2000-01-01T06:00:00'])
+        self.assertEqual(axis_labels('Z', [1000., 850.], {}), ['1000', '850'])
+        # indices are used if labels would not be unique
+        self.assertEqual(axis_labels('Z', [1., 1.], {}), ['0', '1'])
+
+    def test_listing_slices(self):
+        entries = self.ncfs.readdir('/temp')
+        self.assertIn('time=2000-01-02', entries)
+        self.assertEqual(entries[-3:], ['time=2000-01-01', 'time=2000-01-02',
+                                        'time=2000-01-03'])
+        self.assertEqual(self.ncfs.readdir('/temp/time=2000-01-02'),
+                         ['.', '..', 'DATA_REPR', 'lev=1000', 'lev=850'])
+        self.assertEqual(
+            self.ncfs.readdir('/temp/time=2000-01-02/lev=850'),
+            ['.', '..', 'DATA_REPR'])
+        # last two dimensions are never split
+        self.assertNotIn('time=2000-01-01', self.ncfs.readdir('/time'))
+
+    def test_resolving_slice_paths(self):
+        # slices can be accessed without listing their parents first
+        self.assertEqual(self.ncfs.kind('/temp/time=2000-01-03/lev=850'),
+                         SLICE_DIR)
+        self.assertEqual(
+            self.ncfs.kind('/temp/time=2000-01-03/lev=850/DATA_REPR'),
+            SLICE_DATA)
+        self.assertEqual(self.ncfs.kind('/temp/time=2000-01-04'), None)
+        self.assertEqual(self.ncfs.kind('/temp/lev=850'), None)
+        self.assertEqual(self.ncfs.kind('/temp/time=2000-01-01/lev=1'), None)
+        self.assertTrue(self.ncfs.is_dir('/temp/time=2000-01-01'))
+        with self.assertRaises(FuseOSError):
+            self.ncfs.getattr('/temp/time=2000-01-04/DATA_REPR')
+
+    def test_reading_slices(self):
+        var = self.ds['temp']
+        self.assertEqual(self.read('/temp/time=2000-01-02/DATA_REPR'),
+                         self.vardata_repr(var[1]))
+        self.assertEqual(self.read('/temp/time=2000-01-03/lev=850/DATA_REPR'),
+                         self.vardata_repr(var[2, 1]))
+
+    def test_slice_shapes_from_snapshot(self):
+        var_slice = self.ncfs.get_slice('/temp/time=2000-01-03/lev=850')
+        self.assertEqual(var_slice.shape, (2, 3))
+        self.assertEqual(var_slice.start, 5 * 6)
+        # the Variable itself is not asked
+        var_slice = VariableSlice(object(), (1,),
+                                  self.ncfs.variable_metadata('temp'))
+        self.assertEqual(var_slice.dimensions, ('lev', 'y', 'x'))
+        self.assertEqual((var_slice.shape, var_slice.start),
+                         ((2, 2, 3), 12))
+
+    def test_reading_binary_slices(self):
+        self.ncfs.vardata_repr = VardataAsBinaryFiles()
+        var = self.ds['temp']
+        path = '/temp/time=2000-01-02/lev=850/DATA_REPR'
+        self.assertEqual(bytes(self.read(path)), var[1, 1].tobytes())
+
+    def test_slices_are_invalidated_with_variable(self):
+        path = '/temp/time=2000-01-02/DATA_REPR'
+        self.read(path)
+        self.ncfs.invalidate('/temp/DATA_REPR')
+        self.ds['temp'][1] = 0
+        self.assertEqual(self.read(path),
+                         self.vardata_repr(self.ds['temp'][1]))
+
+    def test_splitting_is_disabled_by_default(self):
+        ncfs = NCFS(self.ds, self.vardata_repr, AttributesAsTextFiles(),
+                    DimNamesAsTextFiles())
+        self.assertNotIn('time=2000-01-01', ncfs.readdir('/temp'))
+        self.assertEqual(ncfs.kind('/temp/time=2000-01-01'), None)
+
+
+class TestReadOnlyMode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'ro.nc')
+        create_classic_dataset(path, 'NETCDF4').close()
+        self.ds = Dataset(path, 'r')
+        self.cache = ReprCache(track_owners=False)
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(cache=self.cache),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                         read_only=True)
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir)
+
+    def assertReadOnly(self, method, *args):
+        with self.assertRaises(FuseOSError) as cm:
+            method(*args)
+        self.assertEqual(cm.exception.errno, errno.EROFS)
+
+    def test_modifications_are_rejected(self):
+        self.assertReadOnly(self.ncfs.create, '/newattr', 0o100644)
+        self.assertReadOnly(self.ncfs.mkdir, '/newvar', 0o755)
+        self.assertReadOnly(self.ncfs.write, '/fixed/DATA_REPR', '1\n', 0)
+        self.assertReadOnly(self.ncfs.truncate, '/fixed/DATA_REPR', 0)
+        self.assertReadOnly(self.ncfs.rename, '/fixed', '/other')
+        self.assertReadOnly(self.ncfs.unlink, '/fixed/DATA_REPR')
+        self.assertReadOnly(self.ncfs.open, '/fixed/DATA_REPR', os.O_RDWR)
+        self.assertReadOnly(self.ncfs.open, '/fixed/DATA_REPR',
+                            os.O_RDONLY | os.O_TRUNC)
+
+    def test_reading(self):
+        fh = self.ncfs.open('/fixed/DATA_REPR', os.O_RDONLY)
+        self.assertTrue(self.ncfs.read('/fixed/DATA_REPR', 4096, 0))
+        self.ncfs.release('/fixed/DATA_REPR', fh)
+        self.assertTrue(self.cache.nbytes > 0)
+
+    def test_permissions(self):
+        self.assertEqual(self.ncfs.getattr('/fixed/DATA_REPR')['st_mode'],
+                         0o100444)
+        self.assertEqual(self.ncfs.getattr('/fixed')['st_mode'], 0o40555)
+
+    def test_cache_without_owner_tracking(self):
+        self.cache.put('var', 'key', 'abc')
+        self.assertEqual(self.cache.get('var', 'key'), 'abc')
+        self.assertEqual(self.cache._owners, {})
+        self.cache.invalidate('var')
+        self.assertEqual(self.cache.nbytes, 0)
+
+
+class TestModificationTimes(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_1()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+
+    def tearDown(self):
+        self.ds.close()
+
+    def mtime(self, path):
+        return self.ncfs.getattr(path)['st_mtime']
+
+    def test_unmodified_nodes_have_mount_time(self):
+        for path in ('/', '/foovar', '/foovar/DATA_REPR', '/attr1'):
+            self.assertEqual(self.mtime(path), self.ncfs.mount_time)
+
+    def test_attribute_write(self):
+        self.ncfs.write('/attr1', 'new', 0)
+        self.assertGreater(self.mtime('/attr1'), self.ncfs.mount_time)
+        self.assertEqual(self.mtime('/foovar/fooattr'), self.ncfs.mount_time)
+
+    def test_data_modified_on_commit(self):
+        fh = self.ncfs.open('/y/DATA_REPR', os.O_WRONLY)
+        self.ncfs.truncate('/y/DATA_REPR', 0, fh)
+        self.ncfs.write('/y/DATA_REPR', '7.0\n8.0\n9.0\n', 0, fh)
+        self.assertEqual(self.mtime('/y/DATA_REPR'), self.ncfs.mount_time)
+        self.ncfs.release('/y/DATA_REPR', fh)
+        self.assertGreater(self.mtime('/y/DATA_REPR'), self.ncfs.mount_time)
+        self.assertEqual(self.mtime('/x/DATA_REPR'), self.ncfs.mount_time)
+
+    def test_variable_attribute_modifies_data(self):
+        # attributes such as scale_factor affect data representation
+        self.ncfs.create('/foovar/units', mode=int('0100644', 8))
+        self.assertGreater(self.mtime('/foovar/DATA_REPR'),
+                           self.ncfs.mount_time)
+        self.assertGreater(self.mtime('/foovar'), self.ncfs.mount_time)
+
+    def test_touching_all_nodes(self):
+        self.ncfs.touch_all()
+        self.assertGreater(self.mtime('/x/DATA_REPR'), self.ncfs.mount_time)
+        self.assertGreater(self.mtime('/attr1'), self.ncfs.mount_time)
+
+
+class TestChunkPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'chunked.nc')
+        ds = Dataset(path, 'w', format='NETCDF4')
+        ds.createDimension('t', 20)
+        ds.createDimension('y', 7)
+        ds.createDimension('x', 11)
+        v = ds.createVariable('field', 'f4', ('t', 'y', 'x'), zlib=True,
+                              chunksizes=(3, 4, 11))
+        v[:] = numpy.arange(20 * 7 * 11).reshape(20, 7, 11)
+        v = ds.createVariable('plain', 'f4', ('y', 'x'), contiguous=True)
+        v[:] = numpy.arange(7 * 11).reshape(7, 11)
+        ds.close()
+        self.ds = Dataset(path, 'r')
+        self.cache = ReprCache()
+        self.prefetcher = ChunkPrefetcher(self.cache, threading.RLock())
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir)
+
+    def band_keys(self):
+        return sorted(key[2] for (owner, key) in self.cache._entries
+                      if key[0] == 'band')
+
+    def test_chunk_shape(self):
+        self.assertEqual(chunk_shape(self.ds['field']), (3, 4, 11))
+        self.assertEqual(chunk_shape(self.ds['plain']), None)
+
+    def test_reading_ranges(self):
+        var = self.ds['field']
+        expected = var[:].ravel()
+        for start, stop in [(0, 1), (5, 300), (200, 231), (1000, 1540)]:
+            data = self.prefetcher.read_flat(var, start, stop)
+            self.assertEqual(list(data), list(expected[start:stop]))
+
+    def test_next_band_read_ahead(self):
+        var = self.ds['field']
+        self.prefetcher.read_flat(var, 0, 10)
+        self.prefetcher.join()
+        self.assertEqual(self.band_keys(), [0, 1])
+        self.prefetcher.read_flat(var, 231, 240)
+        self.prefetcher.join()
+        self.assertEqual(self.band_keys(), [0, 1, 2])
+
+    def test_read_positions_dropped_with_variable(self):
+        var = self.ds['field']
+        self.prefetcher.read_flat(var, 0, 10)
+        self.prefetcher.join()
+        self.cache.invalidate(var)
+        self.assertEqual(len(self.cache._entries), 0)
+        # the next read no longer continues the previous one
+        self.prefetcher.read_flat(var, 231, 240)
+        self.prefetcher.join()
+        self.assertEqual(self.band_keys(), [1])
+
+    def test_no_read_ahead_for_random_reads(self):
+        var = self.ds['field']
+        self.prefetcher.read_flat(var, 1000, 1001)
+        self.prefetcher.join()
+        self.assertEqual(self.band_keys(), [4])
+
+    def test_contiguous_variables_are_read_directly(self):
+        var = self.ds['plain']
+        data = self.prefetcher.read_flat(var, 3, 20)
+        self.assertEqual(list(data), list(var[:].ravel()[3:20]))
+        self.assertEqual(self.cache.nbytes, 0)
+
+    def test_plugins_read_through_prefetcher(self):
+        var = self.ds['field']
+        text = VardataAsFlatTextFiles(
+            cache=self.cache, reader=self.prefetcher.read_flat)
+        binary = VardataAsBinaryFiles(
+            cache=self.cache, reader=self.prefetcher.read_flat)
+        self.assertEqual(text.read(var, 100, 50),
+                         text(var)[50:150])
+        self.assertEqual(bytes(binary.read(var, 4096, 100)),
+                         var[:].tobytes()[100:4196])
+        text.invalidate(var)
+        self.assertEqual(self.band_keys(), [])
+
+
+def create_aggregated_files(tmpdir, fmt, lengths, unlimited=True):
+    paths = []
+    start = 0
+    for i, length in enumerate(lengths):
+        path = os.path.join(tmpdir, 'part{}.nc'.format(i))
+        ds = Dataset(path, 'w', format=fmt)
+        ds.title = 'part'
+        ds.createDimension('time', None if unlimited else length)
+        ds.createDimension('y', 2)
+        ds.createDimension('x', 3)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 2001-01-01'
+        time[:] = numpy.arange(start, start + length)
+        ds.createVariable('lat', 'f4', ('y',))[:] = [10., 20.]
+        temp = ds.createVariable('temp', 'f4', ('time', 'y', 'x'))
+        temp[:] = numpy.arange(start * 6, (start + length) * 6).reshape(
+            length, 2, 3)
+        ds.close()
+        paths.append(path)
+        start += length
+    return paths
+
+
+class TestAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = create_aggregated_files(
+            self.tmpdir, 'NETCDF3_CLASSIC', [2, 3, 1])
+        self.expected = numpy.arange(36, dtype='f4').reshape(6, 2, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_classic_numrecs(self):
+        self.assertEqual([classic_numrecs(p) for p in self.paths], [2, 3, 1])
+
+    def test_files_opened_lazily(self):
+        agg = AggregatedDataset(self.paths)
+        self.assertEqual(agg.dimension, 'time')
+        self.assertEqual(agg.variables['temp'].shape, (6, 2, 3))
+        # record counts of classic files are read from their headers
+        self.assertEqual(list(agg.pool._datasets), self.paths[:1])
+        agg.close()
+
+    def test_reading_across_files(self):
+        agg = AggregatedDataset(self.paths, max_open=1)
+        temp = agg.variables['temp']
+        for key in [slice(None), 1, -1, slice(1, 5), slice(None, None, 2),
+                    (Ellipsis, 1), (slice(1, 4), 0, slice(1, 3)),
+                    (4, Ellipsis)]:
+            self.assertEqual(temp[key].tolist(), self.expected[key].tolist())
+        self.assertEqual(list(read_flat(temp, 10, 30)),
+                         list(self.expected.ravel()[10:30]))
+        self.assertEqual(agg.variables['lat'][:].tolist(), [10., 20.])
+        self.assertTrue(len(agg.pool._datasets) <= 1)
+        with self.assertRaises(IndexError):
+            temp[6]
+        agg.close()
+
+    def test_time_dimension_without_unlimited(self):
+        paths = create_aggregated_files(
+            self.tmpdir, 'NETCDF4', [2, 3, 1], unlimited=False)
+        agg = AggregatedDataset(paths)
+        self.assertEqual(agg.dimension, 'time')
+        self.assertEqual(len(agg.dimensions['time']), 6)
+        self.assertEqual(agg.variables['time'][:].tolist(), list(range(6)))
+        agg.close()
+
+    def test_netcdf4_files_opened_once_at_mount(self):
+        paths = create_aggregated_files(self.tmpdir, 'NETCDF4', [2, 3, 1])
+        agg = AggregatedDataset(paths)
+        opened = []
+        get = agg.pool.get
+
+        def counting_get(path):
+            if path not in agg.pool._datasets:
+                opened.append(path)
+            return get(path)
+        agg.pool.get = counting_get
+        ncfs = NCFS(agg, VardataAsFlatTextFiles(), AttributesAsTextFiles(),
+                    DimNamesAsTextFiles(), read_only=True)
+        # the first file is already open; numbers of records of the
+        # others can only be found by opening them
+        self.assertEqual(opened, paths[1:])
+        self.assertTrue(ncfs.getattr('/temp/DATA_REPR')['st_size'] > 0)
+        ncfs.read('/temp/DATA_REPR', 100, 0)
+        self.assertEqual(opened, paths[1:])
+        agg.close()
+
+    def test_mounting_aggregation(self):
+        agg = AggregatedDataset(self.paths)
+        vardata_repr = VardataAsFlatTextFiles()
+        ncfs = NCFS(agg, vardata_repr, AttributesAsTextFiles(),
+                    DimNamesAsTextFiles(), read_only=True)
+        self.assertEqual(list(ncfs.snapshot.variables),
+                         ['time', 'lat', 'temp'])
+        self.assertEqual(ncfs.get_global_attr('/title'), 'part')
+        size = ncfs.getattr('/temp/DATA_REPR')['st_size']
+        self.assertEqual(ncfs.read('/temp/DATA_REPR', size, 0),
+                         vardata_repr._render(agg.variables['temp'],
+                                              self.expected.ravel()))
+        binary = VardataAsBinaryFiles()
+        self.assertEqual(bytes(binary.read(agg.variables['temp'], 40, 20)),
+                         self.expected.tobytes()[20:60])
+        agg.close()
+
+
+class TestNCFSDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('a.nc', 'b.nc'):
+            path = os.path.join(self.tmpdir, name)
+            create_classic_dataset(path, 'NETCDF3_CLASSIC').close()
+        with open(os.path.join(self.tmpdir, 'notes.txt'), 'w') as f:
+            f.write('not a NetCDF file\n')
+        self.cache = ReprCache()
+        self.vardata_repr = VardataAsFlatTextFiles(cache=self.cache)
+        self.opened = []
+        self.ncdir = NCFSDirectory(self.tmpdir, self.open_ncfs, max_open=1,
+                                   idle_timeout=0)
+
+    def open_ncfs(self, path):
+        self.opened.append(os.path.basename(path))
+        return NCFS(Dataset(path, 'r'), self.vardata_repr,
+                    AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                    read_only=True)
+
+    def tearDown(self):
+        self.ncdir.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_listing_files_without_opening_them(self):
+        self.assertEqual(self.ncdir.readdir('/'), ['.', '..', 'a.nc', 'b.nc'])
+        self.assertTrue(self.ncdir.getattr('/a.nc')['st_mode'] & 0o040000)
+        self.assertEqual(self.opened, [])
+        with self.assertRaises(FuseOSError):
+            self.ncdir.getattr('/notes.txt')
+        with self.assertRaises(FuseOSError):
+            self.ncdir.readdir('/c.nc')
+
+    def test_reading_files(self):
+        ds = Dataset(os.path.join(self.tmpdir, 'b.nc'), 'r')
+        expected = self.vardata_repr(ds['fixed'])
+        ds.close()
+        self.assertIn('units', self.ncdir.readdir('/a.nc/fixed'))
+        size = self.ncdir.getattr('/b.nc/fixed/DATA_REPR')['st_size']
+        self.assertEqual(size, len(expected))
+        self.assertEqual(self.ncdir.read('/b.nc/fixed/DATA_REPR', size, 0),
+                         expected)
+        self.assertEqual(self.opened, ['a.nc', 'b.nc'])
+
+    def test_max_open_files(self):
+        self.ncdir.read('/a.nc/fixed/DATA_REPR', 100, 0)
+        self.assertTrue(self.cache.nbytes > 0)
+        self.ncdir.getattr('/b.nc/title')
+        # a.nc was closed, and its cached representations dropped
+        self.assertEqual(list(self.ncdir._mounted), ['b.nc'])
+        self.assertEqual(self.cache.nbytes, 0)
+
+    def test_idle_files_are_closed_unless_open(self):
+        fh = self.ncdir.open('/a.nc/fixed/DATA_REPR', os.O_RDONLY)
+        self.ncdir.close_idle(now=time.time() + 1)
+        self.assertEqual(list(self.ncdir._mounted), ['a.nc'])
+        self.ncdir.read('/a.nc/fixed/DATA_REPR', 100, 0)
+        self.ncdir.release('/a.nc/fixed/DATA_REPR', fh)
+        self.ncdir.close_idle(now=time.time() + 1)
+        self.assertEqual(list(self.ncdir._mounted), [])
+
+    def test_renaming_across_files(self):
+        with self.assertRaises(FuseOSError) as cm:
+            self.ncdir.rename('/a.nc/title', '/b.nc/title')
+        self.assertEqual(cm.exception.errno, errno.EXDEV)
+
+    def test_operations(self):
+        ops = NCFSOperations(self.ncdir)
+        fh = ops.open('/a.nc/fixed/units', os.O_RDONLY)
+        self.assertEqual(ops.read('/a.nc/fixed/units', 100, 0, fh), 'K\n')
+        ops.release('/a.nc/fixed/units', fh)
+
+
+def create_test_dataset_4():
+    ds = Dataset('test4.nc', mode='w', diskless=True, persist=False)
+    ds.title = 'nested'
+    ds.createDimension('x', 3)
+    ds.createVariable('top', 'i4', ('x',))[:] = [1, 2, 3]
+    model = ds.createGroup('model')
+    model.source = 'ocean'
+    model.createVariable('sst', 'f4', ('x',))[:] = [10., 11., 12.]
+    run = model.createGroup('run1')
+    run.createDimension('t', 2)
+    temp = run.createVariable('temp', 'i4', ('t', 'x'))
+    temp.units = 'K'
+    temp[:] = [[1, 2, 3], [4, 5, 6]]
+    return ds
+
+
+class TestGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_4()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+
+    def tearDown(self):
+        self.ds.close()
+
+    def read(self, path):
+        size = self.ncfs.getattr(path)['st_size']
+        return self.ncfs.read(path, size, 0)
+
+    def test_groups_are_loaded_lazily(self):
+        self.assertEqual(list(self.ncfs.snapshot.groups), [''])
+        self.assertEqual(self.ncfs.kind('/model'), GROUP_DIR)
+        self.assertEqual(self.ncfs.readdir('/model'),
+                         ['.', '..', 'sst', 'run1', 'source'])
+        self.assertEqual(sorted(self.ncfs.snapshot.groups), ['', 'model'])
+        self.assertTrue(self.ncfs.getattr('/model/run1')['st_mode'] &
+                        0o040000)
+        self.assertNotIn('model/run1', self.ncfs.snapshot.groups)
+
+    def test_renaming_dimensions_of_variable_in_group(self):
+        path = '/model/run1/temp/DIMENSIONS'
+        self.read(path)
+        self.ncfs.write(path, 'time\ny\n', 0)
+        run = self.ds['model/run1']
+        self.assertEqual(run['temp'].dimensions, ('time', 'y'))
+        # x is a dimension of the root group, shared with other Variables
+        self.assertEqual(list(self.ds.dimensions), ['y'])
+        self.assertEqual(list(run.dimensions), ['time'])
+        self.assertEqual(self.ds['top'].dimensions, ('y',))
+        self.assertEqual(self.read(path), 'time\ny\n')
+        with self.assertRaises(FuseOSError) as cm:
+            self.ncfs.write(path, 'time\ntime\n', 0)
+        self.assertEqual(cm.exception.errno, errno.EACCES)
+
+    def test_preloading_groups(self):
+        self.ncfs.preload()
+        self.assertEqual(sorted(self.ncfs.snapshot.groups),
+                         ['', 'model', 'model/run1'])
+        ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                    AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                    preload=True)
+        for _ in range(100):
+            if len(ncfs.snapshot.groups) == 3:
+                break
+            time.sleep(0.05)
+        self.assertIn('model/run1/temp', ncfs.snapshot.variables)
+
+    def test_deep_path_without_readdir(self):
+        self.assertEqual(self.ncfs.kind('/model/run1/temp/units'), VAR_ATTR)
+        self.assertEqual(self.read('/model/run1/temp/units'), 'K\n')
+        temp = self.ds['model']['run1']['temp']
+        self.assertEqual(self.read('/model/run1/temp/DATA_REPR'),
+                         VardataAsFlatTextFiles()(temp))
+        self.assertEqual(self.read('/model/run1/temp/DIMENSIONS'), 't\nx\n')
+        self.assertFalse(self.ncfs.exists('/model/run2/temp'))
+
+    def test_group_attributes(self):
+        self.assertEqual(self.read('/model/source'), 'ocean\n')
+        self.ncfs.create('/model/comment', 0o644)
+        self.ncfs.write('/model/comment', 'hello', 0)
+        self.assertEqual(self.ds['model'].comment, 'hello')
+        self.assertEqual(self.ds.ncattrs(), ['title'])
+        self.ncfs.unlink('/model/source')
+        self.assertEqual(self.ds['model'].ncattrs(), ['comment'])
+        self.assertNotIn('source', self.ncfs.readdir('/model'))
+
+    def test_group_variables(self):
+        self.assertNotIn(b'sst', self.ncfs.readdir('/'))
+        self.ncfs.mkdir('/model/sss', 0o755)
+        self.assertIn('sss', self.ds['model'].variables)
+        self.assertIn('sss', self.ncfs.readdir('/model'))
+        sst = self.ds['model']['sst']
+        self.assertEqual(self.read('/model/sst/DATA_REPR'),
+                         VardataAsFlatTextFiles()(sst))
+
+
+class TestPatchingTextRepr(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_2()
+        self.var = self.ds.variables['field']
+        self.plugin = VardataAsFlatTextFiles(block_size=5)
+        self.full = self.plugin(self.var)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_parse_text(self):
+        values = parse_text(b'1.000000\n -2.6\n\n3  \n', 'i4')
+        self.assertEqual(values.dtype, numpy.dtype('i4'))
+        self.assertEqual(list(values), [1, -3, 3])
+        self.assertEqual(list(parse_text(b'1.5\nabc\n3\n', 'f8')), [])
+        self.assertEqual(list(parse_text(b'nan\n1e3\n', 'f4'))[1], 1000.)
+
+    def test_write_flat(self):
+        write_flat(self.var, 10, numpy.arange(20.))
+        self.assertEqual(list(read_flat(self.var, 10, 30)), list(range(20)))
+        self.assertEqual(self.var[0, 9], (9 - 40) ** 3 / 7.)
+
+    def test_patching_one_line(self):
+        offset = self.full.index('\n', 300) + 1
+        line = self.full[offset:self.full.index('\n', offset)]
+        element = self.full[:offset].count('\n')
+        self.plugin.size(self.var)
+        self.plugin.patch(self.var, [(offset, b'7' * len(line))])
+        expected = (numpy.arange(7 * 13) - 40.) ** 3 / 7.
+        expected[element] = float('7' * len(line))
+        self.assertEqual(list(self.var[:].ravel()), list(expected))
+        # index was updated, not dropped, and matches a rebuilt one
+        index = self.plugin._cache.get(self.var, self.plugin._index_key())
+        self.assertEqual(list(index), list(self.plugin._build_index(self.var)))
+        self.assertEqual(self.plugin.read(self.var, 10**6, 0),
+                         VardataAsFlatTextFiles()(self.var))
+
+    def test_patch_changing_line_lengths(self):
+        length = self.full.index('\n', self.full.index('\n') + 1) + 1
+        edit = b'1\n2'.ljust(length - 1) + b'\n'
+        self.plugin.patch(self.var, [(0, edit), (0, b'5')])
+        lines = self.plugin.read(self.var, 10**6, 0).split('\n')
+        self.assertEqual(lines[:3], ['5.000000', '2.000000',
+                                     self.full.split('\n')[2]])
+        self.assertEqual(self.plugin.size(self.var),
+                         len(VardataAsFlatTextFiles()(self.var)))
+
+    def test_patch_changing_number_of_elements(self):
+        with self.assertRaises(FuseOSError) as cm:
+            self.plugin.patch(self.var, [(0, b'1\n2\n')])
+        self.assertEqual(cm.exception.errno, errno.EACCES)
+        with self.assertRaises(FuseOSError):
+            self.plugin.patch(self.var, [(len(self.full), b'1\n')])
+        self.assertEqual(self.plugin(self.var), self.full)
+
+    def test_partial_write_does_not_render_whole_file(self):
+        ncfs = NCFS(self.ds, self.plugin, AttributesAsTextFiles(),
+                    DimNamesAsTextFiles())
+        self.ds.createVariable('x', 'f8', ('x',))[:] = numpy.arange(13)
+        ncfs.refresh()
+        fh = ncfs.open('/x/DATA_REPR', os.O_WRONLY)
+        ncfs.write('/x/DATA_REPR', '7', 9, fh)
+        self.assertEqual(ncfs.write_buffer('/x/DATA_REPR', fh, edit=True).data,
+                         None)
+        ncfs.release('/x/DATA_REPR', fh)
+        self.assertEqual(list(self.ds['x'][:3]), [0., 7., 2.])
+
+
+class TestDataFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_2()
+        self.ds.createVariable('x', 'f8', ('x',))[:] = numpy.arange(13)
+        self.cache = ReprCache()
+        self.text = VardataAsFlatTextFiles(block_size=5, cache=self.cache)
+        self.csv = VardataAsCsvFiles(block_size=5, cache=self.cache)
+        self.ncfs = NCFS(self.ds, self.text, AttributesAsTextFiles(),
+                         DimNamesAsTextFiles(), data_reprs=[
+                             ('DATA.txt', self.text),
+                             ('DATA.csv', self.csv),
+                             ('DATA.bin', VardataAsBinaryFiles(self.cache))])
+
+    def tearDown(self):
+        self.ds.close()
+
+    def read(self, path):
+        size = self.ncfs.getattr(path)['st_size']
+        return self.ncfs.read(path, size, 0)
+
+    def test_listing_data_files(self):
+        self.assertEqual(self.ncfs.readdir('/field'),
+                         ['.', '..', 'DATA_REPR', 'DATA.txt', 'DATA.csv',
+                          'DATA.bin', 'DIMENSIONS'])
+        self.assertEqual(self.ncfs.kind('/field/DATA.bin'), VAR_DATA)
+        self.assertFalse(self.ncfs.exists('/field/DATA.npy'))
+        self.assertFalse(self.ncfs.exists('/nosuchvar/DATA.bin'))
+
+    def test_reading_data_files(self):
+        field = self.ds['field'][:]
+        self.assertEqual(self.read('/field/DATA.txt'),
+                         self.read('/field/DATA_REPR'))
+        self.assertEqual(bytes(self.read('/field/DATA.bin')),
+                         field.tobytes())
+        rows = self.read('/field/DATA.csv').splitlines()
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[2].split(','),
+                         ['%f' % value for value in field[2]])
+        self.assertEqual(self.read('/x/DATA.csv'),
+                         self.read('/x/DATA_REPR'))
+
+    def test_csv_reads_at_any_offset(self):
+        full = self.csv(self.ds['field'])
+        self.assertEqual(self.csv.size(self.ds['field']), len(full))
+        for offset in (0, 7, 100, len(full) - 3):
+            self.assertEqual(self.csv.read(self.ds['field'], 50, offset),
+                             full[offset:offset+50])
+
+    def test_editing_csv_keeps_shared_index(self):
+        self.read('/x/DATA_REPR')
+        mtimes = [self.ncfs.getattr(path)['st_mtime']
+                  for path in ('/x/DATA_REPR', '/x/DATA.csv', '/x/DATA.bin')]
+        time.sleep(0.01)
+        fh = self.ncfs.open('/x/DATA.csv', os.O_WRONLY)
+        self.ncfs.write('/x/DATA.csv', '9', 0, fh)
+        self.ncfs.release('/x/DATA.csv', fh)
+        self.assertEqual(self.ds['x'][0], 9.)
+        # all data files of the Variable are modified
+        for path, mtime in zip(('/x/DATA_REPR', '/x/DATA.csv', '/x/DATA.bin'),
+                               mtimes):
+            self.assertGreater(self.ncfs.getattr(path)['st_mtime'], mtime)
+        key = self.text._index_key()
+        self.assertEqual(self.csv._index_key(), key)
+        self.assertIsNotNone(self.cache.get(self.ds['x'], key))
+        self.assertEqual(self.read('/x/DATA_REPR').split('\n')[0],
+                         '9.000000')
+
+    def test_binary_data_files_cannot_be_edited(self):
+        for flags in (os.O_WRONLY, os.O_RDWR, os.O_WRONLY | os.O_TRUNC):
+            with self.assertRaises(FuseOSError) as cm:
+                self.ncfs.open('/x/DATA.bin', flags)
+            self.assertEqual(cm.exception.errno, errno.EACCES)
+        fh = self.ncfs.open('/x/DATA.bin', os.O_RDONLY)
+        self.ncfs.release('/x/DATA.bin', fh)
+
+    def test_cache_invalidation_keeping_entries(self):
+        var = self.ds['x']
+        self.cache.put(var, 'a', b'1')
+        self.cache.put(var, 'b', b'2')
+        self.cache.invalidate(var, keep=('a',))
+        self.assertEqual(self.cache.get(var, 'a'), b'1')
+        self.assertIsNone(self.cache.get(var, 'b'))
+
+
+class TestNpyRepr(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_3()
+        self.plugin = VardataAsNpyFiles()
+        self.var = self.ds['temp']
+        self.full = self.plugin(self.var)
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_loading_npy(self):
+        data = numpy.load(io.BytesIO(self.full))
+        self.assertEqual(data.dtype, numpy.dtype('f4'))
+        self.assertEqual(data.shape, (3, 2, 2, 3))
+        self.assertTrue((data == self.var[:]).all())
+        self.assertEqual(self.plugin.size(self.var), len(self.full))
+
+    def test_data_is_aligned(self):
+        header = self.plugin._header(self.var)
+        self.assertEqual(len(header) % 64, 0)
+        self.assertEqual(self.full[len(header):],
+                         self.var[:].tobytes())
+
+    def test_reading_in_chunks(self):
+        for chunk in (1, 10, 100, 1000):
+            parts = []
+            offset = 0
+            while True:
+                part = bytes(self.plugin.read(self.var, chunk, offset))
+                if not part:
+                    break
+                parts.append(part)
+                offset += len(part)
+            self.assertEqual(b''.join(parts), self.full)
+
+    def test_memory_mapping_a_slice(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'temp.npy')
+            var_slice = VariableSlice(self.var, (1,))
+            with open(path, 'wb') as f:
+                f.write(self.plugin.read(var_slice, 10**6, 0))
+            data = numpy.load(path, mmap_mode='r')
+            self.assertEqual(data.shape, (2, 2, 3))
+            self.assertTrue((data == self.var[1]).all())
+            del data
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+def create_packed_dataset():
+    ds = Dataset('packed.nc', mode='w', diskless=True, persist=False)
+    ds.createDimension('t', 2)
+    ds.createDimension('x', 3)
+    var = ds.createVariable('tas', 'i2', ('t', 'x'))
+    var.scale_factor = 0.5
+    var.add_offset = 100.
+    var[:] = [[100., 101., 102.], [103., 104., 105.]]
+    return ds
+
+
+class TestPackedData(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_packed_dataset()
+        self.var = self.ds['tas']
+        self.cache = ReprCache()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(cache=self.cache),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                         data_reprs=[('DATA.bin',
+                                      VardataAsBinaryFiles(self.cache))])
+
+    def tearDown(self):
+        self.ds.close()
+
+    def read(self, path):
+        size = self.ncfs.getattr(path)['st_size']
+        data = self.ncfs.read(path, size, 0)
+        if isinstance(data, str):
+            data = data.encode()
+        return bytes(data)
+
+    def test_listing_raw_and_scaled_files(self):
+        self.assertEqual(self.ncfs.readdir('/tas')[-7:],
+                         ['DATA_REPR', 'DATA.bin', 'DATA_RAW',
+                          'DATA_RAW.bin', 'DATA_SCALED', 'DATA_SCALED.bin',
+                          'DIMENSIONS'])
+        self.assertFalse(self.ncfs.exists('/tas/DATA_RAW.npy'))
+
+    def test_raw_and_scaled_data(self):
+        raw = numpy.frombuffer(self.read('/tas/DATA_RAW.bin'), 'i2')
+        self.assertEqual(list(raw), [0, 2, 4, 6, 8, 10])
+        scaled = numpy.frombuffer(self.read('/tas/DATA_SCALED.bin'), 'f8')
+        self.assertEqual(list(scaled), [100., 101., 102., 103., 104., 105.])
+        self.assertEqual(self.read('/tas/DATA_RAW').split(b'\n')[1],
+                         b'2.000000')
+        self.assertEqual(self.read('/tas/DATA_REPR'),
+                         self.read('/tas/DATA_SCALED'))
+        # unpacking of the Variable itself is not changed
+        self.assertTrue(self.var.scale)
+
+    def test_packed_mount(self):
+        self.ds.set_auto_scale(False)
+        self.assertEqual(self.read('/tas/DATA.bin'),
+                         self.read('/tas/DATA_RAW.bin'))
+        scaled = numpy.frombuffer(self.read('/tas/DATA_SCALED.bin'), 'f8')
+        self.assertEqual(scaled[-1], 105.)
+        self.assertFalse(self.var.scale)
+
+    def test_views_are_invalidated_with_variable(self):
+        self.read('/tas/DATA_RAW.bin')
+        self.ncfs.invalidate('/tas/add_offset')
+        self.var.add_offset = 0.
+        scaled = numpy.frombuffer(self.read('/tas/DATA_SCALED.bin'), 'f8')
+        self.assertEqual(list(scaled), [0., 1., 2., 3., 4., 5.])
+        raw = numpy.frombuffer(self.read('/tas/DATA_RAW.bin'), 'i2')
+        self.assertEqual(list(raw), [0, 2, 4, 6, 8, 10])
+
+    def test_cache_groups_views_with_variable(self):
+        raw = ScaledVariable(self.var, False)
+        self.assertEqual(raw, ScaledVariable(self.var, False))
+        self.assertNotEqual(raw, ScaledVariable(self.var, True))
+        self.cache.put(VariableSlice(raw, (0,)), 'a', b'1')
+        self.cache.invalidate(self.var)
+        self.assertEqual(self.cache.nbytes, 0)
+
+
+def create_masked_dataset():
+    ds = Dataset('masked.nc', mode='w', diskless=True, persist=False)
+    ds.createDimension('t', 2)
+    ds.createDimension('x', 3)
+    var = ds.createVariable('pr', 'f4', ('t', 'x'), fill_value=-999.)
+    var[:] = numpy.ma.masked_array([[1., 2., 3.], [4., 5., 6.]],
+                                   mask=[[0, 1, 0], [0, 0, 1]])
+    x = ds.createVariable('x', 'i4', ('x',), fill_value=-1)
+    x[:] = numpy.ma.masked_array([10, 20, 30], mask=[0, 1, 0])
+    return ds
+
+
+class TestMissingValues(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_masked_dataset()
+        self.var = self.ds['pr']
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_fill_values(self):
+        text = VardataAsFlatTextFiles(fmt='%g')(self.var)
+        self.assertEqual(text, '1\n-999\n3\n4\n5\n-999\n')
+        binary = VardataAsBinaryFiles().read(self.var, 100, 0)
+        self.assertEqual(list(numpy.frombuffer(binary, 'f4')),
+                         [1., -999., 3., 4., 5., -999.])
+
+    def test_nan(self):
+        plugin = VardataAsFlatTextFiles(fmt='%g', missing='nan')
+        self.assertEqual(plugin(self.var), '1\nnan\n3\n4\n5\nnan\n')
+        self.assertEqual(plugin.size(self.var), len(plugin(self.var)))
+        binary = VardataAsBinaryFiles(missing='nan').read(self.var, 100, 0)
+        self.assertTrue(numpy.isnan(numpy.frombuffer(binary, 'f4')[1]))
+
+    def test_empty_fields(self):
+        plugin = VardataAsCsvFiles(fmt='%g', missing='empty')
+        self.assertEqual(plugin(self.var), '1,,3\n4,5,\n')
+        self.assertEqual(plugin.read(self.var, 4, 3), '3\n4,')
+
+    def test_fixed_width_layout_is_kept(self):
+        plugin = VardataAsFlatTextFiles(fmt='%+14.6e', missing='nan')
+        text = plugin(self.var)
+        self.assertEqual(text.split('\n')[1], ' ' * 11 + 'nan')
+        self.assertEqual(plugin.size(self.var), len(text))
+        self.assertEqual(plugin.read(self.var, 15, 15), text[15:30])
+
+    def test_writing_missing_values(self):
+        plugin = VardataAsFlatTextFiles(missing='empty')
+        plugin.update(self.ds['x'], b'\n1\n\n')
+        self.assertEqual(self.ds['x'][:].tolist(), [None, 1, None])
+        plugin = VardataAsFlatTextFiles(missing='nan')
+        plugin.patch(self.var, [(0, b'nan'.ljust(8))])
+        self.assertTrue(numpy.ma.is_masked(self.var[0, 0]))
+        with self.assertRaises(FuseOSError):
+            plugin.update(self.ds['x'], b'1\nfoo\n3\n')
+
+    def test_rendering_in_windows(self):
+        windows = []
+
+        def reader(variable, start, stop):
+            windows.append(stop - start)
+            return read_flat(variable, start, stop)
+        plugin = VardataAsFlatTextFiles(fmt='%g', block_size=1,
+                                        missing='nan', reader=reader)
+        self.assertEqual(plugin(self.var), '1\nnan\n3\n4\n5\nnan\n')
+        self.assertEqual(max(windows), 6)
+        plugin.size(self.var)
+        windows[:] = []
+        plugin.read(self.var, 2, 2)
+        self.assertEqual(max(windows), 1)
+
+
+def decode_png(image):
+    """ Return (width, height, palette indices) of a PNG image """
+    assert image[:8] == b'\x89PNG\r\n\x1a\n'
+    offset = 8
+    chunks = {}
+    while offset < len(image):
+        length, tag = struct.unpack('>I4s', image[offset:offset+8])
+        data = image[offset+8:offset+8+length]
+        crc, = struct.unpack('>I', image[offset+8+length:offset+12+length])
+        assert zlib.crc32(tag + data) & 0xffffffff == crc
+        chunks[tag] = data
+        offset += length + 12
+    width, height = struct.unpack('>II', chunks[b'IHDR'][:8])
+    rows = numpy.frombuffer(zlib.decompress(chunks[b'IDAT']), numpy.uint8)
+    return width, height, rows.reshape(height, width + 1)[:, 1:]
+
+
+class TestPngRepr(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_3()
+        self.var = self.ds['temp']
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_images_cannot_be_written(self):
+        png = VardataAsPngFiles()
+        ncfs = NCFS(self.ds, VardataAsFlatTextFiles(), AttributesAsTextFiles(),
+                    DimNamesAsTextFiles(), data_reprs=[('DATA.png', png)])
+        for flags in (os.O_WRONLY, os.O_RDWR, os.O_WRONLY | os.O_TRUNC):
+            with self.assertRaises(FuseOSError) as cm:
+                ncfs.open('/temp/DATA.png', flags)
+            self.assertEqual(cm.exception.errno, errno.EACCES)
+        # nor without opening them first
+        with self.assertRaises(FuseOSError) as cm:
+            ncfs.write('/temp/DATA.png', b'x', 0)
+        self.assertEqual(cm.exception.errno, errno.EACCES)
+        with self.assertRaises(FuseOSError) as cm:
+            ncfs.truncate('/temp/DATA.png', 0)
+        self.assertEqual(cm.exception.errno, errno.EACCES)
+        self.assertEqual(self.var[:].tolist(),
+                         numpy.arange(36).reshape(3, 2, 2, 3).tolist())
+
+    def test_encoding(self):
+        indices = numpy.array([[0, 1], [2, 255]], dtype=numpy.uint8)
+        image = encode_png(indices, [(0, 0, 0)] * 256, [255] * 255 + [0])
+        width, height, pixels = decode_png(image)
+        self.assertEqual((width, height), (2, 2))
+        self.assertEqual(pixels.tolist(), indices.tolist())
+
+    def test_first_slab_is_rendered(self):
+        plugin = VardataAsPngFiles()
+        width, height, pixels = decode_png(plugin(self.var))
+        self.assertEqual((width, height), (3, 2))
+        self.assertEqual(pixels.tolist(), [[0, 51, 102], [152, 203, 254]])
+        var_slice = VariableSlice(self.var, (2, 1))
+        _, _, pixels = decode_png(plugin(var_slice))
+        self.assertEqual(pixels.tolist(), [[0, 51, 102], [152, 203, 254]])
+
+    def test_size_does_not_encode_again(self):
+        reads = []
+
+        def reader(variable, start, stop):
+            reads.append((start, stop))
+            return read_flat(variable, start, stop)
+        plugin = VardataAsPngFiles(reader=reader)
+        size = plugin.size(self.var)
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(len(plugin.read(self.var, size, 0)), size)
+        self.assertEqual(plugin.read(self.var, 4, 1), b'PNG\r')
+        self.assertEqual(len(reads), 1)
+        plugin.invalidate(self.var)
+        plugin.size(self.var)
+        self.assertEqual(len(reads), 2)
+
+    def test_subsampling_and_missing_values(self):
+        ds = create_masked_dataset()
+        try:
+            plugin = VardataAsPngFiles(max_side=2)
+            width, height, pixels = decode_png(plugin(ds['pr']))
+            self.assertEqual((width, height), (2, 1))
+            self.assertEqual(pixels.tolist(), [[0, 254]])
+            _, _, pixels = decode_png(VardataAsPngFiles()(ds['pr']))
+            self.assertEqual(pixels[:, 1].tolist(), [255, 254])
+        finally:
+            ds.close()
+
+    def test_rows_are_flipped_if_latitude_increases(self):
+        ds = Dataset('lat.nc', mode='w', diskless=True, persist=False)
+        try:
+            ds.createDimension('lat', 2)
+            ds.createVariable('lat', 'f4', ('lat',))[:] = [-45., 45.]
+            var = ds.createVariable('v', 'f4', ('lat',))
+            var[:] = [0., 1.]
+            var.valid_range = [0., 2.]
+            ds.createDimension('lon', 1)
+            var2 = ds.createVariable('v2', 'f4', ('lat', 'lon'))
+            var2[:] = [[0.], [1.]]
+            plugin = VardataAsPngFiles()
+            _, _, pixels = decode_png(plugin(var2))
+            self.assertEqual(pixels.tolist(), [[254], [0]])
+            _, _, pixels = decode_png(plugin(var))
+            self.assertEqual(pixels.tolist(), [[0, 127]])
+        finally:
+            ds.close()
+
+    def test_data_cannot_be_written(self):
+        with self.assertRaises(NotImplementedError):
+            VardataAsPngFiles().update(self.var, b'')
+
+
+class TestSavedIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.tmpdir, 'index')
+        self.path = os.path.join(self.tmpdir, 'test.nc')
+        ds = Dataset(self.path, mode='w')
+        ds.createDimension('x', 100)
+        ds.createVariable('x', 'f8', ('x',))[:] = numpy.arange(100) * 10.
+        ds.close()
+        self.ds = Dataset(self.path, mode='r')
+        self.reads = []
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir)
+
+    def plugin(self):
+        def reader(variable, start, stop):
+            self.reads.append((start, stop))
+            return read_flat(variable, start, stop)
+        return VardataAsFlatTextFiles(block_size=8, reader=reader,
+                                      index_dir=self.index_dir)
+
+    def test_index_is_saved_and_loaded(self):
+        var = self.ds['x']
+        text = VardataAsFlatTextFiles()(var)
+        size = self.plugin().size(var)
+        self.assertEqual(size, len(text))
+        self.assertEqual(len(os.listdir(self.index_dir)), 1)
+        # a new plugin (e.g. of the next mount) reads only what it renders
+        self.reads[:] = []
+        plugin = self.plugin()
+        self.assertEqual(plugin.size(var), size)
+        self.assertEqual(self.reads, [])
+        self.assertEqual(plugin.read(var, 20, 500), text[500:520])
+        self.assertEqual(len(self.reads), 1)
+
+    def test_index_of_changed_file_is_not_used(self):
+        var = self.ds['x']
+        plugin = self.plugin()
+        plugin.size(var)
+        # changed Variable is not looked up, and its index not saved
+        plugin.invalidate(var)
+        self.assertIsNone(plugin._sidecar_path(var))
+        path = plugin._sidecar_path(VariableSlice(var, ()))
+        self.assertIsNone(path)
+        # nor are indexes of files modified since
+        old_path = self.plugin()._sidecar_path(var)
+        self.ds.close()
+        ds = Dataset(self.path, mode='a')
+        ds['x'][0] = 1000000.
+        ds.close()
+        os.utime(self.path, (0, 0))
+        self.ds = Dataset(self.path, mode='r')
+        self.assertNotEqual(self.plugin()._sidecar_path(self.ds['x']),
+                            old_path)
+        self.assertEqual(self.plugin().size(self.ds['x']),
+                         len(VardataAsFlatTextFiles()(self.ds['x'])))
+
+    def test_stale_indexes_are_removed(self):
+        self.plugin().size(self.ds['x'])
+        old_path = self.plugin()._sidecar_path(self.ds['x'])
+        self.assertTrue(os.path.exists(old_path))
+        self.ds.close()
+        os.utime(self.path, (0, 0))
+        self.ds = Dataset(self.path, mode='r')
+        self.plugin().size(self.ds['x'])
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(os.listdir(self.index_dir), [
+            os.path.basename(self.plugin()._sidecar_path(self.ds['x']))])
+
+    def test_temporary_file_removed_if_saving_fails(self):
+        plugin = self.plugin()
+        plugin._save_index(numpy.arange(3), os.path.join(
+            self.index_dir, 'nosuchdir', 'index.npy'))
+        self.assertEqual(os.listdir(self.index_dir), [])
+
+    def test_invalid_index_is_ignored(self):
+        var = self.ds['x']
+        plugin = self.plugin()
+        path = plugin._sidecar_path(var)
+        os.makedirs(self.index_dir)
+        with open(path, 'wb') as f:
+            f.write(b'not an index')
+        self.assertEqual(plugin.size(var),
+                         len(VardataAsFlatTextFiles()(var)))
+        self.assertEqual(len(numpy.load(path)), 100 // 8 + 2)
+
+    def test_in_memory_datasets_are_not_indexed(self):
+        ds = create_test_dataset_3()
+        try:
+            self.assertIsNone(self.plugin()._sidecar_path(ds['temp']))
+        finally:
+            ds.close()
+
+
+class TestClosingFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'classic.nc')
+        create_classic_dataset(self.path, 'NETCDF3_CLASSIC').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plugins_forget_closed_variables(self):
+        cache = ReprCache()
+        text = VardataAsFlatTextFiles(cache=cache, index_dir=self.tmpdir)
+        binary = VardataAsBinaryFiles(cache=cache)
+        png = VardataAsPngFiles(cache=cache)
+        for _ in range(3):
+            ncfs = NCFS(Dataset(self.path, 'r+'), text,
+                        AttributesAsTextFiles(), DimNamesAsTextFiles(),
+                        data_reprs=[('DATA.bin', binary), ('DATA.png', png)])
+            for path in ('/fixed/DATA_REPR', '/fixed/DATA.bin',
+                         '/fixed/DATA.png'):
+                ncfs.read(path, 100, 0)
+            ncfs.invalidate('/fixed/DATA_REPR')
+            ncfs.close()
+        self.assertEqual(text._changed, set())
+        self.assertEqual(png._versions, {})
+        self.assertEqual(binary._file_maps, {})
+        self.assertEqual(cache.nbytes, 0)
+
+
+class TestAttributeWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = create_test_dataset_1()
+        self.ncfs = NCFS(self.ds, VardataAsFlatTextFiles(),
+                         AttributesAsTextFiles(), DimNamesAsTextFiles())
+
+    def tearDown(self):
+        self.ds.close()
+
+    def write(self, path, chunks, truncate=False):
+        fh = self.ncfs.open(path, os.O_WRONLY)
+        if truncate:
+            self.ncfs.truncate(path, 0, fh)
+        offset = 0
+        for chunk in chunks:
+            self.ncfs.write(path, chunk, offset, fh)
+            offset += len(chunk)
+        return fh
+
+    def test_writes_are_set_on_release(self):
+        fh = self.write('/foovar/fooattr', ['x', 'yz', 'w'], truncate=True)
+        self.assertEqual(self.ds['foovar'].getncattr('fooattr'), 'abc')
+        self.ncfs.release('/foovar/fooattr', fh)
+        self.assertEqual(self.ds['foovar'].getncattr('fooattr'), 'xyzw')
+        fh = self.write('/attr1', ['new'])
+        self.ncfs.release('/attr1', fh)
+        self.assertEqual(self.ds.getncattr('attr1'), 'newrval1')
+
+    def count_flushes(self):
+        """ Return list, to which attributes written at once are added """
+        flushes = []
+        write_attrs = self.ncfs.write_attrs
+
+        def counted():
+            if self.ncfs._pending_attrs:
+                flushes.append(dict(self.ncfs._pending_attrs))
+            return write_attrs()
+        self.ncfs.write_attrs = counted
+        return flushes
+
+    def test_truncate_open_write_release_flushes_once(self):
+        flushes = self.count_flushes()
+        # e.g. echo degC > foovar/fooattr, mounted with atomic_o_trunc
+        fh = self.ncfs.open('/foovar/fooattr', os.O_WRONLY | os.O_TRUNC)
+        self.ncfs.write('/foovar/fooattr', 'degC\n', 0, fh)
+        self.assertEqual(flushes, [])
+        self.ncfs.release('/foovar/fooattr', fh)
+        self.assertEqual(flushes,
+                         [{(VAR_DIR, 'foovar'): {'fooattr': 'degC'}}])
+        self.assertEqual(self.ds['foovar'].getncattr('fooattr'), 'degC')
+        # truncated through the file handle (e.g. ftruncate(2))
+        fh = self.write('/attr1', ['x'], truncate=True)
+        self.ncfs.release('/attr1', fh)
+        self.assertEqual(len(flushes), 2)
+        self.assertEqual(self.ds.getncattr('attr1'), 'x')
+
+    def test_created_attribute(self):
+        fh = self.ncfs.create('/foovar/units', 0o100644)
+        self.ncfs.write('/foovar/units', 'K\n', 0, fh)
+        self.ncfs.release('/foovar/units', fh)
+        self.assertEqual(self.ds['foovar'].getncattr('units'), 'K')
+
+    def test_batched_attributes(self):
+        self.ncfs.attr_batch = 60
+        self.ncfs.release('/foovar/fooattr',
+                          self.write('/foovar/fooattr', ['one']))
+        fh = self.ncfs.create('/foovar/units', 0o100644)
+        self.ncfs.write('/foovar/units', 'K', 0, fh)
+        self.ncfs.release('/foovar/units', fh)
+        # not written yet, but presented
+        self.assertEqual(self.ds['foovar'].ncattrs(), ['fooattr'])
+        self.assertEqual(self.ncfs.read('/foovar/units', 10, 0), 'K\n')
+        self.assertEqual(self.ncfs.getattr('/foovar/fooattr')['st_size'], 4)
+        self.ncfs.fsync('/foovar/units', False)
+        self.assertEqual(self.ds['foovar'].getncattr('fooattr'), 'one')
+        self.assertEqual(self.ds['foovar'].getncattr('units'), 'K')
+        self.assertIsNone(self.ncfs._attr_timer)
+
+    def test_batched_attributes_are_written_later(self):
+        self.ncfs.attr_batch = 0.01
+        self.ncfs.set_global_attr('/attr1', 'later')
+        for _ in range(100):
+            if self.ds.getncattr('attr1') == 'later':
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.ds.getncattr('attr1'), 'later')
+
+    def test_failed_attributes_reported_by_fsync(self):
+        self.ncfs.attr_batch = 60
+        self.ncfs.set_var_attr('/foovar/' + 'x' * 300, 'too long name')
+        self.ncfs.set_var_attr('/foovar/fooattr', 'one')
+        self.ncfs.set_global_attr('/attr1', 'two')
+        with self.assertRaises(FuseOSError) as cm:
+            self.ncfs.fsync('/attr1', False)
+        self.assertEqual(cm.exception.errno, errno.EIO)
+        # attributes of other owners are written nevertheless,
+        # and the snapshot shows what the file holds
+        self.assertEqual(self.ds.getncattr('attr1'), 'two')
+        self.assertFalse(self.ncfs.exists('/foovar/' + 'x' * 300))
+        self.assertEqual(self.ncfs.get_var_attr('/foovar/fooattr'),
+                         self.ds['foovar'].getncattr('fooattr'))
+        # reported once
+        self.assertEqual(self.ncfs.fsync('/attr1', False), 0)
+
+    def test_failed_attribute_reported_at_once(self):
+        with self.assertRaises(FuseOSError) as cm:
+            self.ncfs.set_global_attr('/' + 'x' * 300, 'too long name')
+        self.assertEqual(cm.exception.errno, errno.EIO)
+        self.assertFalse(self.ncfs.exists('/' + 'x' * 300))
+        self.assertEqual(self.ncfs.fsync('/', False), 0)
+
+    def test_attributes_affecting_data_are_not_delayed(self):
+        self.ncfs.attr_batch = 60
+        self.ncfs.set_var_attr('/foovar/scale_factor', '2')
+        self.assertEqual(self.ds['foovar'].getncattr('scale_factor'), '2')